@@ -0,0 +1,237 @@
+'''This script times the Python hot paths of the pipeline on generated inputs of increasing size and fails if
+time or memory regresses beyond a threshold compared to a stored baseline'''
+
+import os
+import sys
+import json
+import gzip
+import shutil
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from datetime import datetime
+from sys import stderr
+from tempfile import mkdtemp
+from time import perf_counter, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/"
+sys.path.insert(0, ROOT + "utilities")
+sys.path.insert(0, ROOT + "bin")
+# Import commonUtil before modules which import it
+import commonUtil
+from sample import Sample
+
+CONTIGS = 25
+HEADER = "##fileformat=VCFv4.2\n"
+
+def vcfText(n, contigs = CONTIGS):
+	# Returns vcf with n records spread over contigs
+	lines = [HEADER]
+	for i in range(contigs):
+		lines.append(("##contig=<ID=chr{},length=250000000>\n").format(i+1))
+	lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tTUMOR\tNORMAL\n")
+	per = max(1, n // contigs)
+	for i in range(n):
+		lines.append(("chr{}\t{}\t.\tA\tG\t.\tPASS\tDP=40\tGT:AD:DP\t0/1:30,10:40\t0/0:40,0:40\n").format(i // per % contigs + 1, (i % per + 1) * 100))
+	return "".join(lines)
+
+def writeFile(outfile, text):
+	# Writes text to file and returns path
+	with open(outfile, "w") as out:
+		out.write(text)
+	return outfile
+
+#-------------------------------------Cases-----------------------------------
+
+def getTotalPlain(tmp, n):
+	# Counts records of plain vcf
+	vcf = writeFile(tmp + "total.vcf", vcfText(n))
+	return None, lambda: commonUtil.getTotal(vcf)
+
+def getTotalGZ(tmp, n):
+	# Counts records of gzipped vcf
+	vcf = tmp + "total.vcf.gz"
+	with gzip.open(vcf, "wt") as out:
+		out.write(vcfText(n))
+	return None, lambda: commonUtil.getTotal(vcf)
+
+def sampleReheader(tmp, n):
+	# Inserts info line into header of mutect output
+	src = writeFile(tmp + "source.vcf", vcfText(n))
+	s = Sample()
+	s.Output = tmp + "A.vcf"
+	return lambda: shutil.copy(src, s.Output), s.__reheader__
+
+def comparisonReheader(tmp, n):
+	# Replaces contig lines of platypus output with contigs from a fasta index
+	import pipelineComparison
+	from vcfHeader import readContigs
+	src = writeFile(tmp + "platypus.vcf", vcfText(n))
+	fai = writeFile(tmp + "ref.fa.fai", "".join([("chr{}\t250000000\t0\t60\t61\n").format(i+1) for i in range(CONTIGS)]))
+	contigs = readContigs(fai)
+	os.makedirs(tmp + "out", exist_ok = True)
+	return None, lambda: pipelineComparison.reheader(contigs, src, tmp + "out/")
+
+def getManifest(tmp, n):
+	# Reads manifest of n samples
+	import mutect2Parallel
+	bams = [writeFile(tmp + i + ".bam", "") for i in ["N", "A", "B"]]
+	infile = writeFile(tmp + "manifest.txt", "".join([("S{}\t{}\t{}\t{}\n").format(i, *bams) for i in range(n)]))
+	return None, lambda: mutect2Parallel.getManifest(infile, False)
+
+def checkOutput(tmp, n):
+	# Replays n events from state database
+	from runState import RunState
+	outdir = tmp + "S1/"
+	os.makedirs(outdir, exist_ok = True)
+	state = RunState(outdir)
+	conn = state.__connect__()
+	steps = ["mutect", "filtering_germline", "isec1", "filtering_covB", "filtering_forB", "isec2", "filtering_NAB", "isec3"]
+	rows = []
+	for i in range(n):
+		sample = ["A", "B"][i % 2]
+		rows.append((state.ID, sample, sample, steps[i // 2 % len(steps)], ["starting", "complete"][i % 2], outdir + sample + ".vcf", time()))
+	conn.executemany("INSERT INTO events (pair, sample, name, step, status, output, time) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+	conn.close()
+	return None, lambda: commonUtil.checkOutput(outdir, prnt = False)
+
+def getFinished(tmp, n):
+	# Reads keys of n completed comparisons
+	from compareNormals import Finished
+	header = "SampleType,Sample,Normal,PrivateSample,PrivateNormal,Common,%Similarity\n"
+	infile = writeFile(tmp + "normalsComparison.csv", header + "".join([("N,S{},S{},10,12,30,57.69%\n").format(i, i+1) for i in range(n)]))
+	return None, lambda: Finished(infile)
+
+def filterVariants(tmp, n):
+	# Matches n calls against sets of confirmed variants (the xlsx file is replaced by sets built here)
+	from filterVariants import KEYS, VariantsFilter
+	rows = []
+	for i in range(n):
+		rows.append(("DCIS_{},{},chr{},{},{},{},{}").format(i % 50, "Yes" if i % 2 else "No", i % 22 + 1, i * 10, i * 10, "ACGT"[i % 4], "TGCA"[i % 4]))
+	infile = writeFile(tmp + "calls.csv", ",".join(KEYS) + "\n" + "\n".join(rows) + "\n")
+	f = VariantsFilter.__new__(VariantsFilter)
+	f.infile = infile
+	f.chunksize = 100000
+	f.variants = {}
+	f.outfiles = {}
+	for idx, name in enumerate(["ampliseq", "stringent", "relaxed"]):
+		f.variants[name] = set([tuple(r.split(",")) for r in rows[idx::10]])
+		f.outfiles[name] = ("{}{}.csv").format(tmp, name)
+	return None, f.filterVariants
+
+# Name, function which writes inputs and returns reset and run functions, and units of size
+CASES = [["getTotal", getTotalPlain, "records"], ["getTotal.gz", getTotalGZ, "records"],
+	["Sample.__reheader__", sampleReheader, "records"], ["pipelineComparison.reheader", comparisonReheader, "records"],
+	["getManifest", getManifest, "samples"], ["checkOutput", checkOutput, "events"],
+	["Finished.__getFinished__", getFinished, "rows"], ["VariantsFilter.filterVariants", filterVariants, "rows"]]
+
+#-----------------------------------------------------------------------------
+
+def measure(setup, n, repeat):
+	# Returns best time and peak traced memory of one case
+	tmp = mkdtemp(prefix = "microBenchmark.") + "/"
+	try:
+		reset, func = setup(tmp, n)
+		best = None
+		with open(os.devnull, "w") as dn, redirect_stdout(dn):
+			for _ in range(repeat):
+				if reset:
+					reset()
+				start = perf_counter()
+				func()
+				elapsed = perf_counter() - start
+				if best is None or elapsed < best:
+					best = elapsed
+			# Measure memory separately so tracing does not slow timed runs
+			if reset:
+				reset()
+			tracemalloc.start()
+			func()
+			_, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+	finally:
+		shutil.rmtree(tmp, ignore_errors = True)
+	return best, peak / 1024
+
+def runCases(names, sizes, repeat):
+	# Returns list of results for each case and size
+	ret = []
+	for name, setup, unit in CASES:
+		if names and name not in names:
+			continue
+		for n in sizes:
+			try:
+				seconds, peak = measure(setup, n, repeat)
+			except ImportError as e:
+				print(("\t[Warning] Skipping {} ({}).").format(name, e), file=stderr)
+				break
+			ret.append({"case": name, "size": n, "unit": unit, "seconds": seconds, "peak_kb": peak})
+			print(("\t{}\t{:,d} {}\t{:.4f}s\t{:,.0f} Kb").format(name, n, unit, seconds, peak), flush = True)
+	return ret
+
+def compareResults(results, baseline, threshold, memory, floor):
+	# Returns list of regressions against baseline results
+	ret = []
+	base = dict([((i["case"], i["size"]), i) for i in baseline["results"]])
+	for i in results:
+		key = (i["case"], i["size"])
+		if key in base.keys():
+			b = base[key]
+			if i["seconds"] > b["seconds"] * (1 + threshold) and i["seconds"] - b["seconds"] > floor:
+				ret.append(("{} ({:,d}): time {:.4f}s -> {:.4f}s (+{:.0%})").format(i["case"], i["size"], b["seconds"], i["seconds"], i["seconds"] / b["seconds"] - 1))
+			if i["peak_kb"] > b["peak_kb"] * (1 + memory) and i["peak_kb"] - b["peak_kb"] > 64:
+				ret.append(("{} ({:,d}): memory {:,.0f} Kb -> {:,.0f} Kb (+{:.0%})").format(i["case"], i["size"], b["peak_kb"], i["peak_kb"], i["peak_kb"] / b["peak_kb"] - 1))
+	return ret
+
+def main():
+	start = datetime.now()
+	parser = ArgumentParser("This script times the Python hot paths of the pipeline and compares them to a baseline.")
+	parser.add_argument("-o", help = "Path to output json of results.")
+	parser.add_argument("-b", help = "Path to baseline json to compare results to (exits with status 1 if there is a regression).")
+	parser.add_argument("-s", default = "1000,10000,100000", help = "Comma separated input sizes (default = 1000,10000,100000).")
+	parser.add_argument("-r", type = int, default = 3, help = "Number of timed runs of each case (the fastest is kept; default = 3).")
+	parser.add_argument("--cases", help = "Comma separated names of cases to run (default is all).")
+	parser.add_argument("--threshold", type = float, default = 0.25, help = "Fractional increase in time counted as a regression (default = 0.25).")
+	parser.add_argument("--memory", type = float, default = 0.25, help = "Fractional increase in peak memory counted as a regression (default = 0.25).")
+	parser.add_argument("--floor", type = float, default = 0.005, help = "Time increases smaller than this many seconds are ignored (default = 0.005).")
+	parser.add_argument("--list", action = "store_true", default = False, help = "Print names of cases and exit.")
+	args = parser.parse_args()
+	if args.list == True:
+		for i in CASES:
+			print(("\t{}").format(i[0]))
+		return
+	names = None
+	if args.cases:
+		names = [i.strip() for i in args.cases.split(",")]
+		for i in names:
+			if i not in [j[0] for j in CASES]:
+				print(("\n\t[Error] Unknown case {}. Exiting.\n").format(i), file=stderr)
+				quit()
+	baseline = None
+	if args.b:
+		if not os.path.isfile(args.b):
+			print(("\n\t[Error] Baseline {} not found. Exiting.\n").format(args.b), file=stderr)
+			quit()
+		with open(args.b, "r") as f:
+			baseline = json.load(f)
+	print("\n\tRunning micro-benchmarks...")
+	results = runCases(names, [int(i) for i in args.s.split(",")], args.r)
+	if args.o:
+		with open(args.o, "w") as out:
+			json.dump({"date": datetime.now().isoformat(), "python": platform.python_version(), "host": platform.node(),
+				"repeat": args.r, "results": results}, out, indent = 1)
+		print(("\n\tWrote {}").format(args.o))
+	if baseline:
+		regressions = compareResults(results, baseline, args.threshold, args.memory, args.floor)
+		if regressions:
+			print(("\n\t[Error] {} regressions against {}:").format(len(regressions), args.b), file=stderr)
+			for i in regressions:
+				print("\t" + i, file=stderr)
+			print(file=stderr)
+			sys.exit(1)
+		print(("\n\tNo regressions against {}.").format(args.b))
+	print(("\tFinished. Runtime: {}\n").format(datetime.now() - start))
+
+if __name__ == "__main__":
+	main()
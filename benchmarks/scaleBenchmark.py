@@ -0,0 +1,666 @@
+'''This script times mutect2Parallel, filterVCFs, compareNormals, and pipelineComparison end to end over synthetic cohorts
+using stub versions of the external tools so orchestration can be measured at scale without a cluster'''
+
+import os
+import json
+import gzip
+import random
+import resource
+import shutil
+import zlib
+from argparse import ArgumentParser
+from multiprocessing.pool import ThreadPool
+from shlex import quote
+from subprocess import Popen, DEVNULL
+from sys import argv, executable, stderr
+from time import sleep, time
+
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin") + "/"
+STAGES = ["mutect2Parallel", "filterVCFs", "compareNormals", "pipelineComparison"]
+# Stages which must run before each stage in the same run directory
+REQUIRES = {"filterVCFs": ["mutect2Parallel"], "pipelineComparison": ["mutect2Parallel", "filterVCFs"]}
+TOOLS = ["gatk", "picard", "java", "bcftools", "heterAnalyzer", "vcf2bed", "bedops"]
+# Default seconds each stubbed tool sleeps before writing output
+DELAYS = {"Mutect2": 1.0, "FilterMutectCalls": 0.2, "HaplotypeCaller": 0.2}
+DELAY_ENV = "SCALEBENCH_DELAYS"
+# heterAnalyzer defaults
+DEFAULTS = {"min_covB": 15, "max_altB": 0, "max_prop_altB": 0.0, "min_covN": 5, "max_reads_altN": 15, "max_freq_altN": 0.3}
+BATCH = "#!/bin/bash\n#SBATCH -t 1:0:0\n#SBATCH --job-name=scaleBenchmark\n"
+
+#------------------------------------Stubs------------------------------------
+
+def openVCF(infile):
+	# Returns text handle for plain or gzipped vcf
+	if infile.endswith(".gz"):
+		return gzip.open(infile, "rt")
+	return open(infile, "r")
+
+def readVCF(infile):
+	# Returns header lines and records of vcf
+	header = []
+	records = []
+	with openVCF(infile) as f:
+		for line in f:
+			if line[0] == "#":
+				header.append(line)
+			elif line.strip():
+				records.append(line.rstrip("\n").split("\t"))
+	return header, records
+
+def writeVCF(outfile, header, records, fmt = "v"):
+	# Writes vcf as plain text or bgzipped
+	tmp = outfile
+	if fmt == "z":
+		tmp = ("{}.{}.tmp").format(outfile, os.getpid())
+	with open(tmp, "w") as out:
+		out.writelines(header)
+		for i in records:
+			out.write("\t".join(i) + "\n")
+	if fmt == "z":
+		import pysam
+		pysam.tabix_compress(tmp, outfile, force = True)
+		os.remove(tmp)
+
+def siteKey(rec):
+	# Returns chromosome, position, ref, and alt of record
+	return (rec[0], rec[1], rec[3], rec[4])
+
+def sortRecords(header, records):
+	# Sorts records by contig order in header and position
+	order = {}
+	for line in header:
+		if line.startswith("##contig=<ID="):
+			order[line[13:line.find(",")]] = len(order)
+	return sorted(records, key = lambda x: (order.get(x[0], len(order)), int(x[1])))
+
+def option(args, flag, default = None):
+	# Returns value following flag in argument list
+	if flag in args:
+		idx = args.index(flag) + 1
+		if idx < len(args):
+			return args[idx]
+	return default
+
+def picardOption(args, key):
+	# Returns value of KEY=value picard argument
+	for idx, i in enumerate(args):
+		if i.startswith(key + "="):
+			if i == key + "=" and idx + 1 < len(args):
+				return args[idx+1]
+			return i[len(key)+1:]
+	return None
+
+def readTruth(bam):
+	# Returns set of sites in synthetic bam
+	ret = set()
+	infile = bam + ".truth.tsv"
+	if os.path.isfile(infile):
+		with open(infile, "r") as f:
+			for line in f:
+				s = line.strip().split("\t")
+				if len(s) == 4:
+					ret.add(tuple(s))
+	return ret
+
+def depth(bam, chrom, pos):
+	# Returns deterministic read depth of site in bam
+	return 10 + zlib.crc32(("{}:{}:{}").format(os.path.basename(bam), chrom, pos).encode()) % 50
+
+def toolSuccess():
+	# Prints gatk success message read by getStatus
+	print("Tool returned:\nSUCCESS")
+
+def mutect2(args):
+	# Writes calls for sites in tumor bam
+	bams = [args[i+1] for i in range(len(args)-1) if args[i] == "-I"]
+	outfile = option(args, "--output", option(args, "-O"))
+	tumor = option(args, "--tumor-sample", "TUMOR")
+	ref = option(args, "-R")
+	header = ["##fileformat=VCFv4.2\n", '##FILTER=<ID=PASS,Description="All filters passed">\n',
+		'##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n',
+		'##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">\n',
+		'##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">\n',
+		'##FORMAT=<ID=F1R2,Number=R,Type=Integer,Description="Count of reads in F1R2 pair orientation">\n',
+		'##FORMAT=<ID=F2R1,Number=R,Type=Integer,Description="Count of reads in F2R1 pair orientation">\n']
+	with open(ref + ".fai", "r") as f:
+		for line in f:
+			s = line.split("\t")
+			header.append(("##contig=<ID={},length={}>\n").format(s[0], s[1]))
+	header.append(("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\tNORMAL\n").format(tumor))
+	records = []
+	for chrom, pos, ref, alt in readTruth(bams[0]):
+		dp = depth(bams[0], chrom, pos)
+		records.append([chrom, pos, ".", ref, alt, ".", ".", ("DP={}").format(dp), "GT:AD:DP:F1R2:F2R1",
+			("0/1:{},{}:{}:{},{}:{},{}").format(dp - dp//3, dp//3, dp, dp//2, dp//6, dp//2, dp//6),
+			("0/0:{},0:{}:{},0:{},0").format(dp, dp, dp//2, dp//2)])
+	writeVCF(outfile, header, sortRecords(header, records))
+	bamout = option(args, "--bamout")
+	if bamout:
+		shutil.copy(bams[0], bamout)
+	toolSuccess()
+
+def filterMutectCalls(args):
+	# Marks a fraction of calls as germline risks
+	header, records = readVCF(option(args, "-V"))
+	for i in records:
+		if zlib.crc32(":".join(siteKey(i)).encode()) % 10 == 0:
+			i[6] = "germline_risk"
+		else:
+			i[6] = "PASS"
+	writeVCF(option(args, "-O"), header, records)
+	toolSuccess()
+
+def haplotypeCaller(args):
+	# Emits ref and alt depth of bam at every interval
+	bam = option(args, "-I")
+	truth = set([(i[0], i[1]) for i in readTruth(bam)])
+	records = []
+	with open(option(args, "--intervals"), "r") as f:
+		for line in f:
+			s = line.split()
+			if len(s) >= 3:
+				pos = str(int(s[1]) + 1)
+				dp = depth(bam, s[0], pos)
+				alt = dp//4 if (s[0], pos) in truth else 0
+				records.append([s[0], pos, ".", "N", "<NON_REF>", ".", ".", ".", "GT:AD", ("0/1:{},{}").format(dp - alt, alt)])
+	header = ["##fileformat=VCFv4.2\n", "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n"]
+	writeVCF(option(args, "-O"), header, records)
+	toolSuccess()
+
+def gatk(args):
+	# Dispatches gatk tool
+	tool = args[0] if args else ""
+	if tool == "Mutect2":
+		mutect2(args[1:])
+	elif tool == "FilterMutectCalls":
+		filterMutectCalls(args[1:])
+	elif tool == "HaplotypeCaller":
+		haplotypeCaller(args[1:])
+	elif tool in ["AddOrReplaceReadGroups", "CreateSequenceDictionary"]:
+		picard(args)
+	else:
+		toolSuccess()
+
+def picard(args):
+	# Copies bam for AddOrReplaceReadGroups
+	tool = args[0] if args else ""
+	if tool == "AddOrReplaceReadGroups":
+		shutil.copy(picardOption(args, "I"), picardOption(args, "O"))
+	toolSuccess()
+
+def java(args):
+	# Dispatches call to a jar by tool name
+	if "-jar" not in args:
+		return 1
+	idx = args.index("-jar") + 1
+	if "picard" in os.path.basename(args[idx]).lower():
+		picard(args[idx+1:])
+	else:
+		gatk(args[idx+1:])
+	return 0
+
+def bcftools(args):
+	# Emulates bcftools subcommands used by the pipeline
+	cmd = args[0]
+	args = args[1:]
+	files = [i for idx, i in enumerate(args) if i[0] != "-" and (idx == 0 or args[idx-1] not in ["-o", "-O", "-p", "-i", "-R"])]
+	fmt = option(args, "-O", "v")
+	if cmd == "isec":
+		outdir = option(args, "-p")
+		os.makedirs(outdir, exist_ok = True)
+		ha, a = readVCF(files[0])
+		hb, b = readVCF(files[1])
+		ka = set([siteKey(i) for i in a])
+		kb = set([siteKey(i) for i in b])
+		writeVCF(outdir + "/0000.vcf", ha, [i for i in a if siteKey(i) not in kb])
+		writeVCF(outdir + "/0001.vcf", hb, [i for i in b if siteKey(i) not in ka])
+		writeVCF(outdir + "/0002.vcf", ha, [i for i in a if siteKey(i) in kb])
+		writeVCF(outdir + "/0003.vcf", hb, [i for i in b if siteKey(i) in ka])
+		with open(outdir + "/README.txt", "w") as out:
+			out.write(("This file was produced by vcfisec.\n0000.vcf\tfor records private to\t{}\n0001.vcf\tfor records private to\t{}\n").format(files[0], files[1]))
+	elif cmd == "merge":
+		header, records = readVCF(files[0])
+		keys = set([siteKey(i) for i in records])
+		for i in files[1:]:
+			for rec in readVCF(i)[1]:
+				if siteKey(rec) not in keys:
+					keys.add(siteKey(rec))
+					records.append(rec)
+		writeVCF(option(args, "-o"), header, sortRecords(header, records), fmt)
+	elif cmd == "sort":
+		header, records = readVCF(files[0])
+		writeVCF(option(args, "-o"), header, sortRecords(header, records), fmt)
+	elif cmd == "filter":
+		header, records = readVCF(files[0])
+		writeVCF(option(args, "-o"), header, [i for i in records if "germline_risk" not in i[6]], fmt)
+	elif cmd == "view":
+		header, records = readVCF(files[0])
+		regions = option(args, "-R")
+		if regions:
+			keep = []
+			with open(regions, "r") as f:
+				intervals = [line.split() for line in f if line.strip()]
+			for i in records:
+				for j in intervals:
+					if i[0] == j[0] and int(j[1]) < int(i[1]) <= int(j[2]):
+						keep.append(i)
+						break
+			records = keep
+		writeVCF(option(args, "-o"), header, records, fmt)
+	return 0
+
+def heterAnalyzer(args):
+	# Keeps calls with enough coverage and few alt reads in paired sample (as in filterSweep.coverageMask)
+	mode = args[0]
+	params = dict(DEFAULTS)
+	for i in params.keys():
+		val = option(args, "--" + i)
+		if val is not None:
+			params[i] = float(val)
+	if mode == "covb":
+		minc, maxalt, maxprop = params["min_covB"], params["max_altB"], params["max_prop_altB"]
+	else:
+		minc, maxalt, maxprop = params["min_covN"], params["max_reads_altN"], params["max_freq_altN"]
+	cov = {}
+	with open(option(args, "-i"), "r") as f:
+		for line in f:
+			s = line.strip().split("\t")
+			if len(s) >= 6:
+				cov[(s[0], s[1])] = (int(s[4]), sum([int(j) for j in s[5].split(",") if j.isdigit()]))
+	header, records = readVCF(option(args, "-v"))
+	keep = []
+	for i in records:
+		if (i[0], i[1]) in cov.keys():
+			ref, alt = cov[(i[0], i[1])]
+			if minc > 0 and ref <= minc:
+				continue
+			if maxalt > 0 and alt >= maxalt:
+				continue
+			if maxprop > 0 and ref > 0 and alt / ref >= maxprop:
+				continue
+			keep.append(i)
+	writeVCF(option(args, "-o"), header, keep)
+	return 0
+
+def vcf2bed(args):
+	# Writes snvs or deletions from vcf on stdin as bed
+	import sys
+	for line in sys.stdin:
+		if line[0] == "#":
+			continue
+		s = line.split("\t")
+		start = int(s[1]) - 1
+		if "--snvs" in args and len(s[3]) == 1 and len(s[4]) == 1:
+			print(("{}\t{}\t{}").format(s[0], start, start + 1))
+		elif "--deletions" in args and len(s[3]) > len(s[4]):
+			print(("{}\t{}\t{}").format(s[0], start, start + len(s[3])))
+	return 0
+
+def bedops(args):
+	# Prints union of bed files in sorted order
+	rows = []
+	for i in args:
+		if i[0] != "-":
+			with open(i, "r") as f:
+				rows.extend([line.rstrip("\n").split("\t") for line in f if line.strip()])
+	for i in sorted(rows, key = lambda x: (x[0], int(x[1]))):
+		print("\t".join(i))
+	return 0
+
+def stubDelay(names):
+	# Sleeps for configured delay of the first tool or subcommand in names
+	delays = json.loads(os.environ.get(DELAY_ENV, "{}"))
+	for i in names:
+		if i in delays.keys():
+			sleep(delays[i])
+			return
+
+def runStub(tool, args):
+	# Runs stubbed tool and returns exit code
+	names = [tool]
+	if tool == "java" and "-jar" in args:
+		names = args[args.index("-jar")+2:args.index("-jar")+3]
+	elif tool in ["gatk", "picard", "bcftools"]:
+		names = args[:1] + names
+	stubDelay(names)
+	if tool == "java":
+		return java(args)
+	elif tool == "gatk":
+		gatk(args)
+	elif tool == "picard":
+		picard(args)
+	elif tool == "bcftools":
+		return bcftools(args)
+	elif tool == "heterAnalyzer":
+		return heterAnalyzer(args)
+	elif tool == "vcf2bed":
+		return vcf2bed(args)
+	elif tool == "bedops":
+		return bedops(args)
+	return 0
+
+def writeStubs(outdir):
+	# Writes stub executables which call this script and returns directory
+	outdir = os.path.join(outdir, "stub") + "/"
+	os.makedirs(outdir, exist_ok = True)
+	for i in TOOLS:
+		with open(outdir + i, "w") as out:
+			out.write(("#!/bin/sh\nexec {} {} --stub {} \"$@\"\n").format(quote(executable), quote(os.path.abspath(__file__)), i))
+		os.chmod(outdir + i, 0o755)
+	# Batch scripts call python
+	if not os.path.exists(outdir + "python"):
+		os.symlink(executable, outdir + "python")
+	for i in ["gatk.jar", "picard.jar"]:
+		open(outdir + i, "w").close()
+	return outdir
+
+#------------------------------------Cohort-----------------------------------
+
+def randomSites(rng, contigs, seq, n):
+	# Returns n unique random sites
+	ret = set()
+	while len(ret) < n:
+		chrom = rng.choice(contigs)
+		pos = rng.randint(100, len(seq[chrom]) - 100)
+		ref = seq[chrom][pos-1]
+		ret.add((chrom, str(pos), ref, rng.choice([i for i in "ACGT" if i != ref])))
+	return ret
+
+def writeBam(outfile, name, sites, seq, contigs, reads):
+	# Writes sorted and indexed bam with reads covering each site and truth file of sites
+	import pysam
+	header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": i, "LN": len(seq[i])} for i in contigs],
+		"RG": [{"ID": name, "SM": name}], "PG": [{"ID": "scaleBenchmark", "PN": "scaleBenchmark"}]}
+	order = dict([(c, idx) for idx, c in enumerate(contigs)])
+	length = 50
+	with pysam.AlignmentFile(outfile, "wb", header = header) as out:
+		count = 0
+		for chrom, pos, ref, alt in sorted(sites, key = lambda x: (order[x[0]], int(x[1]))):
+			start = int(pos) - length//2
+			for i in range(reads):
+				s = list(seq[chrom][start:start+length])
+				if i % 3 == 0:
+					s[length//2 - 1] = alt
+				a = pysam.AlignedSegment()
+				a.query_name = ("r{}").format(count)
+				a.query_sequence = "".join(s)
+				a.flag = 0
+				a.reference_id = order[chrom]
+				a.reference_start = start
+				a.mapping_quality = 60
+				a.cigar = ((0, length),)
+				a.query_qualities = pysam.qualitystring_to_array("I" * length)
+				a.set_tag("RG", name)
+				out.write(a)
+				count += 1
+	pysam.index(outfile)
+	with open(outfile + ".truth.tsv", "w") as out:
+		for i in sorted(sites):
+			out.write("\t".join(i) + "\n")
+
+def vcfLines(sites, contigs, seq, name):
+	# Returns plain vcf of sites
+	lines = ["##fileformat=VCFv4.2\n"]
+	for i in contigs:
+		lines.append(("##contig=<ID={},length={}>\n").format(i, len(seq[i])))
+	lines.append(("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n").format(name))
+	order = dict([(c, idx) for idx, c in enumerate(contigs)])
+	for chrom, pos, ref, alt in sorted(sites, key = lambda x: (order[x[0]], int(x[1]))):
+		lines.append(("{}\t{}\t.\t{}\t{}\t50\tPASS\t.\tGT\t0/1\n").format(chrom, pos, ref, alt))
+	return lines
+
+def makeCohort(outdir, n, variants, overlap, reads, seed, contigs = 3, length = 200000):
+	# Writes reference, bams, normal vcfs, and platypus output for n synthetic samples (existing samples are kept)
+	rng = random.Random(seed)
+	outdir = os.path.join(outdir, "cohort") + "/"
+	os.makedirs(outdir + "platypus", exist_ok = True)
+	names = [("chr{}").format(i+1) for i in range(contigs)]
+	seq = dict([(i, "".join(rng.choice("ACGT") for _ in range(length))) for i in names])
+	ref = outdir + "ref.fa"
+	if not os.path.isfile(ref):
+		import pysam
+		with open(ref, "w") as out:
+			for i in names:
+				out.write((">{}\n").format(i))
+				for j in range(0, length, 60):
+					out.write(seq[i][j:j+60] + "\n")
+		pysam.faidx(ref)
+		with open(outdir + "ref.dict", "w") as out:
+			out.write("@HD\tVN:1.6\n")
+			for i in names:
+				out.write(("@SQ\tSN:{}\tLN:{}\n").format(i, length))
+	# Normals share sites from a common pool so their comparisons are not empty
+	pool = sorted(randomSites(rng, names, seq, variants * 2))
+	samples = []
+	for i in range(n):
+		sid = ("S{:05d}").format(i+1)
+		sdir = outdir + sid + "/"
+		samples.append(sid)
+		srng = random.Random(("{}{}").format(seed, sid))
+		if os.path.isfile(sdir + "B.bam.bai"):
+			continue
+		os.makedirs(sdir, exist_ok = True)
+		a = randomSites(srng, names, seq, variants)
+		shared = set(srng.sample(sorted(a), int(variants * overlap)))
+		b = shared | randomSites(srng, names, seq, variants - len(shared))
+		normal = set(srng.sample(pool, max(1, variants // 2)))
+		writeBam(sdir + "N.bam", sid + "_N", normal, seq, names, reads)
+		writeBam(sdir + "A.bam", sid + "_A", a, seq, names, reads)
+		writeBam(sdir + "B.bam", sid + "_B", b, seq, names, reads)
+		with open(sdir + "N.vcf", "w") as out:
+			out.writelines(vcfLines(normal, names, seq, sid + "_N"))
+		# Platypus calls agree with most mutect calls
+		pdir = outdir + "platypus/" + sid + "/"
+		os.makedirs(pdir, exist_ok = True)
+		calls = {"AfiltcovBNAB_different.vcf": a - b, "BfiltcovBNAB_different.vcf": b - a, "filtcovBNABU_common.vcf": a & b}
+		with open(pdir + "vcfdict.csv", "w") as out:
+			for k, v in calls.items():
+				keep = set([j for j in v if srng.random() < 0.9])
+				with open(pdir + k, "w") as vcf:
+					vcf.writelines(vcfLines(keep, names, seq, sid))
+				out.write(("{},{}\n").format(k, k))
+	return outdir, samples
+
+#------------------------------------Runs-------------------------------------
+
+def writeConfig(rundir, cohort, stub):
+	# Writes config file and batch template for one run
+	conf = rundir + "config.txt"
+	with open(conf, "w") as out:
+		out.write(("GATK_jar = {}gatk.jar\nPicard_jar = {}picard.jar\n").format(stub, stub))
+		out.write(("reference_genome = {}ref.fa\noutput_directory = {}mutect/\n").format(cohort, rundir))
+		out.write("min_covA = 20\nmin_reads_strand = 10\nmin_covB = 15\nmax_altB = 0\nmax_prop_altB = 0.05\n")
+		out.write("min_covN = 5\nmax_freq_altN = 0.3\nmax_reads_altN = 15\n\n")
+		out.write("==============================================================================\n")
+		out.write("#	Sample Batch Script (grid commands and module load commands)\n")
+		out.write("==============================================================================\n\n")
+		out.write(BATCH)
+	return conf
+
+def run(cmd, cwd, env, log):
+	# Runs command and returns True if it exits successfully
+	with open(log, "a") as out:
+		out.write(" ".join(cmd) + "\n")
+		out.flush()
+		proc = Popen(cmd, cwd = cwd, env = env, stdout = out, stderr = out, stdin = DEVNULL)
+		return proc.wait() == 0
+
+def runJobs(scripts, threads, env, log):
+	# Runs batch scripts with the given number of concurrent jobs (emulating the grid)
+	pool = ThreadPool(processes = threads)
+	res = pool.map(lambda x: run(["bash", x], BIN, env, log), scripts)
+	pool.close()
+	pool.join()
+	return False not in res
+
+def mutectStage(rundir, cohort, samples, threads, env, log):
+	# Writes batch scripts with mutect2Parallel and runs every runPair job
+	manifest = rundir + "manifest.txt"
+	with open(manifest, "w") as out:
+		for i in samples:
+			out.write(("{}\t{}N.bam\t{}A.bam\t{}B.bam\n").format(i, cohort + i + "/", cohort + i + "/", cohort + i + "/"))
+	batch = rundir + "batch/"
+	os.makedirs(batch, exist_ok = True)
+	ret = run([executable, BIN + "mutect2Parallel.py", "-i", manifest, "-c", rundir + "config.txt", "-o", batch], BIN, env, log)
+	if ret == True:
+		ret = runJobs([batch + i + ".sh" for i in samples], threads, env, log)
+	return ret, len(samples)
+
+def filterStage(rundir, samples, threads, env, log):
+	# Runs filterVCFs over mutect output from working directory containing heterAnalyzer and coverage scripts
+	work = rundir + "work/"
+	os.makedirs(work, exist_ok = True)
+	for i in ["covB.sh", "covN.sh"]:
+		shutil.copy(BIN + i, work + i)
+	shutil.copy(env["PATH"].split(":")[0] + "/heterAnalyzer", work + "heterAnalyzer")
+	ret = run([executable, BIN + "filterVCFs.py", "-t", str(threads), "-c", rundir + "config.txt"], work, env, log)
+	return ret, len(samples)
+
+def normalsStage(rundir, cohort, samples, threads, env, log):
+	# Compares every pair of normal vcfs
+	manifest = rundir + "normals.txt"
+	with open(manifest, "w") as out:
+		for i in samples:
+			out.write(("{}{}/N.vcf\n").format(cohort, i))
+	ret = run([executable, BIN + "compareNormals.py", "-t", str(threads), "-m", manifest, "-o", rundir + "normals/"], BIN, env, log)
+	return ret, len(samples) * (len(samples) - 1) // 2
+
+def pipelineStage(rundir, cohort, samples, threads, env, log):
+	# Builds comparison manifest from filtered mutect and platypus output and compares each sample
+	plat = rundir + "platypusInput/"
+	os.makedirs(plat, exist_ok = True)
+	for i in samples:
+		if not os.path.exists(plat + i):
+			os.symlink(cohort + "platypus/" + i, plat + i)
+	manifest = rundir + "pipelines.csv"
+	ret = run([executable, BIN + "pipelineComparison.py", "-t", str(threads), "-m", rundir + "mutect/", "-p", plat,
+		"-c", rundir + "platypus/", "-o", manifest], BIN, env, log)
+	if ret == True:
+		ret = run([executable, BIN + "pipelineComparison.py", "-t", str(threads), "-i", manifest, "-o", rundir + "pipelines/"], BIN, env, log)
+	return ret, len(samples)
+
+def childSeconds():
+	# Returns user and system cpu seconds of finished child processes
+	usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return usage.ru_utime + usage.ru_stime
+
+def benchmark(outdir, cohort, samples, threads, stages, stub):
+	# Times each stage for one sample count and worker count and returns rows
+	rundir = ("{}runs/n{}_t{}/").format(outdir, len(samples), threads)
+	if os.path.isdir(rundir):
+		shutil.rmtree(rundir)
+	os.makedirs(rundir)
+	writeConfig(rundir, cohort, stub)
+	env = dict(os.environ)
+	env["PATH"] = stub.rstrip("/") + ":" + env.get("PATH", "")
+	log = rundir + "benchmark.log"
+	rows = []
+	for s in stages:
+		start = time()
+		cpu = childSeconds()
+		if s == "mutect2Parallel":
+			ret, items = mutectStage(rundir, cohort, samples, threads, env, log)
+		elif s == "filterVCFs":
+			ret, items = filterStage(rundir, samples, threads, env, log)
+		elif s == "compareNormals":
+			ret, items = normalsStage(rundir, cohort, samples, threads, env, log)
+		elif s == "pipelineComparison":
+			ret, items = pipelineStage(rundir, cohort, samples, threads, env, log)
+		elapsed = time() - start
+		rows.append([s, len(samples), threads, items, elapsed, childSeconds() - cpu, items / elapsed if elapsed > 0 else 0.0, ret])
+		print(("\t{}\t{:,d} samples\t{} workers\t{:.1f}s\t{:.2f} items/s{}").format(s, len(samples), threads, elapsed,
+			rows[-1][6], "" if ret == True else "\t(failed; see benchmark.log)"), flush = True)
+		if ret == False:
+			break
+	return rows
+
+def plotThroughput(outfile, rows):
+	# Plots throughput against sample count for each stage and worker count
+	try:
+		import matplotlib
+		matplotlib.use("Agg")
+		import matplotlib.pyplot as plt
+	except ImportError:
+		print("\t[Warning] matplotlib is not installed. Skipping plot.", file=stderr)
+		return
+	stages = [i for i in STAGES if i in set([r[0] for r in rows])]
+	fig, axes = plt.subplots(1, len(stages), figsize = (5 * len(stages), 4), squeeze = False)
+	for ax, s in zip(axes[0], stages):
+		for t in sorted(set([r[2] for r in rows if r[0] == s])):
+			pts = sorted([(r[1], r[6]) for r in rows if r[0] == s and r[2] == t])
+			ax.plot([i[0] for i in pts], [i[1] for i in pts], marker = "o", label = ("{} workers").format(t))
+		ax.set_title(s)
+		ax.set_xscale("log")
+		ax.set_xlabel("Samples")
+		ax.set_ylabel("Comparisons/s" if s == "compareNormals" else "Samples/s")
+		ax.legend()
+	fig.tight_layout()
+	fig.savefig(outfile)
+	plt.close(fig)
+
+def checkStages(stages):
+	# Returns stages in pipeline order after checking prerequisites
+	for i in stages:
+		if i not in STAGES:
+			print(("\n\t[Error] Unknown stage {}. Exiting.\n").format(i), file=stderr)
+			quit()
+		for j in REQUIRES.get(i, []):
+			if j not in stages:
+				print(("\n\t[Error] {} requires {}. Exiting.\n").format(i, j), file=stderr)
+				quit()
+	return [i for i in STAGES if i in stages]
+
+def parseDelays(val):
+	# Returns dict of tool delays from comma separated tool=seconds pairs
+	ret = dict(DELAYS)
+	if val:
+		for i in val.split(","):
+			k, v = i.split("=")
+			ret[k.strip()] = float(v)
+	return ret
+
+def main():
+	if len(argv) > 2 and argv[1] == "--stub":
+		# Called through a stub executable
+		quit(runStub(argv[2], argv[3:]))
+	parser = ArgumentParser("This script times the pipeline end to end over synthetic cohorts using stub tools.")
+	parser.add_argument("-o", help = "Path to benchmark directory (synthetic cohorts are kept and reused).")
+	parser.add_argument("-n", default = "10,100,1000", help = "Comma separated sample counts (default = 10,100,1000).")
+	parser.add_argument("-t", default = "1,4,16", help = "Comma separated worker counts (default = 1,4,16).")
+	parser.add_argument("--stages", default = ",".join(STAGES), help = "Comma separated stages to run (default is all).")
+	parser.add_argument("--variants", type = int, default = 200, help = "Number of variants per tumor sample (default = 200).")
+	parser.add_argument("--overlap", type = float, default = 0.5, help = "Fraction of variants shared by both tumors (default = 0.5).")
+	parser.add_argument("--reads", type = int, default = 6, help = "Number of reads covering each variant (default = 6).")
+	parser.add_argument("--delays", help = "Comma separated tool=seconds delays for stub tools \
+(default = Mutect2=1,FilterMutectCalls=0.2,HaplotypeCaller=0.2; tools are gatk tool names or bcftools subcommands).")
+	parser.add_argument("--seed", type = int, default = 1, help = "Random seed (default = 1).")
+	parser.add_argument("--svg", action = "store_true", default = False, help = "Also plot throughput curves (requires matplotlib).")
+	args = parser.parse_args()
+	if not args.o:
+		print("\n\t[Error] Please specify a benchmark directory. Exiting.\n", file=stderr)
+		quit()
+	outdir = os.path.join(os.path.abspath(args.o), "")
+	sizes = sorted([int(i) for i in args.n.split(",")])
+	threads = sorted([int(i) for i in args.t.split(",")])
+	stages = checkStages([i.strip() for i in args.stages.split(",")])
+	os.environ[DELAY_ENV] = json.dumps(parseDelays(args.delays))
+	print(("\n\tGenerating synthetic cohort of {:,d} samples...").format(sizes[-1]))
+	cohort, samples = makeCohort(outdir, sizes[-1], args.variants, args.overlap, args.reads, args.seed)
+	stub = writeStubs(outdir)
+	rows = []
+	for n in sizes:
+		for t in threads:
+			rows.extend(benchmark(outdir, cohort, samples[:n], t, stages, stub))
+	outfile = outdir + "throughput.csv"
+	with open(outfile, "w") as out:
+		out.write("Stage,Samples,Workers,Items,Seconds,CpuSeconds,ItemsPerSecond,Success\n")
+		for i in rows:
+			out.write(("{},{},{},{},{:.3f},{:.3f},{:.4f},{}\n").format(*i))
+	print(("\n\tWrote {}").format(outfile))
+	if args.svg == True:
+		plotThroughput(outdir + "throughput.svg", rows)
+		print(("\tWrote {}throughput.svg").format(outdir))
+	print()
+
+if __name__ == "__main__":
+	main()
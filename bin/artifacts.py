@@ -0,0 +1,174 @@
+'''This script defines a registry of vcf files which have already been sorted, bgzipped, or indexed'''
+
+import os
+import sqlite3
+import hashlib
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT,
+	sorted INTEGER, bgzipped INTEGER, indexed INTEGER, source TEXT, source_hash TEXT);"""
+
+class Artifact():
+	# Stores state of one file
+	def __init__(self, row = None):
+		self.Path = ""
+		self.Size = 0
+		self.Mtime = 0
+		self.Hash = ""
+		self.Sorted = False
+		self.Bgzipped = False
+		self.Indexed = False
+		self.Source = ""
+		self.SourceHash = ""
+		if row:
+			self.__setRow__(row)
+
+	def __setRow__(self, row):
+		# Stores values from database row
+		self.Path = row[0]
+		self.Size = row[1]
+		self.Mtime = row[2]
+		self.Hash = row[3]
+		self.Sorted = bool(row[4])
+		self.Bgzipped = bool(row[5])
+		self.Indexed = bool(row[6])
+		self.Source = row[7]
+		self.SourceHash = row[8]
+
+	def row(self):
+		# Returns values as database row
+		return (self.Path, self.Size, self.Mtime, self.Hash, int(self.Sorted), int(self.Bgzipped),
+			int(self.Indexed), self.Source, self.SourceHash)
+
+class ArtifactRegistry():
+	# Records file states keyed by path, size, mtime, and content hash (in memory unless a database is set)
+	def __init__(self):
+		self.Path = None
+		self.Files = {}
+
+	def setPath(self, path):
+		# Stores registry in sqlite database at path
+		self.Path = path
+		conn = self.__connect__()
+		conn.close()
+
+	def __connect__(self):
+		# Returns connection to registry database
+		conn = sqlite3.connect(self.Path, timeout = 300)
+		conn.executescript(SCHEMA)
+		return conn
+
+	def __checksum__(self, path):
+		# Returns blake2b digest of file contents
+		h = hashlib.blake2b(digest_size = 20)
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				h.update(chunk)
+		return h.hexdigest()
+
+	def __lookup__(self, path):
+		# Returns stored artifact for path or None
+		if path in self.Files.keys():
+			return self.Files[path]
+		if self.Path:
+			conn = self.__connect__()
+			try:
+				row = conn.execute("SELECT * FROM artifacts WHERE path = ?", (path,)).fetchone()
+			finally:
+				conn.close()
+			if row:
+				self.Files[path] = Artifact(row)
+				return self.Files[path]
+		return None
+
+	def __store__(self, a):
+		# Stores artifact in memory and database
+		self.Files[a.Path] = a
+		if self.Path:
+			conn = self.__connect__()
+			try:
+				with conn:
+					conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", a.row())
+			finally:
+				conn.close()
+
+	def forget(self, path):
+		# Removes path from registry
+		if path in self.Files.keys():
+			del self.Files[path]
+		if self.Path:
+			conn = self.__connect__()
+			try:
+				with conn:
+					conn.execute("DELETE FROM artifacts WHERE path = ?", (path,))
+			finally:
+				conn.close()
+
+	def identity(self, path):
+		# Returns content hash of path, only reading the file if size or mtime has changed
+		if not path or not os.path.isfile(path):
+			return None
+		st = os.stat(path)
+		a = self.__lookup__(path)
+		if a and a.Size == st.st_size and a.Mtime == st.st_mtime_ns:
+			return a.Hash
+		h = self.__checksum__(path)
+		if a and a.Size == st.st_size and a.Hash == h:
+			# Contents are unchanged (i.e. file was touched or copied)
+			a.Mtime = st.st_mtime_ns
+			self.__store__(a)
+		else:
+			# Replace stale state with plain file identity
+			a = Artifact()
+			a.Path = path
+			a.Size = st.st_size
+			a.Mtime = st.st_mtime_ns
+			a.Hash = h
+			self.__store__(a)
+		return h
+
+	def isValid(self, path, sort = False, index = False, source = None):
+		# Returns True if path is unchanged and has the requested states (always False without a database so nothing is hashed)
+		if not self.Path:
+			return False
+		h = self.identity(path)
+		a = self.__lookup__(path)
+		if h is None or a is None or a.Hash != h:
+			return False
+		if sort == True and a.Sorted == False:
+			return False
+		if index == True:
+			idx = path + ".tbi"
+			if a.Indexed == False or not os.path.isfile(idx) or os.stat(idx).st_mtime_ns < a.Mtime:
+				return False
+		if source is not None and (a.Source != source or a.SourceHash != self.identity(source)):
+			return False
+		return a.Bgzipped
+
+	def record(self, path, sort = None, index = None, source = None):
+		# Stores current state of bgzipped file (previous flags are kept unless they are given; nothing is stored without a database)
+		if not self.Path or not path or not os.path.isfile(path):
+			return None
+		# Reuses the stored hash if size and mtime are unchanged and resets stale flags otherwise
+		self.identity(path)
+		a = self.__lookup__(path)
+		a.Bgzipped = True
+		if sort is not None:
+			a.Sorted = sort
+		if index is not None:
+			a.Indexed = index
+		if source is not None:
+			a.Source = source
+			a.SourceHash = self.identity(source)
+		self.__store__(a)
+		return a
+
+	def rename(self, old, new):
+		# Moves state to new path after a file is renamed
+		a = self.__lookup__(old)
+		if a:
+			self.forget(old)
+			a.Path = new
+			self.__store__(a)
+
+# Shared by every module in this process; set by each entry point
+REGISTRY = ArtifactRegistry()
@@ -6,17 +6,34 @@ import pysam
 from sys import stderr
 from subprocess import Popen
 from shlex import split
+from time import time
 from unixpath import *
 from sample import Sample
+from hostSlots import SLOTS
+from runState import RunState
+from artifacts import REGISTRY
+from toolCache import CACHE
+from metrics import METRICS, METRICS_FILE, waitProc
+from tracer import TRACER, traced
+from profiler import PROFILER, initWorker
 
+@traced()
 def runProc(cmd, log = None):
 	# Wraps call to Popen, writes stdout/stdout err to log/devnull, returns True if no errors
 	if not log:
 		log = os.devnull
+	# Wait for host-wide slots if limits are set
+	held = SLOTS.acquire(SLOTS.getKinds(cmd))
 	with open(log, "w") as out:
 		try:
+			start = time()
 			call = Popen(split(cmd), stdout = out, stderr = out)
-			call.wait()
+			if METRICS.enabled():
+				# Record cpu time, peak rss, and i/o of child
+				usage, io = waitProc(call)
+				METRICS.record(cmd, start, call.returncode, usage, io)
+			else:
+				call.wait()
 			if call.returncode is not None:
 				return True
 		except:
@@ -30,6 +47,25 @@ def runProc(cmd, log = None):
 				proc = getFileName(s[2])
 			print(("\t[Warning] Could not call {}").format(proc), file=stderr)
 			return False
+		finally:
+			SLOTS.release(held)
+
+def runCached(cmd, inputs, outputs, log = None, check = None):
+	# Calls runProc unless outputs of an identical command with identical inputs are in the tool cache
+	if not CACHE.enabled():
+		return runProc(cmd, log)
+	if log:
+		outputs = outputs + [log]
+	key = CACHE.key(cmd, inputs, outputs)
+	if CACHE.fetch(key, outputs) == True:
+		return True
+	CACHE.clear(outputs)
+	res = runProc(cmd, log)
+	if res == True and False not in [os.path.exists(i) for i in outputs]:
+		if check is None or check() == True:
+			# Only store successful results
+			CACHE.store(key, outputs)
+	return res
 
 def fixGZ(f):
 	# Fixes file extensions on system
@@ -38,6 +74,7 @@ def fixGZ(f):
 	f = f[:f.find(".gz")]
 	f += ".gz"
 	os.rename(old, f)
+	REGISTRY.rename(old, f)
 	if os.path.isfile(old + ".tbi"):
 		# Fix index file
 		os.rename(old + ".tbi", f + ".tbi")
@@ -58,17 +95,34 @@ def checkGZ(f):
 				f = fixGZ(f)
 	return f
 
+def isIndexed(vcf):
+	# Returns name of bgzipped file if registry shows it is unchanged and indexed
+	if getExt(vcf) == "gz":
+		if REGISTRY.isValid(vcf, index = True):
+			return vcf
+	elif REGISTRY.isValid(vcf + ".gz", index = True, source = vcf):
+		# Compressed copy was made from current version of vcf
+		return vcf + ".gz"
+	return None
+
+@traced()
 def tabix(vcf, force = False, keep = False):
 	# tabix index and bgzips vcf files
 	if force == False and os.path.isfile(vcf + ".gz"):
 		gz = vcf + ".gz"
 	else:
 		vcf = checkGZ(vcf)
-		try:
-			gz = pysam.tabix_index(vcf, seq_col=0, start_col=1, end_col=1, force=force, keep_original=keep)
-		except OSError:
-			print(("\t[Warning] Could not index {}.").format(vcf), file=stderr)
-			gz = None
+		gz = isIndexed(vcf)
+		if gz is None:
+			source = None
+			if keep == True and getExt(vcf) != "gz":
+				source = vcf
+			try:
+				gz = checkGZ(pysam.tabix_index(vcf, seq_col=0, start_col=1, end_col=1, force=force, keep_original=keep))
+				REGISTRY.record(gz, index = True, source = source)
+			except OSError:
+				print(("\t[Warning] Could not index {}.").format(vcf), file=stderr)
+				gz = None
 	return checkGZ(gz)
 
 def bcfMerge(outfile, com):
@@ -85,11 +139,19 @@ def bcfSort(infile):
 		return None
 	infile = checkGZ(infile)
 	outfile = infile.replace(".vcf", ".sorted.vcf")
+	gz = outfile
+	if getExt(gz) != "gz":
+		gz += ".gz"
+	if REGISTRY.isValid(gz, sort = True, index = True, source = infile):
+		# Skip if sorted file was made from current version of infile
+		return gz
 	cmd = ("bcftools sort -o {} {}").format(outfile, infile)
 	res = runProc(cmd)
 	if res == False or os.path.isfile(outfile) == False:
 		return None
-	return tabix(outfile, True)
+	gz = tabix(outfile, True)
+	REGISTRY.record(gz, sort = True, index = True, source = infile)
+	return gz
 
 def getTotal(vcf):
 	# Returns total number of content lines from vcf
@@ -116,6 +178,7 @@ def getTotal(vcf):
 		count = None
 	return count
 
+@traced()
 def bcfIsec(outpath, vcfs):
 	# Calls bcftools to get intersecting rows and returns number of private A
 	a = None
@@ -124,7 +187,7 @@ def bcfIsec(outpath, vcfs):
 		vcfs[i] = tabix(vcfs[i], force = True)
 	if None not in vcfs:
 		cmd = ("bcftools isec {} {} -p {}").format(vcfs[0], vcfs[1], outpath)
-		res = runProc(cmd)
+		res = runCached(cmd, vcfs, [outpath])
 		if res == True:
 			# Number of unique variants to each sample and number of shared
 			a = getTotal(outpath + "/0000.vcf")
@@ -141,7 +204,11 @@ def samIndex(bam):
 	# Call samtools to index sam/bam file
 	if not os.path.isfile(bam + ".bai"):
 		print(("\tGenerating sam index for {}...").format(bam))
-		pysam.index(bam)
+		held = SLOTS.acquire(["bam"])
+		try:
+			pysam.index(bam)
+		finally:
+			SLOTS.release(held)
 
 def getTumorName(bam):
 	# Gets relevent header data and extracts tumor sample name from bam file
@@ -214,6 +281,25 @@ def getStatus(log):
 				break
 	return ret
 
+def setHostLimits(conf):
+	# Enables host-wide admission control if a lock directory is given in conf
+	if "lockdir" in conf.keys():
+		jvms = None
+		bams = None
+		if "max_jvms" in conf.keys():
+			jvms = conf["max_jvms"]
+		if "max_bams" in conf.keys():
+			bams = conf["max_bams"]
+		SLOTS.setLimits(conf["lockdir"], jvms, bams)
+
+def setToolCache(conf):
+	# Enables shared tool cache if a cache directory is given in conf
+	if "cache" in conf.keys():
+		size = None
+		if "cache_size" in conf.keys():
+			size = conf["cache_size"]
+		CACHE.setCache(conf["cache"], size)
+
 def getOpt(conf, cmd):
 	# Adds common flags to command
 	if "bed" in conf.keys():
@@ -233,34 +319,14 @@ def getSample(fname):
 		return s[:s.find(".")]
 
 def checkOutput(outdir, normal = None, prnt = True):
-	# Checks for output log file and reads if present
-	first = True
-	done = {}
-	log = outdir + "mutectLog.txt"
+	# Checks state database for previous output (importing mutectLog.txt if present)
 	if prnt == True:
 		print("\tChecking for previous output...")
 	if not os.path.isdir(outdir):
 		os.mkdir(outdir)
-	if os.path.isfile(log):
-		with open(log, "r") as f:
-			for line in f:
-				if first == False and line.strip():
-					line = line.strip().split("\t")
-					if len(line) == 5:
-						if line[0] not in done.keys():
-							# Initialize new sample entry
-							done[line[0]] = Sample()
-						done[line[0]].update(line[0], line[1], line[2], line[3], line[4])
-				else:
-					# Skip header
-					first = False
-	else:
-		with open(log, "w") as f:
-			# Initialize log file and record normal file
-			f.write("Sample\tName\tStep\tStatus\tOutput\n")
-			if normal:
-				f.write("N\t{}\tnormal\tcomplete\t{}\n".format(getFileName(normal), normal))
-	return log, done
+	state = RunState(outdir)
+	done = state.load(normal)
+	return state, done
 
 def configEntry(conf, arg, key):
 	# Returns dict with updated arg entry
@@ -319,6 +385,22 @@ def getOptions(conf, line):
 			conf["max_altB"] = int(val)
 		elif target == "max_prop_altB":
 			conf["max_prop_altB"] = float(val)
+		# Get host-wide limits
+		elif target == "lock_directory":
+			conf["lockdir"] = val
+		elif target == "max_jvms":
+			conf["max_jvms"] = int(val)
+		elif target == "max_bam_readers":
+			conf["max_bams"] = int(val)
+		# Get tool cache options
+		elif target == "cache_directory":
+			conf["cache"] = val
+		elif target == "cache_size":
+			conf["cache_size"] = float(val)
+		elif target == "trace_directory":
+			conf["trace"] = val
+		elif target == "speculate":
+			conf["speculate"] = float(val)
 		elif target == "max_covN":
 			conf["min_covN"] = int(val)
 		elif target == "min_freq_altN":
@@ -327,17 +409,64 @@ def getOptions(conf, line):
 			conf["max_reads_altN"] = int(val)
 	return conf
 
+def trimTemplate(lines):
+	# Removes blank and separator lines from the end of a batch template
+	while lines and (not lines[-1].strip() or lines[-1].startswith("=")):
+		lines.pop()
+	return lines
+
+def writeBatchScript(outfile, template, name, cmds):
+	# Writes batch template with name appended to the job name followed by commands
+	with open(outfile, "w") as output:
+		for line in template:
+			if "--job-name=" in line:
+				output.write(("{}_{}\n").format(line.strip(), name))
+			else:
+				output.write(line)
+		for i in cmds:
+			output.write(i + "\n")
+
+def submitJobs(scripts, batch, outdir):
+	# Determines grid type and submits jobs
+	os.chdir(outdir)
+	cmd = ""
+	for line in batch:
+		if "#SBATCH" in line:
+			cmd = "sbatch "
+			break
+		elif "#PBS" in line:
+			cmd = "qsub "
+			break
+	if len(cmd) <= 3:
+		print("\t[Error] Cannot determine grid type. Exiting.\n")
+		quit()
+	for i in scripts:
+		try:
+			# Submit each batch script
+			Popen(split(cmd + i + " \n"))
+		except:
+			print(("\t[Error] Could not submit {}").format(i))
+	print()
+	return True
+
 def getConf(infile):
-	# Stores runtime options
+	# Stores runtime options (tiered batch templates are stored in conf["templates"])
 	batch = []
 	opt = True
 	store = False
-	conf = {"ref":None}
+	conf = {"ref":None, "templates":{}}
 	print("\n\tReading config file...")
 	with open(infile, "r") as f:
 		for line in f:
 			if "Sample Batch Script" in line:
 				opt = False
+				store = False
+				# Named tiers are given as "Sample Batch Script: name"
+				name = "default"
+				if ":" in line and line.split(":", 1)[1].split():
+					name = line.split(":", 1)[1].split()[0]
+				batch = []
+				conf["templates"][name] = batch
 			elif opt == True and line.strip():
 				# Store options
 					conf = getOptions(conf, line)
@@ -347,6 +476,11 @@ def getConf(infile):
 				if store == True:
 					# Store batch script
 					batch.append(line)
+	for i in conf["templates"].values():
+		trimTemplate(i)
+	if conf["templates"]:
+		# Use the first template when tiers are not planned
+		batch = list(conf["templates"].values())[0]
 	# Check for critical errors
 	checkFile(conf["ref"])
 	conf["outpath"] = checkDir(conf["outpath"], True)
@@ -5,68 +5,36 @@ from datetime import datetime
 from argparse import ArgumentParser
 from sys import stderr
 from shutil import copy
+from copy import deepcopy
+from functools import partial
 from itertools import combinations
 from multiprocessing import Pool, cpu_count
 from unixpath import *
 from commonUtil import *
+from resultSink import ResultSink
+from progress import EVENTS, PROGRESS, fileSize
+from scheduling import getChunksize, orderByCost
+from speculate import Speculator, scratchPath
+from workQueue import WorkQueue, drain
 
 class Finished():
 
 	def __init__(self, infile):
 		self.Log = infile
-		self.A = {}
-		self.B = {}
-		self.N = {}
+		self.Sink = None
 		self.__getFinished__()
 
 	def __getFinished__(self):
-		# Returns list of pairs which finished comparison
-		first = True
+		# Opens summary file and stores finished pairs
 		if not os.path.isfile(self.Log):
 			print("\tMaking new log file...")
-			with open(self.Log, "w") as out:
-				# Initialize log file
-				out.write("SampleType,Sample,Normal,PrivateSample,PrivateNormal,Common,%Similarity\n")
-		else:
-			with open(self.Log, "r") as f:
-				for line in f:
-					if first == False:
-						s =  line.split(",")
-						# Add to appropriate dict
-						if s[0] == "A":
-							if s[1] not in self.A.keys():
-								self.A[s[1]] = []
-							self.A[s[1]].append(s[2])
-						elif s[0] == "B":
-							if s[1] not in self.B.keys():
-								self.B[s[1]] = []
-							self.B[s[1]].append(s[2])
-						elif s[0] == "N":
-							if s[1] not in self.N.keys():
-								self.N[s[1]] = []
-							self.N[s[1]].append(s[2])
-					else:
-						first = False
-			l = len(self.A) + len(self.B) + len(self.N)
-			print(("\tIdentified {:,d} completed samples.").format(l))
+		self.Sink = ResultSink(self.Log, "SampleType,Sample,Normal,PrivateSample,PrivateNormal,Common,%Similarity\n", keys = 3)
+		if len(self.Sink.Done) > 0:
+			print(("\tIdentified {:,d} completed comparisons.").format(len(self.Sink.Done)))
 
 	def inFinished(self, typ, vcf1, vcf2):
 		# Reuturns true if vcfs pair is in done
-		v = getFileName(vcf1)
-		n = getFileName(vcf2)
-		if typ == "A":
-			if v in self.A.keys():
-				if n in self.A[v]:
-					return True
-		elif typ == "B":
-			if v in self.B.keys():
-				if n in self.B[v]:
-					return True
-		elif typ == "N":
-			if v in self.N.keys():
-				if n in self.N[v]:
-					return True
-		return False
+		return self.Sink.has(typ, getFileName(vcf1), getFileName(vcf2))
 
 #-----------------------------------------------------------------------------
 
@@ -93,8 +61,8 @@ class VCFcomparison():
 				root = "isecNormals"
 			self.outdir = ("{}{}/{}_{}").format(outdir, root, self.v, self.n)	
 		else:
-			# Get pipeline output
-			self.outdir = outdir + self.sample + "/"
+			# Get pipeline output (each comparison of a sample gets its own directory since they run at the same time)
+			self.outdir = ("{}{}/{}/").format(outdir, self.sample, self.type)
 
 	def __checkInput__(self):
 		# Makes sure input files exist
@@ -114,7 +82,11 @@ def getType(vcf):
 
 def compareSamples(v):
 	# Calls bcftools isec for each set of normals vs vcf
+	pair = v.sample if v.sample is not None else v.v
+	PROGRESS.emit(pair, v.n, "isec", "starting", [v.vcf, v.normal])
+	METRICS.setContext(pair, v.n, "isec")
 	a = bcfIsec(v.outdir, [v.vcf, v.normal])
+	PROGRESS.emit(pair, v.n, "isec", "complete" if a is not None else "failed", None, [v.outdir])
 	if a is not None:
 		b = getTotal(v.outdir + "/0001.vcf")
 		c = getTotal(v.outdir + "/0002.vcf")
@@ -122,18 +94,29 @@ def compareSamples(v):
 			sim = c/(a+b+c)
 		except ZeroDivisionError:
 			sim = 0.0
-		with open(v.log, "a") as out:
-			t = v.type
-			vcf = v.v
-			n = v.n
-			if v.sample is not None:
-				t = v.sample + "," + v.type
-				vcf = v.vcf
-				n = v.normal
-			out.write(("{},{},{},{},{},{},{:.2%}\n").format(t, vcf, n, a, b, c, sim))
-		return [True, v.v, v.n]
+		t = v.type
+		vcf = v.v
+		n = v.n
+		if v.sample is not None:
+			t = v.sample + "," + v.type
+			vcf = v.vcf
+			n = v.normal
+		# Return row so it can be written by the parent process
+		row = ("{},{},{},{},{},{},{:.2%}").format(t, vcf, n, a, b, c, sim)
+		return [True, v.v, v.n, row]
 	else:
-		return [False, v.v, v.n]
+		return [False, v.v, v.n, None]
+
+def duplicateComparison(v):
+	# Returns comparison writing to scratch directory which replaces the output directory if it finishes first
+	c = deepcopy(v)
+	c.outdir = scratchPath(v.outdir)
+	return compareSamples, c, [[c.outdir, v.outdir]], None
+
+def indexInputs(vcfs):
+	# Indexes each input vcf once so invocations sharing a queue do not compress the same file at the same time
+	for i in sorted(set([j for v in vcfs for j in [v.vcf, v.normal]])):
+		tabix(i, force = True)
 
 def allSamplePairs(outdir, normals, a, b):
 	# Returns all pairs for a:normal and b:normal
@@ -148,7 +131,7 @@ def allSamplePairs(outdir, normals, a, b):
 					# Append each a/b to normal pair
 					c = VCFcomparison(typ, i, j, log, outdir, True)
 					vcfs.append(c)
-	return vcfs
+	return vcfs, done.Sink
 
 def getSamplePairs(outdir, normals, vcf = None):
 	# Returns pairs of samples to compare
@@ -171,7 +154,7 @@ def getSamplePairs(outdir, normals, vcf = None):
 			if done.inFinished(typ, i[0], i[1]) == False:
 				c = VCFcomparison(typ, i[0], i[1], log, outdir, True)
 				vcfs.append(c)
-	return vcfs
+	return vcfs, done.Sink
 
 def checkVCF(inpath, outpath, stem):
 	# Returns name of existing output file and copies if necessary
@@ -248,28 +231,68 @@ help = "Compares each tumor vcf to all normal vcfs.")
 help = "Path to input sample (If omitted, the normal vcfs will be compared to one another).")
 	parser.add_argument("-m", help = "Path to manifest of normals files (one file per line).")
 	parser.add_argument("-o", help = "Path to output directory.")
+	parser.add_argument("--queue", help = "Path to shared work queue directory (any number of invocations on different nodes given the same \
+directory compare pairs from it cooperatively and merge their rows into the summary file).")
+	parser.add_argument("--chunk", type = int, default = 100, help = "Number of comparisons in each work queue item (default = 100).")
+	parser.add_argument("--speculate", type = float,
+help = "Duplicate comparisons which run longer than this multiple of the median runtime into scratch output (the first to finish is kept).")
+	parser.add_argument("--profile", help = "Path to directory for cProfile stats of every process (merged into profile.txt when finished).")
+	parser.add_argument("--profile_memory", action = "store_true", default = False,
+help = "Also record tracemalloc snapshots of every process (requires --profile).")
 	args = parser.parse_args()
+	PROFILER.setPath(args.profile, args.profile_memory)
 	args, norm = checkArgs(args)
+	REGISTRY.setPath(args.o + "artifacts.db")
+	PROGRESS.setPath(args.o + EVENTS)
+	METRICS.setPath(args.o + METRICS_FILE)
 	normals, a, b = getNormals(args.m, args.o, args.allsamples)
 	if norm == False and args.allsamples == False:
 		print("\tGetting all sample:normal pairs...")
-		vcfs = getSamplePairs(args.o, normals, args.i)
+		vcfs, sink = getSamplePairs(args.o, normals, args.i)
 	elif args.allsamples == False:
 		print("\tGetting all pairs of normal samples...")
-		vcfs = getSamplePairs(args.o, normals)
+		vcfs, sink = getSamplePairs(args.o, normals)
 	else:
 		print("\tGetting all tumor:normal sample pairs...")
-		vcfs = allSamplePairs(args.o, normals, a, b)
+		vcfs, sink = allSamplePairs(args.o, normals, a, b)
 	print(("\t{:,d} file pairs found.").format(len(vcfs)))
+	# Start comparisons of the largest vcfs first
+	vcfs = orderByCost(vcfs, lambda x: fileSize([x.vcf, x.normal]))
 	l = len(vcfs)
-	pool = Pool(processes = args.t)
+	pool = None
 	print(("\tComparing vcf to normals with {} threads...\n").format(args.t))
-	for x in pool.imap_unordered(compareSamples, vcfs):
-		l -= 1
-		if x[0] == False:
-			print(("\t[Warning] Comparison between {} and {} failed.").format(x[1], x[2]), flush = True)
-		else:		
-			print(("\tComparison between {} and {} successful. {:,d} sets remaining.").format(x[1], x[2], l), flush = True)
+	if args.queue:
+		# Claim comparisons from shared queue until every pair has been compared by some invocation
+		queue = WorkQueue(args.queue)
+		units = dict([(",".join([v.type, v.v, v.n]), v) for v in vcfs])
+		n = queue.populate(list(units.keys()), args.chunk, partial(indexInputs, vcfs))
+		if n > 0:
+			print(("\tAdded {:,d} items to work queue.").format(n))
+		pool = Pool(processes = args.t, initializer = initWorker)
+		name = os.path.basename(sink.Outfile)
+		results = drain(queue, units.get, compareSamples, pool, args.t, lambda x: [[name, x[3]]] if x[0] else [], {name: sink})
+	elif args.speculate:
+		# Duplicate comparisons which run much longer than the median
+		results = Speculator(args.t, args.speculate, initializer = initWorker, check = lambda x: x[0]).run(compareSamples, vcfs, duplicateComparison)
+	else:
+		pool = Pool(processes = args.t, initializer = initWorker)
+		results = pool.imap_unordered(compareSamples, vcfs, getChunksize(l, args.t))
+	try:
+		for x in results:
+			l -= 1
+			if x[0] == False:
+				print(("\t[Warning] Comparison between {} and {} failed.").format(x[1], x[2]), flush = True)
+			elif args.queue:
+				print(("\tComparison between {} and {} successful.").format(x[1], x[2]), flush = True)
+			else:		
+				sink.add(x[3])
+				print(("\tComparison between {} and {} successful. {:,d} sets remaining.").format(x[1], x[2], l), flush = True)
+		if pool:
+			pool.close()
+			pool.join()
+	finally:
+		sink.close()
+	PROFILER.merge()
 	print(("\tFinished. Runtime: {}\n").format(datetime.now()-start))
 
 if __name__ == "__main__":
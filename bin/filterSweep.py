@@ -0,0 +1,303 @@
+'''This script will evaluate a grid of filtering thresholds over existing filterVCFs output in a single pass.'''
+
+import os
+import gzip
+import numpy as np
+from argparse import ArgumentParser
+from datetime import datetime
+from glob import glob
+from itertools import product
+from multiprocessing import Pool, cpu_count
+from sys import stderr
+from unixpath import checkDir
+from commonUtil import getConf
+
+TUMOR = ["min_covA", "min_reads_strand"]
+COVB = ["min_covB", "max_altB", "max_prop_altB"]
+NAB = ["min_covN", "max_reads_altN", "max_freq_altN"]
+# heterAnalyzer defaults
+DEFAULTS = {"min_covB": 15, "max_altB": 0, "max_prop_altB": 0.0, "min_covN": 5, "max_reads_altN": 15, "max_freq_altN": 0.3}
+
+def openFile(infile):
+	# Returns text handle for plain or gzipped file
+	if infile.endswith(".gz"):
+		return gzip.open(infile, "rt")
+	return open(infile, "r")
+
+def findFile(infile):
+	# Returns name of plain or gzipped file if either exists
+	for i in [infile, infile + ".gz"]:
+		if os.path.isfile(i):
+			return i
+	return None
+
+def maxValue(val):
+	# Returns maximum integer from comma separated format value
+	ret = -1
+	for i in val.split(","):
+		if i and i != ".":
+			try:
+				ret = max(ret, int(i))
+			except ValueError:
+				pass
+	return ret
+
+class Calls():
+	# Stores FORMAT values from one FilterMutectCalls output as arrays
+	def __init__(self, infile):
+		self.Keys = []
+		self.Germline = []
+		self.Qual = []
+		self.DP = []
+		self.F1R2 = []
+		self.F2R1 = []
+		self.__readVCF__(infile)
+
+	def __readVCF__(self, infile):
+		# Reads fields used by bcftools filter; any sample passing a threshold passes the record (as in DP[*])
+		with openFile(infile) as f:
+			for line in f:
+				if line[0] == "#":
+					continue
+				s = line.rstrip("\n").split("\t")
+				fmt = s[8].split(":")
+				vals = {"DP": -1, "F1R2": -1, "F2R1": -1, "AD": -1}
+				for sample in s[9:]:
+					for k, v in zip(fmt, sample.split(":")):
+						if k in vals.keys():
+							if k == "AD":
+								# Use total depth if DP is missing
+								v = str(sum([max(0, maxValue(i)) for i in v.split(",")]))
+							vals[k] = max(vals[k], maxValue(v))
+				if vals["DP"] < 0:
+					vals["DP"] = vals["AD"]
+				self.Keys.append((s[0], s[1], s[3], s[4]))
+				# Same test as bcftools FILTER != 'germline_risk', which compares the whole FILTER set
+				self.Germline.append(s[6] == "germline_risk")
+				self.Qual.append(s[5] == ".")
+				self.DP.append(vals["DP"])
+				self.F1R2.append(vals["F1R2"])
+				self.F2R1.append(vals["F2R1"])
+
+class Coverage():
+	# Stores covB.sh/covN.sh output for lookup by site
+	def __init__(self, infile):
+		self.Sites = {}
+		if infile:
+			self.__readTable__(infile)
+
+	def __readTable__(self, infile):
+		# Stores reference and alternate read counts by chromosome and position
+		with openFile(infile) as f:
+			for line in f:
+				s = line.rstrip("\n").split("\t")
+				if len(s) >= 6:
+					self.Sites[(s[0], s[1])] = [max(0, maxValue(s[4])), max(0, maxValue(s[5]))]
+
+	def arrays(self, keys):
+		# Returns presence, reference, and alternate read arrays in order of keys
+		found = np.zeros(len(keys), dtype = bool)
+		ref = np.zeros(len(keys), dtype = np.int64)
+		alt = np.zeros(len(keys), dtype = np.int64)
+		for idx, k in enumerate(keys):
+			if (k[0], k[1]) in self.Sites.keys():
+				found[idx] = True
+				ref[idx], alt[idx] = self.Sites[(k[0], k[1])]
+		return found, ref, alt
+
+class Pair():
+	# Stores arrays for a pair of tumor samples over the union of their variants
+	def __init__(self, path):
+		self.ID = os.path.basename(path.rstrip("/"))
+		self.Keys = []
+		self.A = {}
+		self.B = {}
+		self.__load__(checkDir(path))
+
+	def __tumorArrays__(self, calls, index):
+		# Returns dict of arrays aligned to union of keys (missing records never pass)
+		n = len(self.Keys)
+		ret = {"in": np.zeros(n, dtype = bool), "pass": np.zeros(n, dtype = bool)}
+		for k in ["DP", "F1R2", "F2R1"]:
+			ret[k] = np.full(n, -1, dtype = np.int64)
+		idx = np.array([index[k] for k in calls.Keys], dtype = np.int64)
+		ret["in"][idx] = True
+		ret["pass"][idx] = ~np.array(calls.Germline, dtype = bool) & np.array(calls.Qual, dtype = bool)
+		ret["DP"][idx] = calls.DP
+		ret["F1R2"][idx] = calls.F1R2
+		ret["F2R1"][idx] = calls.F2R1
+		return ret
+
+	def __load__(self, path):
+		# Reads FilterMutectCalls output and coverage tables
+		a = findFile(path + "A.unfiltered.vcf")
+		b = findFile(path + "B.unfiltered.vcf")
+		if not a or not b:
+			raise FileNotFoundError(("Cannot find unfiltered vcfs for {}").format(self.ID))
+		a = Calls(a)
+		b = Calls(b)
+		index = {}
+		for k in a.Keys + b.Keys:
+			if k not in index.keys():
+				index[k] = len(self.Keys)
+				self.Keys.append(k)
+		self.A = self.__tumorArrays__(a, index)
+		self.B = self.__tumorArrays__(b, index)
+		# Coverage in B of sites private to A is used to filter A (and vice versa)
+		self.A["covB"] = Coverage(findFile(path + "B_unfiltered/B.private.tsv")).arrays(self.Keys)
+		self.B["covB"] = Coverage(findFile(path + "A_unfiltered/A.private.tsv")).arrays(self.Keys)
+		normal = Coverage(findFile(path + "normalVariants.tsv")).arrays(self.Keys)
+		self.A["nab"] = normal
+		self.B["nab"] = normal
+
+def tumorMask(t, mina, strand):
+	# Returns bcftools filter mask for one tumor
+	mask = t["pass"].copy()
+	if mina is not None:
+		mask &= t["DP"] >= mina
+	if strand is not None:
+		mask &= (t["F1R2"] >= strand) & (t["F2R1"] >= strand)
+	return mask
+
+def coverageMask(cov, minc, maxalt, maxprop):
+	# Returns heterAnalyzer mask (filters set to 0 are not applied)
+	found, ref, alt = cov
+	mask = found.copy()
+	if minc > 0:
+		mask &= ref > minc
+	if maxalt > 0:
+		mask &= alt < maxalt
+	if maxprop > 0.0:
+		# Match float division in heterAnalyzer (0/0 is NaN and passes)
+		with np.errstate(divide = "ignore", invalid = "ignore"):
+			prop = alt.astype(float) / ref.astype(float)
+		mask &= ~(prop >= maxprop)
+	return mask
+
+def summarize(a, b, unfa, unfb):
+	# Returns private a, private b, common, and similarity as calculated by Samples.compareVCFs
+	pa = int(np.count_nonzero(a & ~unfb))
+	pb = int(np.count_nonzero(b & ~unfa))
+	c = 0
+	sim = 0.0
+	if pa > 0 and pb > 0:
+		c = int(np.count_nonzero((a & unfb) | (b & unfa)))
+		sim = c/(pa+pb+c)
+	return pa, pb, c, sim
+
+def sweepPair(args):
+	# Evaluates every combination of thresholds for one pair and returns csv rows
+	path, grid = args
+	rows = []
+	try:
+		p = Pair(path)
+	except (FileNotFoundError, OSError) as e:
+		print(("\t[Warning] {}. Skipping.").format(e), file=stderr)
+		return [path, rows]
+	# Compute masks for each group of parameters once
+	tumor = {}
+	for t in product(*[grid[i] for i in TUMOR]):
+		tumor[t] = [tumorMask(p.A, *t), tumorMask(p.B, *t)]
+	covb = {}
+	for t in product(*[grid[i] for i in COVB]):
+		covb[t] = [coverageMask(p.A["covB"], *t), coverageMask(p.B["covB"], *t)]
+	nab = {}
+	for t in product(*[grid[i] for i in NAB]):
+		nab[t] = [coverageMask(p.A["nab"], *t), coverageMask(p.B["nab"], *t)]
+	for t in tumor.keys():
+		unfa, unfb = tumor[t]
+		stages = {"unfiltered": summarize(unfa, unfb, unfa, unfb)}
+		for cb in covb.keys():
+			fa = unfa & covb[cb][0]
+			fb = unfb & covb[cb][1]
+			stages["covB"] = summarize(fa, fb, unfa, unfb)
+			for n in nab.keys():
+				stages["NAB"] = summarize(fa & nab[n][0], fb & nab[n][1], unfa, unfb)
+				params = [str(i) for i in list(t) + list(cb) + list(n)]
+				for s in ["unfiltered", "covB", "NAB"]:
+					pa, pb, c, sim = stages[s]
+					rows.append(("{},{},{},{},{},{},{:.2%}").format(p.ID, ",".join(params), s, pa, pb, c, sim))
+	return [path, rows]
+
+#-----------------------------------------------------------------------------
+
+def parseValues(val, typ):
+	# Returns list of values from comma separated string
+	if val is None:
+		return [None]
+	return [typ(i) for i in val.split(",")]
+
+def getGrid(args, conf):
+	# Returns dict of threshold lists (defaults to values from config file)
+	grid = {}
+	for i in TUMOR + COVB + NAB:
+		typ = int
+		if "prop" in i or "freq" in i:
+			typ = float
+		val = getattr(args, i)
+		if val is None:
+			if i in conf.keys():
+				val = str(conf[i])
+			elif i in DEFAULTS.keys():
+				val = str(DEFAULTS[i])
+		grid[i] = parseValues(val, typ)
+	return grid
+
+def changedValues(grid, conf):
+	# Returns tumor thresholds which differ from the config file
+	# Coverage tables only contain sites which were private under the original values, so any other value miscounts the private sets
+	ret = []
+	for i in TUMOR:
+		orig = conf[i] if i in conf.keys() else None
+		for v in grid[i]:
+			if v != orig:
+				ret.append(("{}={} (config file {})").format(i, v, orig))
+	return ret
+
+def main():
+	starttime = datetime.now()
+	parser = ArgumentParser("This script will evaluate a grid of filtering thresholds over existing filterVCFs output \
+in a single pass. Give comma separated values for any threshold to include it in the grid.")
+	parser.add_argument("-t", type = int, default = 1, help = "Number of threads.")
+	parser.add_argument("-c", help = "Path to config file (thresholds not given on the command line are read from here).")
+	parser.add_argument("-i", help = "Path to filterVCFs output directory (default is output_directory from config file).")
+	parser.add_argument("-o", help = "Path to output csv (default is sweep.csv in the input directory).")
+	for i in TUMOR + COVB + NAB:
+		parser.add_argument("--" + i, help = ("Comma separated values for {}.").format(i))
+	args = parser.parse_args()
+	conf = {}
+	if args.c:
+		conf, _ = getConf(args.c)
+	if args.i:
+		indir = checkDir(args.i)
+	elif "outpath" in conf.keys():
+		indir = conf["outpath"]
+	else:
+		print("\n\t[Error] Please specify an input directory or config file. Exiting.\n", file=stderr)
+		quit()
+	if not args.o:
+		args.o = indir + "sweep.csv"
+	if args.t > cpu_count():
+		args.t = cpu_count()
+	grid = getGrid(args, conf)
+	changed = changedValues(grid, conf)
+	if changed:
+		print(("\n\t[Error] Tumor thresholds must match the original run (give the config file used by filterVCFs): {}. Exiting.\n").format(", ".join(changed)), file=stderr)
+		quit()
+	paths = [i for i in glob(indir + "*/") if os.path.isdir(i)]
+	total = 1
+	for i in grid.values():
+		total *= len(i)
+	print(("\n\tEvaluating {:,d} threshold combinations over {:,d} pairs with {} threads...").format(total, len(paths), args.t))
+	pool = Pool(processes = args.t)
+	with open(args.o, "w") as out:
+		out.write(("ID,{},Stage,#PrivateA,#PrivateB,#Common,%Similarity\n").format(",".join(TUMOR + COVB + NAB)))
+		for x in pool.imap_unordered(sweepPair, [[i, grid] for i in paths]):
+			if x[1]:
+				out.write("\n".join(x[1]) + "\n")
+	pool.close()
+	pool.join()
+	print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
+
+if __name__ == "__main__":
+	main()
@@ -2,6 +2,7 @@
 
 import os
 from shutil import rmtree
+from functools import partial
 from argparse import ArgumentParser
 from sys import stderr
 from datetime import datetime
@@ -10,6 +11,12 @@ from multiprocessing import Pool, cpu_count
 from commonUtil import *
 from samples import *
 from sample import *
+from resultSink import ResultSink
+from variantStore import VariantStore
+from scheduling import getChunksize, getHistory, orderByCost
+from speculate import Speculator, scratchPath
+from workQueue import WorkQueue, drain
+from progress import EVENTS, PROGRESS, fileSize
 from unixpath import checkDir
 
 def cleanUp(outpath):
@@ -34,10 +41,14 @@ def cleanUp(outpath):
 				# Remove variants extracted from normal bam
 				os.remove(i)
 
+@traced()
 def filterPair(S):
 	# Filters and compares pair of samples
 	covb = False
 	nab = False
+	if S.State.isComplete():
+		# Finished before its rows were written to the summary files
+		return [True, S.ID, S.State.results()]
 	rg = S.rmGermline()
 	if rg == True:
 		# Add summary to unfiltered log and use output of bcfIsec
@@ -79,10 +90,37 @@ def filterPair(S):
 						cleanUp(S.Outdir)
 		else:
 			nab = False
-	return [nab, S.ID]
+	# Write human-readable log
+	S.State.export()
+	# Return every stored row so rows of steps finished by an earlier run reach the summary files
+	return [nab, S.ID, S.State.results()]
+
+def duplicatePair(root, S):
+	# Returns pair which restarts filtering in scratch output tree and replaces the output of the original if it finishes first
+	D = S.speculativeCopy(root)
+
+	def finish(x):
+		# Moves events of the duplicate to the output tree
+		S.State.adopt(D.State)
+		S.State.export()
+		return x
+
+	return filterPair, D, [[D.Outdir, S.Outdir, True, S.Existing]], finish
 
 #--------------------------------------------I/O------------------------------
 
+def getPair(conf, outdir, done, flog, blog, ulog, p):
+	# Returns Samples for input directory (None if the pair has finished filtering and its row is in the summary)
+	name = os.path.basename(p.rstrip("/"))
+	if conf["force"] == False and name in done and RunState(outdir + name + "/").isComplete():
+		return None
+	S = Samples()
+	S.setLogs(flog, ulog, blog, conf)
+	res = S.setSamples(p, outdir, done)
+	if res == True and S.ID not in done:
+		return S
+	return None
+
 def getOutdir(conf, outdir, done, flog, blog, ulog):
 	# Reads in dictionary of input samples
 	variants = []
@@ -91,34 +129,49 @@ def getOutdir(conf, outdir, done, flog, blog, ulog):
 	for p in paths:
 		if os.path.isfile(p) == False:
 			# Iterate through each subdirectory
-			S = Samples()
-			S.setLogs(flog, ulog, blog, conf)
-			res = S.setSamples(p, outdir, done)
-			if res == True and S.ID not in done:
+			S = getPair(conf, outdir, done, flog, blog, ulog, p)
+			if S is not None:
 				variants.append(S)
 	return variants
 
+def pairSize(S):
+	# Returns size of bams and vcfs read while filtering a pair
+	return fileSize([S.N.Bam, S.A.Bam, S.B.Bam, S.A.Output, S.B.Output])
+
 def getComplete(outdir,  force):
-	# Makes log file or returns list of completed samples
+	# Makes summary files or returns list of completed samples
+	sinks = {}
 	summary = outdir + "summary_NAB.csv"
 	ulog = outdir + "summary_unfiltered.csv"
 	blog = outdir + "summary_covB.csv"
 	for log in [ulog, blog, summary]:
-		# Check summary last to keep final output
-		first = True
-		done = []
-		if not os.path.isfile(log) or force == True:
-			with open(log, "w") as out:
-				# Initialize summary file and write header
-				out.write("ID,SampleA,SampleB,#PrivateA,#PrivateB,#Common,%Similarity\n")
-		else:
-			with open(log, "r") as f:
-				for line in f:
-					if first == False:
-						done.append(line.split(",")[0])
-					else:
-						first = False
-	return done, summary, blog, ulog
+		# Initialize summary file and write header
+		sinks[log] = ResultSink(log, "ID,SampleA,SampleB,#PrivateA,#PrivateB,#Common,%Similarity\n", force = force)
+	# Use summary to keep final output
+	done = set([i[0] for i in sinks[summary].Done])
+	return done, sinks, summary, blog, ulog
+
+def resetSummaries(sinks):
+	# Rewrites summary files with only their headers
+	for i in sinks.values():
+		i.reset()
+
+def getFilterScripts(args, batch, threads, n):
+	# Writes one batch script for each queue item (each job drains the queue and merges summary rows when it exits)
+	cmd = ("python filterVCFs.py -c {} -o {} --queue {} -t {} --nowait").format(os.path.abspath(args.c), os.path.abspath(args.o), 
+		os.path.abspath(args.queue), threads)
+	if args.cleanup == True:
+		cmd += " --cleanup"
+	if args.trace:
+		cmd += (" --trace {}").format(os.path.abspath(args.trace))
+	scripts = []
+	for i in range(n):
+		name = ("filter{:05d}").format(i + 1)
+		outfile = args.grid + name + ".sh"
+		# Jobs run from this directory so heterAnalyzer and the coverage scripts are found
+		writeBatchScript(outfile, batch, name, [("cd {}").format(os.getcwd()), cmd])
+		scripts.append(outfile)
+	return scripts
 
 def checkBin():
 	# Makes sure heterAnalyzer and bash scripts are present in working directory
@@ -142,32 +195,146 @@ and output will be written to same sub-directory).")
 help = "Remove intermediary files (default is to keep them).")
 	parser.add_argument("--force", action = "store_true", default = False,
 help = "Force script to re-run filtering (resumes from last complete step by default).")
+	parser.add_argument("--store", action = "store_true", default = False,
+help = "Load vcfs from each pair into variants.db in the output directory as soon as the pair finishes.")
+	parser.add_argument("--queue", help = "Path to shared work queue directory (any number of invocations on different nodes given the same \
+directory filter pairs from it cooperatively and merge their rows into the summary files).")
+	parser.add_argument("--chunk", type = int, default = 1, help = "Number of pairs in each work queue item (default = 1).")
+	parser.add_argument("--nowait", action = "store_true", default = False,
+help = "Exit when no work queue item is left to claim instead of waiting for other invocations to finish theirs.")
+	parser.add_argument("--grid", help = "Path to directory for filtering batch scripts. Pairs are added to the work queue (queue/ in this \
+directory unless --queue is given) and one batch script is written from the config template for each queue item.")
+	parser.add_argument("--submit", action = "store_true", default = False, help = "Submit grid batch scripts for execution (requires --grid).")
+	parser.add_argument("--speculate", type = float,
+help = "Duplicate pairs which run longer than this multiple of the median runtime into scratch output (overrides speculate in the config file).")
+	parser.add_argument("--profile", help = "Path to directory for cProfile stats of every process (merged into profile.txt when finished).")
+	parser.add_argument("--profile_memory", action = "store_true", default = False,
+help = "Also record tracemalloc snapshots of every process (requires --profile).")
+	parser.add_argument("--trace", help = "Path to directory for timeline trace files (opt-in; open the merged trace.json in Perfetto).")
 	args = parser.parse_args()
+	PROFILER.setPath(args.profile, args.profile_memory)
 	checkBin()
+	# Grid jobs use the requested number of threads on their own nodes
+	threads = args.t
+	if args.grid:
+		args.grid = checkDir(args.grid, True)
+		if not args.queue:
+			args.queue = args.grid + "queue/"
+		if args.store == True:
+			print("\t[Warning] --store is not used with --grid. Run variantStore.py once the jobs have finished.", file=stderr)
+			args.store = False
+	elif args.submit == True:
+		print("\n\t[Error] --submit requires --grid. Exiting.\n", file=stderr)
+		quit()
 	if args.t > cpu_count():
 		args.t = cpu_count()
-	# Load config file and discard batch template
-	conf, _ = getConf(args.c)
+	queue = None
+	if args.queue:
+		queue = WorkQueue(args.queue)
+		if queue.exists():
+			# Only the invocation which populates the queue may restart filtering
+			args.force = False
+	# Load config file (batch template is only used for grid jobs)
+	conf, batch = getConf(args.c)
+	if args.grid and not batch:
+		print("\n\t[Error] Please add a batch script template to the config file. Exiting.\n", file=stderr)
+		quit()
 	conf["cleanup"] = args.cleanup
 	conf["force"] = args.force
+	setHostLimits(conf)
+	setToolCache(conf)
 	if args.o:
 		args.o = checkDir(args.o, True)
-		done, flog, blog, ulog = getComplete(args.o, args.force)
 	else:
 		args.o = conf["outpath"]
-		done, flog, blog, ulog = getComplete(conf["outpath"], args.force)
-	variants = getOutdir(conf, args.o, done, flog, blog, ulog)
+	# Summary files are reset when the queue is populated
+	done, sinks, flog, blog, ulog = getComplete(args.o, args.force and queue is None)
+	if args.force == True:
+		done = set()
+	REGISTRY.setPath(args.o + "artifacts.db")
+	METRICS.setPath(args.o + METRICS_FILE)
+	PROGRESS.setPath(args.o + EVENTS)
+	if args.trace:
+		TRACER.setPath(args.trace)
+	elif "trace" in conf.keys():
+		TRACER.setPath(conf["trace"])
+	variants = []
+	if queue is None or not queue.exists():
+		# Invocations which join an existing queue only read the pairs they claim
+		variants = getOutdir(conf, args.o, done, flog, blog, ulog)
+	store = None
+	if args.store == True:
+		store = VariantStore(args.o + "variants.db")
+	# Start the longest pairs first using filtering runtimes from previous runs
+	history = getHistory([args.o + METRICS_FILE], exclude = ["mutect"])
+	variants = orderByCost(variants, pairSize, lambda x: x.ID, history)
 	l = len(variants)
-	pool = Pool(processes = args.t)
-	print(("\tComparing samples from {} sets with {} threads...\n").format(l, args.t))
-	for x in pool.imap_unordered(filterPair, variants):
-		l -= 1
-		if x[0] == False:
-			print(("\t[Warning] Some files from {} failed comparison.").format(x[1]), flush = True)
-		else:		
-			print(("\tAll comparisons for {} run successfully. {} samples remaining.").format(x[1], l), flush = True)
-	pool.close()
-	pool.join()
+	pool = None
+	if queue is not None:
+		print(("\tComparing samples from work queue {} with {} threads...\n").format(args.queue, args.t))
+	else:
+		print(("\tComparing samples from {} sets with {} threads...\n").format(l, args.t))
+	if args.speculate:
+		conf["speculate"] = args.speculate
+	scratch = ("{}_{}/").format(scratchPath(args.o), os.getpid())
+	if queue is not None:
+		# Claim pairs from shared queue until every pair has been filtered by some invocation
+		n = queue.populate([S.ID for S in variants], args.chunk, partial(resetSummaries, sinks))
+		if n > 0:
+			print(("\tAdded {:,d} items to work queue.").format(n))
+		if args.grid:
+			# Write one job for each item which is waiting (including expired claims of jobs which died)
+			queue.reclaim()
+			scripts = getFilterScripts(args, batch, threads, queue.status()["todo"])
+			print(("\tWrote {:,d} batch scripts to {}.").format(len(scripts), args.grid))
+			if args.submit == True:
+				cwd = os.getcwd()
+				submitJobs(scripts, batch, args.grid)
+				os.chdir(cwd)
+			results = []
+		else:
+			pool = Pool(processes = args.t, initializer = initWorker)
+			# Pairs are read when they are claimed unless this invocation already read them to populate the queue
+			loaded = dict([(S.ID, S) for S in variants])
+			units = lambda x: loaded.pop(x) if x in loaded.keys() else getPair(conf, args.o, done, flog, blog, ulog, conf["outpath"] + x)
+			results = drain(queue, units, filterPair, pool, args.t, lambda x: x[2],
+				dict([(os.path.basename(k), v) for k, v in sinks.items()]), wait = not args.nowait)
+	elif "speculate" in conf.keys():
+		# Duplicate pairs which run much longer than the median into a scratch output tree
+		results = Speculator(args.t, conf["speculate"], initializer = initWorker, check = lambda x: x[0]).run(filterPair, variants,
+			partial(duplicatePair, scratch))
+	else:
+		pool = Pool(processes = args.t, initializer = initWorker)
+		results = pool.imap_unordered(filterPair, variants, getChunksize(l, args.t, True))
+	try:
+		for x in results:
+			l -= 1
+			if queue is None:
+				for log, row in x[2]:
+					# Write summary rows from parent process only (rows of earlier runs may already be present)
+					sink = sinks[args.o + log]
+					if not sink.has(*sink.key(row)):
+						sink.add(row)
+			if x[0] == False:
+				print(("\t[Warning] Some files from {} failed comparison.").format(x[1]), flush = True)
+			elif queue is not None:
+				# Other invocations process the remaining pairs
+				print(("\tAll comparisons for {} run successfully.").format(x[1]), flush = True)
+			else:		
+				print(("\tAll comparisons for {} run successfully. {} samples remaining.").format(x[1], l), flush = True)
+			if store:
+				# Load from parent process so only one writer updates the store
+				store.loadPair(args.o + x[1])
+		if pool:
+			pool.close()
+			pool.join()
+	finally:
+		for i in sinks.values():
+			i.close()
+	if os.path.isdir(scratch):
+		rmtree(scratch)
+	TRACER.merge()
+	PROFILER.merge()
 	print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
 
 if __name__ == "__main__":
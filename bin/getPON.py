@@ -6,23 +6,35 @@ from sys import stderr
 from datetime import datetime
 from runPair import callMutect
 from commonUtil import *
+from ponStore import PONStore
 
-def makePON(infiles, outfile, gatk):
-	# Calls mutect to create a new panel of normals
+def readNormals(infiles):
+	# Returns list of normal vcfs from log file
 	first = True
-	if gatk:
-		# Format command for calling gatk jar
-		cmd = ("java -jar {} CreateSomaticPanelOfNormals -O {}").format(gatk, outfile)
-	else:
-		cmd = ("gatk CreateSomaticPanelOfNormals -O {}").format(outfile)
+	vcfs = []
 	with open(infiles, "r") as f:
 		for line in f:
 			if first == False and line[0] != "#":
 				splt = line.split("\t")
 				if len(splt) >= 2:
-					cmd += (" -vcfs {}").format(splt[1].strip())
+					vcfs.append(splt[1].strip())
 			else:
 				first = False
+	return vcfs
+
+def makePON(infiles, outfile, gatk):
+	# Calls mutect to create a new panel of normals
+	if gatk:
+		# Format command for calling gatk jar
+		cmd = ("java -jar {} CreateSomaticPanelOfNormals -O {}").format(gatk, outfile)
+	else:
+		cmd = ("gatk CreateSomaticPanelOfNormals -O {}").format(outfile)
+	# Pass vcfs in an arguments file to avoid command line length limits
+	argfile = outfile[:outfile.find(".")] + ".args"
+	with open(argfile, "w") as out:
+		for i in readNormals(infiles):
+			out.write(("-vcfs {}\n").format(i))
+	cmd += (" --arguments_file {}").format(argfile)
 	log = outfile[:outfile.find(".")] + ".stdout"
 	res = runProc(cmd, log)
 	if res == True:
@@ -30,6 +42,21 @@ def makePON(infiles, outfile, gatk):
 	else:
 		return None
 
+def incrementalPON(infiles, outfile, workspace, threads, minimum, rebuild):
+	# Imports new normals into sharded site counts and writes panel of normals from all shards
+	store = PONStore(workspace, minimum)
+	if rebuild == True:
+		store.rebuild()
+	store.importNormals(readNormals(infiles), threads)
+	if outfile.endswith(".gz"):
+		outfile = outfile[:-3]
+	print("\tMerging shards...")
+	gz = tabix(store.merge(outfile, threads), force = True)
+	if gz is None:
+		return False
+	print(("\tPanel of normals written to {}").format(gz))
+	return True
+
 def submitNormal(conf):
 	# Builds mutect command
 	if "picard" in conf.keys():
@@ -99,6 +126,10 @@ def getConfig(args):
 			conf["af"] = args.af
 	if args.e:
 		conf["contaminant"] = args.e	
+	if args.lockdir:
+		conf["lockdir"] = args.lockdir
+		conf["max_jvms"] = args.max_jvms
+		conf["max_bams"] = args.max_bams
 	return conf
 
 def main():
@@ -107,6 +138,14 @@ def main():
 only mode and assemble a panel of normals. Be sure that pysam is installed and that bcftools is in your PATH.")
 	parser.add_argument("--pon", default = False, action = "store_true", help = "Generate new \
 panel of normals from log file (requires -l (output from tumor only mode) and -o (output PON file) flags only).")
+	parser.add_argument("--incremental", default = False, action = "store_true", help = "Build panel of normals \
+from sharded site counts, importing only normals which have not been imported (use with --pon and -w).")
+	parser.add_argument("-w", help = "Path to workspace directory for incremental panel of normals.")
+	parser.add_argument("--min_samples", type = int, default = 2,
+help = "Minimum number of normals a site must be found in for incremental panel of normals (default = 2).")
+	parser.add_argument("--rebuild", default = False, action = "store_true",
+help = "Re-import all normals into incremental workspace.")
+	parser.add_argument("-t", type = int, default = 1, help = "Number of threads for incremental panel of normals.")
 	parser.add_argument("-s", help = "Sample name (required).")
 	parser.add_argument("-l", help = "Path to log file (required; output files are recorded here).")
 	parser.add_argument("-c", help = "Path to normal/control bam (required).")
@@ -118,17 +157,32 @@ panel of normals from log file (requires -l (output from tumor only mode) and -o
 	parser.add_argument("-g", help = "Path to germline resource.")
 	parser.add_argument("--af", help = "Estimated allele frequency (required if using a germline resource).")
 	parser.add_argument("-e", help = "Path to contmination estimate vcf.")
+	parser.add_argument("--lockdir", help = "Path to directory of host-wide lock files (limits are shared by all jobs on a node).")
+	parser.add_argument("--max_jvms", type = int, help = "Maximum number of gatk/picard JVMs per node (requires --lockdir).")
+	parser.add_argument("--max_bams", type = int, help = "Maximum number of processes reading bam files per node (requires --lockdir).")
+	parser.add_argument("--trace", help = "Path to directory for timeline trace files (opt-in; open the merged trace.json in Perfetto).")
 	args = parser.parse_args()
+	TRACER.setPath(args.trace)
+	if args.lockdir:
+		setHostLimits({"lockdir": args.lockdir, "max_jvms": args.max_jvms, "max_bams": args.max_bams})
 	if args.pon == True:
 		print("\n\tGenerating panel of normals...")
-		status = makePON(args.l, args.o, args.gatk)
+		if args.incremental == True:
+			if not args.w:
+				print("\n\t[Error] Please specify a workspace directory with -w. Exiting.\n", file=stderr)
+				quit()
+			status = incrementalPON(args.l, args.o, args.w, args.t, args.min_samples, args.rebuild)
+		else:
+			status = makePON(args.l, args.o, args.gatk)
 		if status == False:
 			print("\n\t[Error] Could not generate panel of normals. Exiting.", file=stderr)
 	else:
 		conf = getConfig(args)
+		setHostLimits(conf)
 		# Call mutect
 		print(("\n\tCalling Mutect2 in tumor-only mode on {}....").format(conf["sample"]))
 		status = submitNormal(conf)
+	TRACER.merge()
 	if status == True:
 		print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
 
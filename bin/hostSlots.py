@@ -0,0 +1,93 @@
+'''This script defines a class for limiting the number of heavy processes running on a node,
+regardless of which batch job started them'''
+
+import os
+import fcntl
+import socket
+from time import sleep
+from sys import stderr
+
+class HostSlots():
+	# Stores host-wide slot limits for each class of process and the lock files held by this process
+	def __init__(self):
+		self.Dir = ""
+		self.Host = socket.gethostname().split(".")[0]
+		self.Limits = {}
+		self.Wait = 5
+
+	def setLimits(self, lockdir, jvms = None, bams = None):
+		# Enables admission control if a lock directory and at least one limit are given
+		if not lockdir:
+			return False
+		if not os.path.isdir(lockdir):
+			try:
+				os.makedirs(lockdir, exist_ok = True)
+			except OSError:
+				print(("\t[Warning] Could not create lock directory {}. Host limits disabled.").format(lockdir), file=stderr)
+				return False
+		if lockdir[-1] != "/":
+			lockdir += "/"
+		self.Dir = lockdir
+		for k, v in [["jvm", jvms], ["bam", bams]]:
+			if v is not None and int(v) > 0:
+				self.Limits[k] = int(v)
+		return self.enabled()
+
+	def enabled(self):
+		# Returns True if any limit has been set
+		return len(self.Dir) > 0 and len(self.Limits) > 0
+
+	def getKinds(self, cmd):
+		# Returns sorted list of slot types required by command
+		kinds = set()
+		s = cmd.split()
+		if not s:
+			return []
+		if s[0] in ["java", "gatk", "picard"]:
+			kinds.add("jvm")
+		for i in s:
+			if i.endswith("covB.sh") or i.endswith("covN.sh"):
+				# HaplotypeCaller is called on bam files
+				kinds.add("jvm")
+				kinds.add("bam")
+			elif i.endswith(".bam") and "jvm" in kinds:
+				kinds.add("bam")
+		# Always acquire in the same order to avoid deadlocks between processes
+		return sorted([i for i in kinds if i in self.Limits.keys()])
+
+	def __tryLock__(self, kind):
+		# Attempts to lock each slot file for kind once; returns open file or None
+		for i in range(self.Limits[kind]):
+			path = ("{}{}.{}.{}.lock").format(self.Dir, self.Host, kind, i)
+			f = open(path, "a")
+			try:
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return f
+			except OSError:
+				f.close()
+		return None
+
+	def acquire(self, kinds):
+		# Blocks until one slot of each kind is held and returns list of open lock files
+		held = []
+		if self.enabled():
+			for k in kinds:
+				if k not in self.Limits.keys():
+					continue
+				f = self.__tryLock__(k)
+				while f is None:
+					sleep(self.Wait)
+					f = self.__tryLock__(k)
+				held.append(f)
+		return held
+
+	def release(self, held):
+		# Releases all given lock files (locks are also released if the process dies)
+		for f in held:
+			try:
+				fcntl.flock(f, fcntl.LOCK_UN)
+			finally:
+				f.close()
+
+# Shared by every module in this process; set by each entry point
+SLOTS = HostSlots()
@@ -0,0 +1,168 @@
+'''This script records the resource usage of each external tool call and reports which tools and samples use the most core-hours'''
+
+import os
+import json
+from argparse import ArgumentParser
+from glob import glob
+from socket import gethostname
+from sys import stderr
+from time import time
+
+METRICS_FILE = "toolMetrics.jsonl"
+
+def toolName(cmd):
+	# Returns name of tool and subcommand from command
+	s = cmd.split()
+	if not s:
+		return ""
+	if s[0] == "java" and "-jar" in s:
+		idx = s.index("-jar") + 1
+		ret = os.path.basename(s[idx]) if idx < len(s) else "java"
+		ret = ret[:ret.find(".")] if "." in ret else ret
+		for i in s[idx+1:]:
+			if i[0] != "-":
+				# Add tool name (i.e. FilterMutectCalls)
+				return ret + " " + i
+		return ret
+	ret = os.path.basename(s[0])
+	if len(s) > 1 and s[1][0] != "-" and "/" not in s[1] and "." not in s[1]:
+		# Get subcommand if present (i.e. bcftools isec)
+		ret += " " + s[1]
+	return ret
+
+def readIO(pid):
+	# Returns dict of i/o counters from /proc (empty if they cannot be read)
+	ret = {}
+	try:
+		with open(("/proc/{}/io").format(pid), "r") as f:
+			for line in f:
+				k, v = line.split(":")
+				ret[k.strip()] = int(v)
+	except (OSError, ValueError):
+		pass
+	return ret
+
+def waitProc(call):
+	# Waits for Popen child, sets its return code, and returns resource usage and i/o counters
+	io = {}
+	try:
+		# Wait without reaping so /proc/<pid>/io can still be read
+		os.waitid(os.P_PID, call.pid, os.WEXITED | os.WNOWAIT)
+		io = readIO(call.pid)
+	except (OSError, AttributeError):
+		pass
+	_, status, usage = os.wait4(call.pid, 0)
+	call.returncode = os.waitstatus_to_exitcode(status)
+	return usage, io
+
+class ToolMetrics():
+	# Appends one json line per tool call tagged with the current pair, sample, and step (disabled unless a path is set)
+	def __init__(self):
+		self.Path = None
+		self.Host = gethostname()
+		self.Pair = ""
+		self.Sample = ""
+		self.Step = ""
+
+	def setPath(self, path):
+		# Stores metrics file path
+		self.Path = path
+
+	def enabled(self):
+		# Returns True if a metrics file has been set
+		return self.Path is not None
+
+	def setContext(self, pair = None, sample = None, step = None):
+		# Stores pair, sample, and step used to tag following records in this process
+		if pair is not None:
+			self.Pair = pair
+		if sample is not None:
+			self.Sample = sample
+		if step is not None:
+			self.Step = step
+
+	def record(self, cmd, start, returncode, usage, io):
+		# Writes record for one finished tool call
+		if not self.Path:
+			return
+		rec = {"time": start, "host": self.Host, "pair": self.Pair, "sample": self.Sample, "step": self.Step,
+			"tool": toolName(cmd), "cmd": cmd, "returncode": returncode, "wall": time() - start,
+			"user": usage.ru_utime, "sys": usage.ru_stime, "maxrss_kb": usage.ru_maxrss,
+			"read_bytes": io.get("read_bytes", 0), "write_bytes": io.get("write_bytes", 0),
+			"rchar": io.get("rchar", 0), "wchar": io.get("wchar", 0)}
+		try:
+			fd = os.open(self.Path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+			try:
+				os.write(fd, (json.dumps(rec) + "\n").encode())
+			finally:
+				os.close(fd)
+		except OSError:
+			pass
+
+# Shared by every module in this process; set by each entry point
+METRICS = ToolMetrics()
+
+#-----------------------------------------------------------------------------
+
+def readRecords(paths):
+	# Returns list of records from metrics files or output directories
+	ret = []
+	for p in paths:
+		if os.path.isdir(p):
+			files = glob(os.path.join(p, "**", METRICS_FILE), recursive = True)
+		else:
+			files = [p]
+		for i in files:
+			with open(i, "r") as f:
+				for line in f:
+					try:
+						ret.append(json.loads(line))
+					except ValueError:
+						pass
+	return ret
+
+def summarize(records, by):
+	# Returns rows of calls, core-hours, wall-hours, peak rss, and bytes grouped by given keys in decreasing order of core-hours
+	groups = {}
+	for r in records:
+		key = tuple([str(r.get(k, "")) for k in by])
+		if key not in groups.keys():
+			groups[key] = [0, 0.0, 0.0, 0, 0, 0]
+		g = groups[key]
+		g[0] += 1
+		g[1] += (r["user"] + r["sys"]) / 3600
+		g[2] += r["wall"] / 3600
+		g[3] = max(g[3], r["maxrss_kb"])
+		g[4] += r["read_bytes"]
+		g[5] += r["write_bytes"]
+	return sorted([list(k) + v for k, v in groups.items()], key = lambda x: x[len(by)+1], reverse = True)
+
+def main():
+	parser = ArgumentParser("This script reports which tools and samples use the most core-hours.")
+	parser.add_argument("--report", nargs = "+", help = "Paths to metrics files or output directories (searched recursively).")
+	parser.add_argument("--by", default = "tool", help = "Comma separated fields to group by (any of tool, pair, sample, step, host; default = tool).")
+	parser.add_argument("-n", type = int, default = 20, help = "Number of rows to print (default = 20).")
+	parser.add_argument("-o", help = "Optional path to write all rows as csv.")
+	args = parser.parse_args()
+	if not args.report:
+		print("\n\t[Error] Please specify at least one metrics file or output directory. Exiting.\n", file=stderr)
+		quit()
+	by = [i.strip() for i in args.by.split(",")]
+	records = readRecords(args.report)
+	rows = summarize(records, by)
+	total = sum([i[len(by)+1] for i in rows])
+	header = by + ["Calls", "CoreHours", "WallHours", "PeakRSS(Gb)", "ReadGb", "WriteGb"]
+	print(("\n\t{:,d} tool calls used {:.2f} core-hours.\n").format(len(records), total))
+	print("\t" + "\t".join(header))
+	for i in rows[:args.n]:
+		print("\t" + "\t".join(i[:len(by)] + [str(i[len(by)]), ("{:.2f}").format(i[len(by)+1]), ("{:.2f}").format(i[len(by)+2]),
+			("{:.2f}").format(i[len(by)+3] / 1048576), ("{:.2f}").format(i[len(by)+4] / 1e9), ("{:.2f}").format(i[len(by)+5] / 1e9)]))
+	if args.o:
+		with open(args.o, "w") as out:
+			out.write(",".join(header) + "\n")
+			for i in rows:
+				out.write(",".join([str(j) for j in i]) + "\n")
+	print()
+
+if __name__ == "__main__":
+	main()
@@ -1,35 +1,16 @@
 '''This script will call MuTect2 on a given list of input files'''
 
 import os
+import hashlib
 from argparse import ArgumentParser
 from sys import stderr
 from datetime import datetime
 from subprocess import Popen
 from shlex import split
 from commonUtil import *
-
-def submitJobs(scripts, batch, outdir):
-	# Determines grid type and submits jobs
-	os.chdir(outdir)
-	cmd = ""
-	for line in batch:
-		if "#SBATCH" in line:
-			cmd = "sbatch "
-			break
-		elif "#PBS" in line:
-			cmd = "qsub "
-			break
-	if len(cmd) <= 3:
-		print("\t[Error] Cannot determine grid type. Exiting.\n")
-		quit()
-	for i in scripts:
-		try:
-			# Submit each batch script
-			Popen(split(cmd + i + " \n"))
-		except:
-			print(("\t[Error] Could not submit {}").format(i))
-	print()
-	return True
+from planner import Planner
+from scheduling import getHistory, orderByCost
+from progress import fileSize
 
 def getCommand(conf):
 	# Returns base python call for all files
@@ -44,6 +25,8 @@ def getCommand(conf):
 			cmd += ("-g {} --af {} ").format(conf["germline"], conf["af"])
 		if "mo" in conf.keys():
 			cmd += ('--mo "{} "').format(conf["mo"])
+		if "speculate" in conf.keys():
+			cmd += ("--speculate {} ").format(conf["speculate"])
 	else:
 		# Format for tumor-only mode
 		cmd = ("python getPON.py -l {} -r {} ").format(conf["outpath"] + "normalsLog.txt", conf["ref"])
@@ -51,31 +34,28 @@ def getCommand(conf):
 			with open(conf["outpath"] + "normalsLog.txt", "w") as f:
 				# initilize lof file
 				f.write("Sample\tVCF\n")
-	for i in ["bed", "gatk", "picard"]:
+	for i in ["bed", "gatk", "picard", "lockdir", "max_jvms", "max_bams", "trace"]:
 		if i in conf.keys() and conf[i] != None:
 			cmd += ("--{} {} ").format(i, conf[i])
 	return cmd
 
-def getBatchScripts(outdir, conf, batch, files):
-	# Generates new batch script for each set of samples
+def getBatchScripts(outdir, conf, batch, files, plan = None):
+	# Generates new batch script for each set of samples (using the tier assigned by plan if given)
 	cmd = getCommand(conf)
 	scripts = []
 	for i in files.keys():
 		print(("\tWriting batch script for {}...").format(i))
 		outfile = outdir + i + ".sh"
-		with open(outfile, "w") as output:
-			for line in batch:
-				if "--job-name=" in line:
-					output.write(("{}_{}\n").format(line.strip(), i))
-				else:
-					output.write(line)
-			if conf["newpon"] == False:
-				outpath = conf["outpath"] + i + "/"
-				c = cmd + ("-s {} -c {} -x {} -y {} -o {}").format(i, 
-					files[i][0], files[i][1], files[i][2], outpath)
-			else:
-				c = cmd + ("-s {} -c {} -o {}").format(i, files[i], conf["outpath"])
-			output.write(c + "\n")
+		template = batch
+		if plan is not None:
+			template = plan[i]["tier"].Lines
+		if conf["newpon"] == False:
+			outpath = conf["outpath"] + i + "/"
+			c = cmd + ("-s {} -c {} -x {} -y {} -o {}").format(i, 
+				files[i][0], files[i][1], files[i][2], outpath)
+		else:
+			c = cmd + ("-s {} -c {} -o {}").format(i, files[i], conf["outpath"])
+		writeBatchScript(outfile, template, i, [c])
 		scripts.append(outfile)
 	return scripts
 
@@ -117,8 +97,48 @@ def getManifest(infile, pon):
 
 #-----------------------------------------------------------------------------
 
-def checkReferences(conf):
-	# Ensures fasta and vcf index and dict files are present
+def resourceSource(vcf, bed):
+	# Returns string identifying the current versions of a resource and bed file
+	ret = []
+	for i in [vcf, bed]:
+		st = os.stat(i)
+		ret.append(("{}\t{}\t{}").format(os.path.abspath(i), st.st_size, st.st_mtime_ns))
+	return "\n".join(ret) + "\n"
+
+def subsetResource(vcf, bed, outdir):
+	# Returns path to copy of vcf subset to bed intervals, creating it if it is missing
+	# Versions of the resource and bed are part of the name so subsets read by queued jobs are never overwritten
+	name = os.path.split(vcf)[1]
+	name = name[:name.find(".vcf")] if ".vcf" in name else name
+	version = hashlib.sha1(resourceSource(vcf, bed).encode()).hexdigest()[:12]
+	outfile = ("{}{}.{}.{}.vcf.gz").format(outdir, name, getFileName(bed), version)
+	if os.path.isfile(outfile) and os.path.isfile(outfile + ".tbi"):
+		return outfile
+	print(("\tSubsetting {} to target intervals...").format(vcf))
+	tmp = ("{}_{}.vcf.gz").format(outfile[:-7], os.getpid())
+	res = runProc(("bcftools view -R {} -O z -o {} {}").format(bed, tmp, vcf))
+	if res == True and os.path.isfile(tmp) and tabix(tmp, force = True):
+		# Index is moved last so the subset is only used once both are in place
+		os.replace(tmp, outfile)
+		os.replace(tmp + ".tbi", outfile + ".tbi")
+		return outfile
+	for i in [tmp, tmp + ".tbi"]:
+		if os.path.isfile(i):
+			os.remove(i)
+	print(("\t[Warning] Could not subset {}. Using full resource.").format(vcf), file = stderr)
+	return vcf
+
+def subsetResources(conf, config):
+	# Replaces panel of normals and germline resource with copies subset to bed annotation
+	if "bed" in conf.keys():
+		outdir = checkDir(os.path.join(os.path.dirname(os.path.abspath(config)), "resources"), True)
+		for i in ["pon", "germline"]:
+			if i in conf.keys():
+				conf[i] = subsetResource(conf[i], conf["bed"], outdir)
+	return conf
+
+def checkReferences(conf, config, subset = True):
+	# Ensures fasta and vcf index and dict files are present and subsets resources to the bed annotation if subset is True
 	if not os.path.isdir(conf["outpath"]):
 		os.mkdir(conf["outpath"])
 	ref = conf["ref"]
@@ -143,6 +163,9 @@ def checkReferences(conf):
 					cmd = ("gatk IndexFeatureFile -F {}").format(conf["pon"])
 				fd = Popen(split(cmd), stdout=dn, stderr=dn)
 				fd.communicate()
+	if subset == True:
+		subsetResources(conf, config)
+
 def main():
 	starttime = datetime.now()
 	parser = ArgumentParser(description = "This script will call MuTect2 on a given \
@@ -159,7 +182,15 @@ help = "Path to space/tab/comma seperated text file of input files (format: ID N
 help = "Path to config file containing reference genome, java jars (if using), and mutect options.")
 	parser.add_argument("-o", default = "",
 help = "Path to batch script output directory (leave blank for current directory).")
+	parser.add_argument("--plan", action = "store_true", default = False,
+help = "Print predicted runtime, memory, scratch, and template tier of each sample with total core-hours and exit without writing batch scripts.")
+	parser.add_argument("--history", nargs = "*",
+help = "Paths to toolMetrics.jsonl files or output directories of previous runs used to fit the plan (the output directory in the config is always read).")
+	parser.add_argument("--profile", help = "Path to directory for cProfile stats of every process (merged into profile.txt when finished).")
+	parser.add_argument("--profile_memory", action = "store_true", default = False,
+help = "Also record tracemalloc snapshots of every process (requires --profile).")
 	args = parser.parse_args()
+	PROFILER.setPath(args.profile, args.profile_memory)
 	if not args.i and args.c:
 		print("\n\t[Error] Please specify input file and config file. Exiting.\n")
 		quit()
@@ -168,13 +199,30 @@ help = "Path to batch script output directory (leave blank for current directory
 	conf, batch = getConf(args.c)
 	conf["bamout"] = args.bamout
 	conf["newpon"] = args.newPON
-	checkReferences(conf)
+	# Resources are only subset when batch scripts will be written
+	checkReferences(conf, args.c, args.plan == False)
 	files = getManifest(args.i, conf["newpon"])
-	scripts = getBatchScripts(args.o, conf, batch, files)
+	# Write and submit the longest samples first using mutect runtimes from previous runs
+	order = orderByCost(list(files.keys()), lambda x: fileSize(files[x]), lambda x: x, getHistory([conf["outpath"]], steps = ["mutect"]))
+	files = dict([(i, files[i]) for i in order])
+	plan = None
+	if args.plan == True and not conf["templates"]:
+		print("\n\t[Error] Please add a batch script template to the config file to plan resources. Exiting.\n", file=stderr)
+		quit()
+	if args.plan == True or len(conf["templates"]) > 1:
+		planner = Planner(conf, conf["templates"], args.history)
+		plan = planner.plan(files)
+		planner.report(plan)
+		if args.plan == True:
+			PROFILER.merge()
+			print(("\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
+			return
+	scripts = getBatchScripts(args.o, conf, batch, files, plan)
 	if args.submit == True:
 		done = submitJobs(scripts, batch, args.o)
 	else:
 		done = True
+	PROFILER.merge()
 	if done == True:
 		print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
 
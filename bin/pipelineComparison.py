@@ -8,31 +8,43 @@ from datetime import datetime
 from argparse import ArgumentParser
 from sys import stderr
 from glob import glob
-from compareNormals import VCFcomparison, compareSamples
+from multiprocessing import Pool, cpu_count
+from compareNormals import VCFcomparison, compareSamples, indexInputs
 from commonUtil import *
+from resultSink import ResultSink
+from progress import EVENTS, PROGRESS
+from vcfHeader import readContigs, reheaderVCF
 from unixpath import *
 
 A = re.compile(r"AfiltcovBNAB.*different\.vcf")
 B = re.compile(r"BfiltcovBNAB.*different\.vcf")
 C = re.compile(r"filtcovBNABU.*common\.vcf")
 
-def comparePipelines(samples):
-	# Calls bcftools isec on each pair of vcfs and writes summary file
+def comparePipelines(samples, sink, threads = 1):
+	# Calls bcftools isec on each pair of vcfs and writes summary file as comparisons finish
 	print("\tComparing samples...")
+	vcfs = []
 	for s in samples.keys():
 		for t in ["A", "B", "Common"]:
-			# Iterate through list to keep fixed order
 			if t in samples[s].keys():
-				_ = compareSamples(samples[s][t])
+				vcfs.append(samples[s][t])
+	# A and B rows of a sample share the platypus common file, so each input is indexed once before comparisons start
+	indexInputs(vcfs)
+	pool = Pool(processes = threads, initializer = initWorker)
+	for res in pool.imap_unordered(compareSamples, vcfs):
+		if res[0] == True:
+			sink.add(res[3])
+	pool.close()
+	pool.join()
+	sink.close()
 
 def comparisonManifest(infile, outdir):
 	# Reads in dict of vcfs to compare
 	samples = {}
 	first = True
 	log = outdir + "comparisonSummary.csv"
-	with open(log, "w") as out:
-		# Initialize summary file and write header
-		out.write("ID,Comparison,Mutect(A),Platypus(B),#PrivateA,#PrivateB,#Common,%Similarity\n")
+	# Initialize summary file and write header
+	sink = ResultSink(log, "ID,Comparison,Mutect(A),Platypus(B),#PrivateA,#PrivateB,#Common,%Similarity\n", force = True)
 	# Get input
 	with open(infile, "r") as f:
 		for line in f:
@@ -46,7 +58,7 @@ def comparisonManifest(infile, outdir):
 					samples[s][spl[1]] = VCFcomparison(spl[1], spl[2], spl[3], log, outdir, sample = spl[0]) 
 			else:
 				first = False
-	return samples
+	return samples, sink
 
 #-----------------------------------------------------------------------------
 
@@ -84,33 +96,12 @@ def mergeSamples(outfile, mut, plat, ext):
 				rawSamples(out, i, mut[i], plat[i])
 
 def reheader(contigs, infile, outdir = None):
-	# Inserts contig lines into vcf header and returns outfile name
-	ins = True
-	ids = []
+	# Replaces contig lines in vcf header and returns outfile name
 	if outdir:
 		outfile = outdir + infile[infile.rfind("/")+1:]
 	else:
 		outfile = infile.replace(".vcf", "reheadered.vcf")
-	# Get list of ids in file and sort
-	with open(infile, "r") as f:
-		for line in f:
-			if line[0] != "#":
-				n = line.split("\t")[0]
-				if n not in ids:
-					ids.append(n)
-	with open(outfile, "w") as out:
-		with open(infile, "r") as f:
-			for line in f:
-				if "##FILTER=" in line and ins == True:
-					# Insert contigs before first filter line
-					for i in ids:
-						if i in contigs.keys():
-							out.write(contigs[i])
-						else:
-							print(("\t[Warning] {} not in example vcf header.").format(i), file=stderr)
-					ins = False
-				out.write(line)
-	return outfile
+	return reheaderVCF(infile, outfile, contigs = contigs)
 
 def platypusPaths(p, ext):
 	# Returns paths from vcfdict
@@ -135,29 +126,61 @@ def platypusPaths(p, ext):
 					break
 	return paths
 
-def getPlatypusOutput(path, outdir, contigs, ext):
-	# Returns dict of platypus output
-	plat = {}
-	paths = glob(path + "*/")
-	print("\tGetting platypus output...")
-	for p in paths:
-		sdir = None
-		p = checkDir(p)
-		sample = getParent(p)
-		paths = platypusPaths(p, ext)
-		plat[sample] = {}
-		if outdir:
-			# Copy to new location
-			sdir = checkDir(outdir + sample, True)
-		for i in paths.keys():
+def platypusTarget(infile, sdir, contigs):
+	# Returns name of copied or reheadered vcf (or infile if it is compressed in place)
+	if sdir:
+		return sdir + infile[infile.rfind("/")+1:]
+	elif contigs:
+		return infile.replace(".vcf", "reheadered.vcf")
+	return infile
+
+def platypusSample(args):
+	# Copies/reheaders and sorts platypus output for one sample
+	p, outdir, contigs, ext = args
+	sdir = None
+	p = checkDir(p)
+	sample = getParent(p)
+	paths = platypusPaths(p, ext)
+	ret = {}
+	if outdir:
+		# Copy to new location
+		sdir = checkDir(outdir + sample, True)
+	for i in paths.keys():
+		gz = platypusTarget(paths[i], sdir, contigs)
+		if not gz.endswith(".gz"):
+			gz += ".gz"
+		if REGISTRY.isValid(gz, index = True, source = paths[i]):
+			# Skip copy and reheader if compressed output was made from current version of input
+			vcf = gz
+		else:
+			keep = False
 			if contigs:
 				vcf = reheader(contigs, paths[i], sdir)
 			elif outdir:
 				vcf = copy(paths[i], sdir)
-			bcf = bcfSort(tabix(vcf))
-			if bcf == None:
-				bcf = ""
-			plat[sample][i] = bcf 
+			else:
+				# Compress alongside original platypus output
+				vcf = paths[i]
+				keep = True
+			if vcf:
+				vcf = tabix(vcf, force = True, keep = keep)
+			if vcf:
+				REGISTRY.record(vcf, index = True, source = paths[i])
+		bcf = bcfSort(vcf)
+		if bcf == None:
+			bcf = ""
+		ret[i] = bcf
+	return sample, ret
+
+def getPlatypusOutput(path, outdir, contigs, ext, threads = 1):
+	# Returns dict of platypus output
+	plat = {}
+	print("\tGetting platypus output...")
+	pool = Pool(processes = threads, initializer = initWorker)
+	for sample, ret in pool.imap_unordered(platypusSample, [[p, outdir, contigs, ext] for p in glob(path + "*/")]):
+		plat[sample] = ret
+	pool.close()
+	pool.join()
 	return plat
 
 def checkVCF(f):
@@ -177,49 +200,45 @@ def getNames(path, ext):
 		b = ("{}B.vcf").format(path)
 	return a, b, c
 
-def getMutectOutput(path, ext):
+def mutectSample(args):
+	# Indexes and sorts filtered mutect output for one sample (up to date files are skipped by tabix and bcfSort)
+	p, ext = args
+	p = checkDir(p)
+	full = getParent(p)
+	# Drop leading number from name
+	sample = full[full.find("_")+1:]
+	ret = {"a": "NA", "b": "NA", "c": "NA"}
+	# Get path names and check each file
+	a, b, c = getNames(p, ext)
+	pa = checkVCF(a)
+	if pa:
+		ret["a"] = bcfSort(pa)
+	pb = checkVCF(b)
+	if pb:
+		ret["b"] = bcfSort(pb)
+	if c:
+		common = checkVCF(c)
+		if common:
+			ret["c"] = bcfSort(common)
+	return sample, ret
+
+def getMutectOutput(path, ext, threads = 1):
 	# Returns dict of fitered mutect output
 	mut = {}
-	paths = glob(path + "*/")
 	print("\tGetting mutect output...")
-	for p in paths:
-		p = checkDir(p)
-		full = getParent(p)
-		# Drop leading number from name
-		sample = full[full.find("_")+1:]
-		mut[sample] = {}
-		mut[sample]["a"] = "NA"
-		mut[sample]["b"] = "NA"
-		mut[sample]["c"] = "NA"
-		# Get path names and check each file
-		a, b, c = getNames(p, ext)
-		pa = checkVCF(a)
-		if pa:
-			mut[sample]["a"] = bcfSort(pa)
-		pb = checkVCF(b)
-		if pb:
-			mut[sample]["b"] = bcfSort(pb)
-		if c:
-			common = checkVCF(c)
-			if common:
-				mut[sample]["c"] = bcfSort(common)
+	pool = Pool(processes = threads, initializer = initWorker)
+	for sample, ret in pool.imap_unordered(mutectSample, [[p, ext] for p in glob(path + "*/")]):
+		mut[sample] = ret
+	pool.close()
+	pool.join()
 	return mut
 
 #-----------------------------------------------------------------------------
 
 def getContigs(infile):
-	# Reads contig info from vcf header
-	contigs = {}
-	print("\tGetting contigs from vcf header...")
-	with open(infile, "r") as f:
-		for line in f:
-			if line[0] != "#":
-				break
-			if "##contig=" in line:
-				spl = line.split(",")
-				name = spl[0][spl[0].rfind("=")+1:]
-				contigs[name] = line
-	return contigs
+	# Reads contig info from vcf header or reference fasta index/dict
+	print("\tGetting contigs from reference...")
+	return readContigs(infile)
 
 def getExt(raw, unfiltered):
 	# Returns extension for type of comparison
@@ -248,6 +267,8 @@ def checkArgs(args):
 	else:
 		checkFile(args.i)
 		args.o = checkDir(args.o, True)
+	if args.t > cpu_count():
+		args.t = cpu_count()
 	return args, getExt(args.raw, args.unfiltered)
 
 def main():
@@ -258,26 +279,36 @@ help = "Compare Raw mutect2 output to common variants from platypus output (comp
 	parser.add_argument("--unfiltered", action = "store_true", default = False,
 help = "Compare 'unfiltered' somatic variants (compares fully filtered output by default).")
 	parser.add_argument("-c", help = "Copy target platypus data to this directory.")
-	parser.add_argument("-v", help = "Path to uncompressed vcf header (Copies contig information to platypus vcf headers).")
+	parser.add_argument("-v", help = "Path to uncompressed vcf header, reference fasta index (.fai), or sequence dict (.dict) (Copies contig information to platypus vcf headers).")
 	parser.add_argument("-m", help = "Path to mutect2parallel parent output directory.")
 	parser.add_argument("-p", help = "Path to platypus-based parent output directory.")
 	parser.add_argument("-o", 
 help = "Path to output manifest if using -m and -p. Path to output directory if using -i.")
 	parser.add_argument("-i", help = "Path to input manifest for comparison.")
+	parser.add_argument("-t", type = int, default = 1, help = "Number of threads.")
+	parser.add_argument("--profile", help = "Path to directory for cProfile stats of every process (merged into profile.txt when finished).")
+	parser.add_argument("--profile_memory", action = "store_true", default = False,
+help = "Also record tracemalloc snapshots of every process (requires --profile).")
 	args, ext = checkArgs(parser.parse_args())
+	PROFILER.setPath(args.profile, args.profile_memory)
+	# Both modes use the registry beside the comparison manifest so files indexed while writing it are not indexed again
+	manifest = args.i if args.i else args.o
+	REGISTRY.setPath(os.path.join(os.path.dirname(os.path.abspath(manifest)), "artifacts.db"))
 	if args.m and args.p:
 		print("\n\tGetting new manifest for comparison...")
 		contigs = None
 		if args.v:
 			contigs = getContigs(args.v)
-		mutect = getMutectOutput(args.m, ext)
-		plat = getPlatypusOutput(args.p, args.c, contigs, ext)
+		mutect = getMutectOutput(args.m, ext, args.t)
+		plat = getPlatypusOutput(args.p, args.c, contigs, ext, args.t)
 		mergeSamples(args.o, mutect, plat, ext)
 	elif args.i:
 		# Run comparison
 		print("\n\tComparing output from each pipeline...")
-		samples = comparisonManifest(args.i, args.o)
-		comparePipelines(samples)
+		PROGRESS.setPath(args.o + EVENTS)
+		samples, sink = comparisonManifest(args.i, args.o)
+		comparePipelines(samples, sink, args.t)
+	PROFILER.merge()
 	print(("\tFinished. Runtime: {}\n").format(datetime.now()-start))
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+'''This script predicts the runtime, memory, and scratch space of each sample and assigns it to the smallest batch template tier it fits in'''
+
+import os
+import re
+from sys import stderr
+from metrics import readRecords
+
+GB = 1024 ** 3
+# Runtime is multiplied by this factor before choosing a tier
+MARGIN = 1.5
+# Defaults used when there is no history
+SECONDS_PER_GB = 600
+OVERHEAD = 300
+JVM_MEMORY = 16 * GB
+SCRATCH_RATIO = 0.05
+
+def parseTime(val):
+	# Returns seconds from slurm (minutes, m:s, h:m:s, d-h, d-h:m, d-h:m:s) or pbs (h:m:s) time limit
+	days = 0
+	val = val.strip()
+	if "-" in val:
+		d, val = val.split("-", 1)
+		days = int(d)
+		s = [int(i) for i in val.split(":")]
+		# Hours are given first after days
+		while len(s) < 3:
+			s.append(0)
+	else:
+		s = [int(i) for i in val.split(":")]
+		if len(s) == 1:
+			s = [0, s[0], 0]
+		elif len(s) == 2:
+			s = [0, s[0], s[1]]
+	return days * 86400 + s[0] * 3600 + s[1] * 60 + s[2]
+
+def parseMemory(val):
+	# Returns bytes from memory request (slurm defaults to megabytes)
+	m = re.match(r"^\s*([\d.]+)\s*([kmgt]?)b?\s*$", val.lower())
+	if not m:
+		return None
+	unit = m.group(2) if m.group(2) else "m"
+	return int(float(m.group(1)) * 1024 ** ("kmgt".index(unit) + 1))
+
+def formatTime(seconds):
+	# Returns seconds as d-h:m
+	minutes = int(seconds // 60)
+	return ("{}-{}:{:02d}").format(minutes // 1440, minutes % 1440 // 60, minutes % 60)
+
+class Tier():
+	# Stores batch template lines with the time limit, cores, and memory requested by it
+	def __init__(self, name, lines):
+		self.Name = name
+		self.Lines = lines
+		self.Time = None
+		self.Cores = 1
+		self.Memory = None
+		self.__parse__()
+
+	def __parse__(self):
+		# Reads resource requests from #SBATCH or #PBS lines
+		for line in self.Lines:
+			line = line.strip()
+			if line.startswith("#SBATCH"):
+				s = line[7:].strip().replace("=", " ").split()
+				if len(s) < 2:
+					continue
+				if s[0] in ["-t", "--time"]:
+					self.Time = parseTime(s[1])
+				elif s[0] in ["-n", "--ntasks", "-c", "--cpus-per-task"]:
+					self.Cores = max(self.Cores, int(s[1]))
+				elif s[0] == "--mem":
+					self.Memory = parseMemory(s[1])
+			elif line.startswith("#PBS") and "-l" in line:
+				for i in line[line.find("-l")+2:].strip().split(","):
+					if i.startswith("walltime="):
+						self.Time = parseTime(i[9:])
+					elif i.startswith("mem="):
+						self.Memory = parseMemory(i[4:])
+					elif i.startswith("nodes=") and "ppn=" in i:
+						self.Cores = int(i[i.find("ppn=")+4:])
+
+	def fits(self, runtime, memory):
+		# Returns True if runtime (with margin) and memory are within the limits of the tier
+		if self.Time is not None and runtime * MARGIN > self.Time:
+			return False
+		if self.Memory is not None and memory > self.Memory:
+			return False
+		return True
+
+def getTiers(templates):
+	# Returns tiers in order of increasing time limit (templates without a limit are last)
+	tiers = [Tier(k, v) for k, v in templates.items()]
+	return sorted(tiers, key = lambda x: (x.Time is None, x.Time or 0, x.Cores))
+
+def genomeSize(ref):
+	# Returns total length of contigs in fasta index
+	total = 0
+	if ref and os.path.isfile(ref + ".fai"):
+		with open(ref + ".fai", "r") as f:
+			for line in f:
+				s = line.split("\t")
+				if len(s) >= 2:
+					total += int(s[1])
+	return total
+
+def intervalFraction(bed, ref):
+	# Returns fraction of genome covered by bed intervals (1 if either is unknown)
+	genome = genomeSize(ref)
+	if not bed or not genome or not os.path.isfile(bed):
+		return 1.0
+	total = 0
+	with open(bed, "r") as f:
+		for line in f:
+			s = line.split()
+			if len(s) >= 3 and s[1].isdigit() and s[2].isdigit():
+				total += int(s[2]) - int(s[1])
+	return min(1.0, total / genome)
+
+class History():
+	# Stores mutect throughput, peak memory, and scratch written per byte read from previous tool metrics
+	def __init__(self, paths):
+		self.Calls = 0
+		self.Rate = SECONDS_PER_GB / GB
+		self.Memory = JVM_MEMORY
+		self.Scratch = SCRATCH_RATIO
+		self.__load__(paths)
+
+	def __load__(self, paths):
+		# Fits rates from Mutect2 calls which read data
+		paths = [i for i in paths if i and os.path.exists(i)]
+		if not paths:
+			return
+		wall = 0.0
+		read = 0
+		written = 0
+		rss = []
+		for r in readRecords(paths):
+			if r.get("returncode") != 0:
+				continue
+			if r.get("tool", "").endswith("Mutect2") and r.get("rchar", 0) > 0:
+				self.Calls += 1
+				wall += r["wall"]
+				read += r["rchar"]
+				# Scratch is fit from the same calls as the bytes read
+				written += r.get("write_bytes", 0)
+				rss.append(r["maxrss_kb"] * 1024)
+		if self.Calls > 0:
+			self.Rate = wall / read
+			# Use a high percentile so most jobs fit
+			rss.sort()
+			self.Memory = rss[min(len(rss) - 1, int(len(rss) * 0.95))]
+			if written > 0:
+				self.Scratch = written / read
+
+class Planner():
+	# Predicts resources of each sample and assigns it to a tier
+	def __init__(self, conf, templates, history = None):
+		self.Tiers = getTiers(templates)
+		self.Fraction = intervalFraction(conf.get("bed"), conf.get("ref"))
+		self.Bamout = conf.get("bamout", False)
+		paths = [conf["outpath"]]
+		if history:
+			paths.extend(history)
+		self.History = History(paths)
+
+	def __size__(self, path):
+		# Returns size of file (0 if it is missing)
+		try:
+			return os.path.getsize(path)
+		except OSError:
+			return 0
+
+	def estimate(self, files):
+		# Returns predicted runtime, memory, and scratch of one sample from its normal and tumor bams
+		if isinstance(files, str):
+			files = [files]
+		sizes = [self.__size__(i) for i in files]
+		normal = sizes[0]
+		tumors = sizes[1:] if len(sizes) > 1 else [0]
+		# Each tumor is run against the normal in parallel
+		read = [(normal + t) * self.Fraction for t in tumors]
+		runtime = OVERHEAD + self.History.Rate * max(read)
+		memory = self.History.Memory * len(tumors)
+		scratch = self.History.Scratch * sum(read)
+		if self.Bamout == True:
+			scratch += sum(tumors) * self.Fraction
+		return sum(sizes), runtime, memory, scratch
+
+	def plan(self, files):
+		# Returns dict of plan rows for each sample
+		ret = {}
+		for i in files.keys():
+			size, runtime, memory, scratch = self.estimate(files[i])
+			tier = None
+			for t in self.Tiers:
+				if t.fits(runtime, memory):
+					tier = t
+					break
+			fits = tier is not None
+			if not fits:
+				# Use largest tier and warn
+				tier = self.Tiers[-1]
+			ret[i] = {"size": size, "runtime": runtime, "memory": memory, "scratch": scratch, "tier": tier,
+				"fits": fits, "corehours": tier.Cores * runtime / 3600}
+		return ret
+
+	def report(self, plan):
+		# Prints plan for each sample with totals per tier
+		print(("\n\tPlan for {:,d} samples (interval fraction {:.3f}; ").format(len(plan), self.Fraction), end = "")
+		if self.History.Calls > 0:
+			print(("fitted from {:,d} previous Mutect2 calls):\n").format(self.History.Calls))
+		else:
+			print("no previous metrics, using defaults):\n")
+		print("\tSample\tInput(Gb)\tRuntime\tMemory(Gb)\tScratch(Gb)\tTier\tLimit\tCores\tCoreHours")
+		totals = {}
+		for i in sorted(plan.keys()):
+			p = plan[i]
+			t = p["tier"]
+			limit = formatTime(t.Time) if t.Time is not None else "NA"
+			print(("\t{}\t{:.1f}\t{}\t{:.1f}\t{:.1f}\t{}\t{}\t{}\t{:.2f}{}").format(i, p["size"] / GB, formatTime(p["runtime"]),
+				p["memory"] / GB, p["scratch"] / GB, t.Name, limit, t.Cores, p["corehours"], "" if p["fits"] else "\t(exceeds limit)"))
+			if t.Name not in totals.keys():
+				totals[t.Name] = [0, 0.0]
+			totals[t.Name][0] += 1
+			totals[t.Name][1] += p["corehours"]
+		print()
+		for t in self.Tiers:
+			if t.Name in totals.keys():
+				print(("\t{}: {:,d} samples, {:.2f} core-hours").format(t.Name, totals[t.Name][0], totals[t.Name][1]))
+		print(("\tTotal: {:.2f} core-hours\n").format(sum([i["corehours"] for i in plan.values()])))
+		over = [i for i in plan.keys() if plan[i]["fits"] == False]
+		if over:
+			print(("\t[Warning] {:,d} samples may exceed the limits of the largest tier.").format(len(over)), file=stderr)
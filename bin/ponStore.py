@@ -0,0 +1,259 @@
+'''This script defines an incremental, sharded store of site counts for building a panel of normals'''
+
+import os
+import gzip
+import pysam
+import shutil
+from multiprocessing import Pool
+from sys import stderr
+from time import time_ns
+from urllib.parse import quote, unquote
+
+HEADER = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+# Empty block at the end of every bgzipped file (removed between concatenated shards)
+EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def openVCF(infile):
+	# Returns text handle for plain or gzipped vcf
+	if infile.endswith(".gz"):
+		return gzip.open(infile, "rt")
+	return open(infile, "r")
+
+def readSites(args):
+	# Returns dict of unique sites in normal vcf by shard
+	infile, binsize = args
+	shards = {}
+	header = []
+	with openVCF(infile) as f:
+		for line in f:
+			if line[0] == "#":
+				if line.startswith("##fileformat") or line.startswith("##contig") or line.startswith("##reference"):
+					header.append(line)
+				continue
+			s = line.split("\t", 5)
+			key = (s[0], int(s[1]) // binsize)
+			if key not in shards.keys():
+				shards[key] = set()
+			for alt in s[4].split(","):
+				shards[key].add((int(s[1]), s[3], alt))
+	return infile, shards, header
+
+def updateShard(args):
+	# Adds site counts of batch to shard table and rewrites shard vcf body (tables record the last batch so it is not counted twice)
+	table, body, contig, sites, minimum, batch = args
+	counts = {}
+	if os.path.isfile(table):
+		with open(table, "r") as f:
+			for line in f:
+				s = line.rstrip("\n").split("\t")
+				if s[0] == "#batch":
+					if s[1] == batch:
+						# Applied before the import was interrupted
+						return body
+					continue
+				counts[(int(s[0]), s[1], s[2])] = int(s[3])
+	for k, v in sites.items():
+		counts[k] = counts.get(k, 0) + v
+	with open(table + "~", "w") as out:
+		out.write(("#batch\t{}\n").format(batch))
+		for k in sorted(counts.keys()):
+			out.write(("{}\t{}\t{}\t{}\n").format(k[0], k[1], k[2], counts[k]))
+	os.replace(table + "~", table)
+	with open(body + "~", "w") as out:
+		for k in sorted(counts.keys()):
+			if counts[k] >= minimum:
+				out.write(("{}\t{}\t.\t{}\t{}\t.\t.\t.\n").format(contig, k[0], k[1], k[2]))
+	os.replace(body + "~", body)
+	return body
+
+def compressShard(body):
+	# Writes bgzipped copy of shard body
+	pysam.tabix_compress(body, body + ".gz~", force = True)
+	os.replace(body + ".gz~", body + ".gz")
+	return body + ".gz"
+
+def copyBlocks(infile, out):
+	# Copies bgzipped file to open output without its end of file block
+	size = os.path.getsize(infile)
+	with open(infile, "rb") as f:
+		f.seek(max(0, size - len(EOF)))
+		if f.read() == EOF:
+			size -= len(EOF)
+		f.seek(0)
+		while size > 0:
+			chunk = f.read(min(size, 1 << 20))
+			if not chunk:
+				break
+			out.write(chunk)
+			size -= len(chunk)
+
+class PONStore():
+	# Stores per-site counts of normals sharded by interval so only shards with new sites are rebuilt
+	def __init__(self, workspace, minimum = 2, binsize = 10000000):
+		if workspace[-1] != "/":
+			workspace += "/"
+		self.Dir = workspace
+		self.Shards = workspace + "shards/"
+		self.Imported = workspace + "imported.txt"
+		self.Header = workspace + "header.txt"
+		self.Pending = workspace + "pending.txt"
+		self.Min = minimum
+		self.Bin = binsize
+		self.Done = {}
+		os.makedirs(self.Shards, exist_ok = True)
+		self.__readImported__()
+
+	def __readImported__(self):
+		# Reads paths, sizes, and modification times of imported normals
+		if os.path.isfile(self.Imported):
+			with open(self.Imported, "r") as f:
+				for line in f:
+					s = line.rstrip("\n").split("\t")
+					if len(s) == 3:
+						self.Done[s[0]] = (int(s[1]), int(s[2]))
+
+	def __shardName__(self, contig, idx):
+		# Returns file stem for shard (contig names are quoted for use as file names)
+		return ("{}{}.{:05d}").format(self.Shards, quote(contig, safe = ""), idx)
+
+	def newNormals(self, vcfs):
+		# Returns list of vcfs which have not been imported
+		ret = []
+		for i in vcfs:
+			st = os.stat(i)
+			if i in self.Done.keys():
+				if self.Done[i] != (st.st_size, st.st_mtime_ns):
+					print(("\t[Warning] {} has changed since it was imported. Use --rebuild to include changes.").format(i), file=stderr)
+			else:
+				ret.append(i)
+		return ret
+
+	def __setPending__(self, batch, vcfs):
+		# Records batch before any shard is updated so an interrupted import can be finished
+		with open(self.Pending + "~", "w") as out:
+			out.write(batch + "\n")
+			for i in vcfs:
+				out.write(i + "\n")
+		os.replace(self.Pending + "~", self.Pending)
+
+	def __resume__(self, pool):
+		# Finishes batch which was interrupted between updating shards and recording its normals
+		if not os.path.isfile(self.Pending):
+			return set()
+		with open(self.Pending, "r") as f:
+			lines = [i.rstrip("\n") for i in f if i.strip()]
+		vcfs = [i for i in lines[1:] if i not in self.Done.keys()]
+		ret = set()
+		if vcfs:
+			print(("\t[Warning] Finishing interrupted import of {:,d} normals.").format(len(vcfs)), file=stderr)
+			ret = self.__importBatch__(pool, vcfs, lines[0])
+		else:
+			os.remove(self.Pending)
+		return ret
+
+	def __importBatch__(self, pool, vcfs, batch = None):
+		# Counts sites from one batch of normals, updates affected shards, and records imported files
+		if batch is None:
+			batch = ("{}.{}").format(time_ns(), os.getpid())
+			self.__setPending__(batch, vcfs)
+		sites = {}
+		for infile, shards, header in pool.imap_unordered(readSites, [[i, self.Bin] for i in vcfs]):
+			if header and not os.path.isfile(self.Header):
+				with open(self.Header, "w") as out:
+					out.write("".join(header))
+			for k, v in shards.items():
+				if k not in sites.keys():
+					sites[k] = {}
+				for s in v:
+					sites[k][s] = sites[k].get(s, 0) + 1
+		args = []
+		for k, v in sites.items():
+			stem = self.__shardName__(k[0], k[1])
+			args.append([stem + ".tsv", stem + ".vcf", k[0], v, self.Min, batch])
+		for _ in pool.imap_unordered(updateShard, args):
+			pass
+		# Only record normals once their counts have been stored
+		with open(self.Imported, "a") as log:
+			for i in vcfs:
+				st = os.stat(i)
+				self.Done[i] = (st.st_size, st.st_mtime_ns)
+				log.write(("{}\t{}\t{}\n").format(i, st.st_size, st.st_mtime_ns))
+		os.remove(self.Pending)
+		return set(sites.keys())
+
+	def importNormals(self, vcfs, threads = 1, batch = 100):
+		# Imports new normals in batches to limit memory; returns number of shards rebuilt
+		pool = Pool(processes = threads)
+		updated = self.__resume__(pool)
+		vcfs = self.newNormals(vcfs)
+		if vcfs:
+			print(("\tImporting {:,d} new normals...").format(len(vcfs)))
+		for i in range(0, len(vcfs), batch):
+			updated |= self.__importBatch__(pool, vcfs[i:i+batch])
+		pool.close()
+		pool.join()
+		print(("\tUpdated {:,d} shards.").format(len(updated)))
+		return len(updated)
+
+	def __contigOrder__(self):
+		# Returns list of contigs in header order
+		order = []
+		if os.path.isfile(self.Header):
+			with open(self.Header, "r") as f:
+				for line in f:
+					if line.startswith("##contig=<ID="):
+						order.append(line[13:].split(",")[0].rstrip(">\n"))
+		return order
+
+	def merge(self, outfile, threads = 1):
+		# Writes bgzipped panel of normals from shard bodies in contig order (changed shards are compressed in parallel)
+		order = self.__contigOrder__()
+		shards = {}
+		stale = []
+		for i in os.listdir(self.Shards):
+			if i.endswith(".vcf"):
+				contig, idx = i[:-4].rsplit(".", 1)
+				contig = unquote(contig)
+				if contig not in shards.keys():
+					shards[contig] = []
+				body = self.Shards + i
+				shards[contig].append([int(idx), body + ".gz"])
+				if not os.path.isfile(body + ".gz") or os.path.getmtime(body + ".gz") < os.path.getmtime(body):
+					stale.append(body)
+		for i in sorted(shards.keys()):
+			if i not in order:
+				order.append(i)
+		if stale:
+			pool = Pool(processes = threads)
+			for _ in pool.imap_unordered(compressShard, stale):
+				pass
+			pool.close()
+			pool.join()
+		header = ("{}header.{}.vcf").format(self.Dir, os.getpid())
+		with open(header, "w") as out:
+			if os.path.isfile(self.Header):
+				with open(self.Header, "r") as f:
+					out.write(f.read())
+			out.write(HEADER)
+		gz = outfile + ".gz"
+		with open(gz + "~", "wb") as out:
+			# Bgzipped files remain valid when concatenated
+			copyBlocks(compressShard(header), out)
+			for i in order:
+				if i in shards.keys():
+					for _, path in sorted(shards[i]):
+						copyBlocks(path, out)
+			out.write(EOF)
+		os.replace(gz + "~", gz)
+		for i in [header, header + ".gz"]:
+			os.remove(i)
+		return gz
+
+	def rebuild(self):
+		# Removes all counts so every normal is imported again (only files written by the store are removed from the workspace)
+		shutil.rmtree(self.Shards, ignore_errors = True)
+		for i in [self.Imported, self.Header, self.Pending]:
+			if os.path.isfile(i):
+				os.remove(i)
+		os.makedirs(self.Shards)
+		self.Done = {}
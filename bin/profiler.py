@@ -0,0 +1,155 @@
+'''This script records cProfile stats and optional tracemalloc snapshots for each process and merges them into one report'''
+
+import os
+import io
+import json
+import pstats
+import cProfile
+import tracemalloc
+from argparse import ArgumentParser
+from glob import glob
+from multiprocessing.util import Finalize
+from socket import gethostname
+from sys import argv, stderr
+
+class Profiler():
+	# Profiles the current process and writes its stats to a per-process file (disabled unless a directory is set)
+	def __init__(self):
+		self.Dir = None
+		self.Memory = False
+		self.Prof = None
+		self.Pid = None
+
+	def setPath(self, path, memory = False):
+		# Stores profile directory and starts profiling this process
+		if path:
+			os.makedirs(path, exist_ok = True)
+			self.Dir = os.path.join(path, "")
+			self.Memory = memory
+			self.start()
+
+	def enabled(self):
+		# Returns True if a profile directory has been set
+		return self.Dir is not None
+
+	def start(self):
+		# Starts a new profiler for this process (forked workers must not add to stats copied from the parent)
+		if self.Prof is not None:
+			self.Prof.disable()
+		self.Pid = os.getpid()
+		self.Prof = cProfile.Profile()
+		if self.Memory == True:
+			if tracemalloc.is_tracing():
+				tracemalloc.clear_traces()
+			else:
+				tracemalloc.start(10)
+		self.Prof.enable()
+
+	def dump(self):
+		# Writes stats of this process (only once per process)
+		if self.Prof is None or self.Pid != os.getpid():
+			return
+		self.Prof.disable()
+		name = ("{}{}.{}").format(self.Dir, gethostname(), self.Pid)
+		try:
+			self.Prof.dump_stats(name + ".prof")
+			if self.Memory == True and tracemalloc.is_tracing():
+				current, peak = tracemalloc.get_traced_memory()
+				tracemalloc.take_snapshot().dump(name + ".snap")
+				with open(name + ".mem.json", "w") as out:
+					json.dump({"script": os.path.basename(argv[0]), "current": current, "peak": peak}, out)
+		except OSError:
+			print(("\t[Warning] Could not write profile for process {}.").format(self.Pid), file=stderr)
+		self.Prof = None
+
+	def merge(self, outfile = None):
+		# Dumps stats of this process and combines stats from every process into one report
+		if not self.Dir:
+			return None
+		self.dump()
+		if not outfile:
+			outfile = self.Dir + "profile.txt"
+		return mergeProfiles(self.Dir, outfile)
+
+# Shared by every module in this process; set by each entry point
+PROFILER = Profiler()
+
+def initWorker():
+	# Pool initializer which profiles each worker and writes its stats when the worker exits
+	if PROFILER.enabled():
+		PROFILER.start()
+		Finalize(PROFILER, PROFILER.dump, exitpriority = 10)
+
+#-----------------------------------------------------------------------------
+
+def memoryReport(indir, n):
+	# Returns lines of peak memory for each process and the largest allocation sites summed over every process
+	lines = []
+	peaks = []
+	for i in sorted(glob(indir + "*.mem.json")):
+		with open(i, "r") as f:
+			rec = json.load(f)
+		peaks.append([os.path.basename(i)[:-9], rec["script"], rec["peak"], rec["current"]])
+	if not peaks:
+		return lines
+	lines.append("\n\tPeak traced memory of each process (Mb):")
+	lines.append("\tProcess\tScript\tPeak\tAtExit")
+	for i in sorted(peaks, key = lambda x: x[2], reverse = True):
+		lines.append(("\t{}\t{}\t{:.1f}\t{:.1f}").format(i[0], i[1], i[2] / 1048576, i[3] / 1048576))
+	sites = {}
+	for i in glob(indir + "*.snap"):
+		for s in tracemalloc.Snapshot.load(i).statistics("lineno"):
+			key = str(s.traceback[0])
+			if key not in sites.keys():
+				sites[key] = [0, 0]
+			sites[key][0] += s.size
+			sites[key][1] += s.count
+	lines.append(("\n\tTop {} allocation sites still held at exit (summed over processes):").format(n))
+	lines.append("\tSize(Kb)\tBlocks\tLocation")
+	for k, v in sorted(sites.items(), key = lambda x: x[1][0], reverse = True)[:n]:
+		lines.append(("\t{:.1f}\t{}\t{}").format(v[0] / 1024, v[1], k))
+	return lines
+
+def mergeProfiles(indir, outfile, n = 40):
+	# Writes combined pstats file and text report of the top functions by cumulative and internal time
+	indir = os.path.join(indir, "")
+	files = sorted(glob(indir + "*.prof"))
+	files = [i for i in files if os.path.basename(i) != "profile.prof"]
+	if not files:
+		return None
+	stats = pstats.Stats(files[0])
+	for i in files[1:]:
+		stats.add(i)
+	stats.dump_stats(indir + "profile.prof")
+	stream = io.StringIO()
+	stats.stream = stream
+	stats.strip_dirs()
+	print(("\tMerged profiles from {} processes.\n").format(len(files)), file=stream)
+	stats.sort_stats("cumulative").print_stats(n)
+	stats.sort_stats("tottime").print_stats(n)
+	tmp = ("{}.{}.tmp").format(outfile, os.getpid())
+	with open(tmp, "w") as out:
+		out.write(stream.getvalue())
+		out.write("\n".join(memoryReport(indir, n)) + "\n")
+	os.replace(tmp, outfile)
+	return outfile
+
+def main():
+	parser = ArgumentParser("This script merges per-process profiles into one report.")
+	parser.add_argument("-i", help = "Path to profile directory.")
+	parser.add_argument("-o", help = "Path to output report (default is profile.txt in the profile directory).")
+	parser.add_argument("-n", type = int, default = 40, help = "Number of functions and allocation sites to report (default = 40).")
+	args = parser.parse_args()
+	if not args.i or not os.path.isdir(args.i):
+		print("\n\t[Error] Please specify a profile directory. Exiting.\n", file=stderr)
+		quit()
+	if not args.o:
+		args.o = os.path.join(args.i, "profile.txt")
+	ret = mergeProfiles(args.i, args.o, args.n)
+	if not ret:
+		print("\n\t[Error] No profiles found. Exiting.\n", file=stderr)
+		quit()
+	print(("\tWrote {}").format(ret))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,235 @@
+'''This script records step transitions as json-lines events and reports throughput, ETAs, and stragglers from them'''
+
+import os
+import json
+from argparse import ArgumentParser
+from socket import gethostname
+from statistics import median
+from sys import stderr
+from time import time, sleep
+
+EVENTS = "progressEvents.jsonl"
+
+def fileSize(paths):
+	# Returns total size of existing files and directories in paths (a single path may be given)
+	if isinstance(paths, str):
+		paths = [paths]
+	total = 0
+	for i in paths or []:
+		if not i:
+			continue
+		try:
+			if os.path.isdir(i):
+				for root, _, files in os.walk(i):
+					for j in files:
+						total += os.path.getsize(os.path.join(root, j))
+			else:
+				total += os.path.getsize(i)
+		except OSError:
+			# Files may be removed while they are counted
+			pass
+	return total
+
+class ProgressLog():
+	# Appends one json line per step transition to an events file (disabled unless a path is set)
+	def __init__(self, path = None):
+		self.Path = path
+		self.Host = gethostname()
+
+	def setPath(self, path):
+		# Stores events file path
+		self.Path = path
+
+	def emit(self, pair, sample, step, status, infiles = None, outfiles = None):
+		# Writes event in a single append so concurrent writers do not interleave lines
+		if not self.Path:
+			return
+		try:
+			event = {"time": time(), "host": self.Host, "pid": os.getpid(), "pair": pair, "sample": sample,
+				"step": step, "status": status, "bytes_in": fileSize(infiles), "bytes_out": fileSize(outfiles)}
+			fd = os.open(self.Path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+			try:
+				os.write(fd, (json.dumps(event) + "\n").encode())
+			finally:
+				os.close(fd)
+		except OSError:
+			# Progress reporting must never stop the pipeline
+			pass
+
+# Shared by every module in this process; set by each entry point
+PROGRESS = ProgressLog()
+
+#-----------------------------------------------------------------------------
+
+class Stage():
+	# Stores counts, durations, and bytes for one step
+	def __init__(self):
+		self.Running = {}
+		self.Complete = 0
+		self.Failed = 0
+		self.Done = set()
+		self.Durations = []
+		self.Times = []
+		self.BytesIn = 0
+		self.BytesOut = 0
+
+class Reporter():
+	# Aggregates events into per-step rates, ETAs, and stragglers (only new lines are read on each update)
+	def __init__(self, infile, factor = 3.0, window = 600):
+		self.Infile = infile
+		self.Factor = factor
+		self.Window = window
+		self.Offset = 0
+		self.Keys = set()
+		self.Active = {}
+		self.Stages = {}
+
+	def __stage__(self, step):
+		# Returns stage for step
+		if step not in self.Stages.keys():
+			self.Stages[step] = Stage()
+		return self.Stages[step]
+
+	def __apply__(self, e):
+		# Updates stages with one event; completions are attributed to the step which was started
+		key = (e["pair"], e["sample"])
+		self.Keys.add(key)
+		if e["status"] == "starting":
+			s = self.__stage__(e["step"])
+			s.Running[key] = e["time"]
+			s.BytesIn += e["bytes_in"]
+			self.Active[key] = e["step"]
+		elif e["status"] in ["complete", "failed"]:
+			step = e["step"]
+			if key in self.Active.keys():
+				step = self.Active.pop(key)
+			s = self.__stage__(step)
+			start = s.Running.pop(key, None)
+			if e["status"] == "complete":
+				s.Complete += 1
+				s.Done.add(key)
+				s.BytesOut += e["bytes_out"]
+				s.Times.append(e["time"])
+				if start is not None:
+					s.Durations.append(e["time"] - start)
+			else:
+				s.Failed += 1
+
+	def update(self):
+		# Reads complete lines appended since last update
+		if not os.path.isfile(self.Infile):
+			return 0
+		with open(self.Infile, "rb") as f:
+			f.seek(self.Offset)
+			data = f.read()
+		end = data.rfind(b"\n") + 1
+		count = 0
+		for line in data[:end].decode().splitlines():
+			try:
+				self.__apply__(json.loads(line))
+				count += 1
+			except (ValueError, KeyError):
+				pass
+		self.Offset += end
+		return count
+
+	def summary(self, now = None):
+		# Returns dict of metrics for each step
+		if now is None:
+			now = time()
+		ret = {}
+		for step, s in self.Stages.items():
+			m = {"running": len(s.Running), "complete": s.Complete, "failed": s.Failed, "bytes_in": s.BytesIn,
+				"bytes_out": s.BytesOut, "median": None, "rate": 0.0, "eta": None, "stragglers": []}
+			if s.Durations:
+				m["median"] = median(s.Durations)
+			recent = [t for t in s.Times if now - t <= self.Window]
+			m["rate"] = len(recent) * 60.0 / self.Window
+			remaining = len(self.Keys - s.Done)
+			if m["rate"] > 0:
+				m["eta"] = remaining / (m["rate"] / 60.0)
+			if m["median"]:
+				for key, start in s.Running.items():
+					if now - start > self.Factor * m["median"]:
+						m["stragglers"].append([key[0], key[1], now - start])
+			ret[step] = m
+		return ret
+
+	def report(self, now = None):
+		# Returns formatted table of metrics and stragglers
+		summary = self.summary(now)
+		lines = ["\tStep\tRunning\tComplete\tFailed\tMedian(s)\tRate(/min)\tMB in\tMB out\tETA(min)"]
+		stragglers = []
+		for step in sorted(summary.keys()):
+			m = summary[step]
+			med = "NA" if m["median"] is None else ("{:.0f}").format(m["median"])
+			eta = "NA" if m["eta"] is None else ("{:.1f}").format(m["eta"] / 60)
+			lines.append(("\t{}\t{}\t{}\t{}\t{}\t{:.2f}\t{:.1f}\t{:.1f}\t{}").format(step, m["running"], m["complete"],
+				m["failed"], med, m["rate"], m["bytes_in"] / 1e6, m["bytes_out"] / 1e6, eta))
+			for i in m["stragglers"]:
+				stragglers.append(("\t{}\t{}\t{}\t{:.0f}s").format(i[0], i[1], step, i[2]))
+		if stragglers:
+			lines.append(("\n\tStragglers (running more than {} times the median):").format(self.Factor))
+			lines.extend(stragglers)
+		return "\n".join(lines)
+
+	def prometheus(self, outfile, now = None):
+		# Writes metrics in Prometheus textfile format
+		summary = self.summary(now)
+		metrics = [["running", "running", "gauge", "Number of samples currently running each step."],
+			["complete", "complete_total", "counter", "Number of completed runs of each step."],
+			["failed", "failed_total", "counter", "Number of failed runs of each step."],
+			["bytes_in", "bytes_in_total", "counter", "Bytes read by each step."],
+			["bytes_out", "bytes_out_total", "counter", "Bytes written by each step."],
+			["median", "duration_median_seconds", "gauge", "Median duration of each step in seconds."],
+			["rate", "rate_per_minute", "gauge", "Completions of each step per minute."],
+			["eta", "eta_seconds", "gauge", "Estimated seconds until each step is complete for every sample."],
+			["stragglers", "stragglers", "gauge", "Number of runs of each step taking longer than expected."]]
+		lines = []
+		for name, suffix, typ, desc in metrics:
+			metric = "mutect2parallel_" + suffix
+			lines.append(("# HELP {} {}").format(metric, desc))
+			lines.append(("# TYPE {} {}").format(metric, typ))
+			for step in sorted(summary.keys()):
+				val = summary[step][name]
+				if name == "stragglers":
+					val = len(val)
+				if val is not None:
+					lines.append(("{}{{step=\"{}\"}} {}").format(metric, step, val))
+		tmp = ("{}.{}.tmp").format(outfile, os.getpid())
+		with open(tmp, "w") as out:
+			out.write("\n".join(lines) + "\n")
+		os.replace(tmp, outfile)
+
+def main():
+	parser = ArgumentParser("This script reports throughput, ETAs, and stragglers from progress events.")
+	parser.add_argument("--watch", help = "Path to output directory (or events file) to report on.")
+	parser.add_argument("-i", type = float, default = 60, help = "Number of seconds between reports (default = 60).")
+	parser.add_argument("--once", action = "store_true", default = False, help = "Print one report and exit.")
+	parser.add_argument("--factor", type = float, default = 3.0,
+help = "Runs taking longer than this multiple of the median duration of their step are reported as stragglers (default = 3).")
+	parser.add_argument("--window", type = float, default = 600,
+help = "Number of seconds used to calculate rates (default = 600).")
+	parser.add_argument("--prometheus", help = "Path to Prometheus textfile to write metrics to.")
+	args = parser.parse_args()
+	if not args.watch:
+		print("\n\t[Error] Please specify an output directory or events file. Exiting.\n", file=stderr)
+		quit()
+	infile = args.watch
+	if os.path.isdir(infile):
+		infile = os.path.join(infile, EVENTS)
+	r = Reporter(infile, args.factor, args.window)
+	try:
+		while True:
+			r.update()
+			print(("\n{}\n").format(r.report()), flush = True)
+			if args.prometheus:
+				r.prometheus(args.prometheus)
+			if args.once == True:
+				break
+			sleep(args.i)
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == "__main__":
+	main()
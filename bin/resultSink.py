@@ -0,0 +1,70 @@
+'''This script defines a class for writing summary rows returned by pool workers from the parent process'''
+
+import os
+from time import time
+
+class ResultSink():
+	# Batches result rows and writes them to a single csv with periodic fsync
+	def __init__(self, outfile, header, keys = 1, force = False, size = 100, interval = 30):
+		self.Outfile = outfile
+		self.Header = header
+		self.Keys = keys
+		self.Done = set()
+		self.Rows = []
+		self.Size = size
+		self.Interval = interval
+		self.Last = time()
+		self.__initialize__(force)
+
+	def key(self, row):
+		# Returns tuple of key columns from row
+		return tuple(row.strip().split(",")[:self.Keys])
+
+	def __initialize__(self, force):
+		# Writes header to new file or reads keys of existing rows
+		if not os.path.isfile(self.Outfile) or force == True:
+			with open(self.Outfile, "w") as out:
+				out.write(self.Header)
+		else:
+			first = True
+			with open(self.Outfile, "r") as f:
+				for line in f:
+					if first == False:
+						if line.strip():
+							self.Done.add(self.key(line))
+					else:
+						first = False
+
+	def reset(self):
+		# Rewrites file with only its header
+		self.Rows = []
+		self.Done = set()
+		with open(self.Outfile, "w") as out:
+			out.write(self.Header)
+
+	def has(self, *key):
+		# Returns True if a row with given key columns has been recorded
+		return tuple(key) in self.Done
+
+	def add(self, row):
+		# Stores row and writes batch if it is large or old enough
+		if not row.endswith("\n"):
+			row += "\n"
+		self.Rows.append(row)
+		self.Done.add(self.key(row))
+		if len(self.Rows) >= self.Size or time() - self.Last >= self.Interval:
+			self.flush()
+
+	def flush(self):
+		# Writes all stored rows in one call and syncs them to disk
+		if self.Rows:
+			with open(self.Outfile, "a") as out:
+				out.write("".join(self.Rows))
+				out.flush()
+				os.fsync(out.fileno())
+			self.Rows = []
+		self.Last = time()
+
+	def close(self):
+		# Writes any remaining rows
+		self.flush()
@@ -4,17 +4,22 @@ import os
 from argparse import ArgumentParser
 from sys import stderr
 from datetime import datetime
+from copy import deepcopy
+from shutil import rmtree
 from functools import partial
 from multiprocessing import Pool, cpu_count
 from commonUtil import *
+from speculate import Speculator
+from progress import EVENTS, PROGRESS
 
 def appendLog(conf, s):
-	# Appends direclty to log without using Samples class
+	# Records status directly in state database without using Samples class (duplicate attempts have no state)
+	if conf["state"] is None:
+		return
 	out = s.Output
 	if s.Status == "starting":
 		out = s.Input
-	with open(conf["log"], "a") as l:
-		l.write(("{}\t{}\t{}\t{}\t{}\n").format(s.Name, s.ID, s.Step, s.Status, out))	
+	conf["state"].append(s.Name, s.ID, s.Step, s.Status, out)
 
 #-------------------------------Mutect----------------------------------------
 
@@ -34,6 +39,7 @@ def callMutect(cmd, name, outfile):
 		print(("\t{} failed mutect analysis.").format(name))
 		return None
 
+@traced()
 def submitSample(infile, conf, s, name):
 	# Builds mutect command
 	if "picard" in conf.keys():
@@ -92,11 +98,37 @@ def submitFiles(conf, samples, infile):
 		s.update(sample, name, "mutect", "starting", conf["outpath"] + sample + ".vcf")
 	s.Input = infile
 	if s.Step == "mutect" and s.Status != "complete":
-		# Record input and call mutect2
+		# Record input, tag resource usage with this step, and call mutect2
 		appendLog(conf, s)	
+		METRICS.setContext(conf["pair"], s.Name, s.Step)
 		s = submitSample(infile, conf, s, name)
 	return s
 
+def duplicateFiles(conf, samples, infile):
+	# Returns mutect call writing to scratch directory and outputs which replace those of the original call if it finishes first
+	scratch = checkDir(conf["outpath"] + "speculative/", True)
+	dconf = dict(conf)
+	dconf["outpath"] = scratch
+	# Nothing is recorded for the duplicate until finish adopts its result
+	dconf["state"] = None
+	dsamples = deepcopy(samples)
+	sample = "A" if infile == conf["tumor1"] else "B"
+	if sample in dsamples.keys() and dsamples[sample].Output:
+		dsamples[sample].Output = scratch + os.path.basename(dsamples[sample].Output)
+	paths = []
+	for i in [".vcf", ".vcf.idx", ".stdout", ".Mutect2.bam", ".Mutect2.bai"]:
+		paths.append([scratch + sample + i, conf["outpath"] + sample + i])
+
+	def finish(s):
+		# Records committed output in place of scratch output
+		s.Output = s.Output.replace(scratch, conf["outpath"])
+		s.Bam = s.Bam.replace(scratch, conf["outpath"])
+		if s.Status == "complete":
+			appendLog(conf, s)
+		return s
+
+	return partial(submitFiles, dconf, dsamples), infile, paths, finish
+
 #-----------------------------------------------------------------------------
 
 def getArgs(args):
@@ -128,6 +160,12 @@ def getArgs(args):
 			conf["af"] = args.af
 	if args.mo:
 		conf["mo"] = args.mo
+	if args.speculate:
+		conf["speculate"] = args.speculate
+	if args.lockdir:
+		conf["lockdir"] = args.lockdir
+		conf["max_jvms"] = args.max_jvms
+		conf["max_bams"] = args.max_bams
 	return conf
 
 def main():
@@ -149,21 +187,50 @@ help = "Indicates that mutect should also generate bam output files.")
 	parser.add_argument("-g", help = "Path to germline resource.")
 	parser.add_argument("--af", help = "Estimated allele frequency (required if using a germline resource).")
 	parser.add_argument("--mo", help = "Additional mutect options in quotes (these will not be checked for errors).")
+	parser.add_argument("--speculate", type = float,
+help = "Duplicate a tumor which runs longer than this multiple of the other tumor's runtime into scratch output (the first to finish is kept).")
+	parser.add_argument("--lockdir", help = "Path to directory of host-wide lock files (limits are shared by all jobs on a node).")
+	parser.add_argument("--max_jvms", type = int, help = "Maximum number of gatk/picard JVMs per node (requires --lockdir).")
+	parser.add_argument("--max_bams", type = int, help = "Maximum number of processes reading bam files per node (requires --lockdir).")
+	parser.add_argument("--profile", help = "Path to directory for cProfile stats of every process (merged into profile.txt when finished).")
+	parser.add_argument("--profile_memory", action = "store_true", default = False,
+help = "Also record tracemalloc snapshots of every process (requires --profile).")
+	parser.add_argument("--trace", help = "Path to directory for timeline trace files (opt-in; open the merged trace.json in Perfetto).")
 	args = parser.parse_args()
+	PROFILER.setPath(args.profile, args.profile_memory)
 	conf = getArgs(args)
-	log, samples = checkOutput(conf["outpath"], conf["normal"])
-	conf["log"] = log
-	pool = Pool(processes = 2)
+	setHostLimits(conf)
+	TRACER.setPath(args.trace)
+	state, samples = checkOutput(conf["outpath"], conf["normal"])
+	conf["state"] = state
+	conf["pair"] = state.ID
+	METRICS.setPath(state.Root + METRICS_FILE)
+	PROGRESS.setPath(state.Root + EVENTS)
+	pool = None
 	func = partial(submitFiles, conf, samples)
 	# Call mutect
 	print(("\n\tCalling mutect2 on {}....").format(conf["sample"]))
-	for x in pool.imap_unordered(func, [conf["tumor1"], conf["tumor2"]]):
+	if "speculate" in conf.keys():
+		# Duplicate a tumor which runs much longer than the other one
+		spec = Speculator(2, conf["speculate"], minimum = 1, initializer = initWorker, check = lambda x: x.Status != "failed")
+		results = spec.run(func, [conf["tumor1"], conf["tumor2"]], partial(duplicateFiles, conf, samples))
+	else:
+		pool = Pool(processes = 2, initializer = initWorker)
+		results = pool.imap_unordered(func, [conf["tumor1"], conf["tumor2"]])
+	for x in results:
 		if x.Status == "failed":
 			print(("\n\tFailed to run {}").format(x.ID), flush = True)
 		else:		
 			print(("\n\t{} has finished mutect.").format(x.ID), flush = True)
-	pool.close()
-	pool.join()
+	if pool:
+		pool.close()
+		pool.join()
+	if os.path.isdir(conf["outpath"] + "speculative/"):
+		rmtree(conf["outpath"] + "speculative/")
+	# Write human-readable log
+	state.export()
+	TRACER.merge()
+	PROFILER.merge()
 	print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
 
 if __name__ == "__main__":
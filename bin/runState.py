@@ -0,0 +1,284 @@
+'''This script defines a class for recording sample progress in one sqlite database per output tree'''
+
+import os
+import sqlite3
+from urllib.parse import quote
+from time import time
+from unixpath import getFileName
+from progress import PROGRESS
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, pair TEXT, sample TEXT,
+	name TEXT, step TEXT, status TEXT, output TEXT, time REAL);
+CREATE INDEX IF NOT EXISTS events_pair ON events (pair, sample, step);
+CREATE TABLE IF NOT EXISTS status (pair TEXT, sample TEXT, name TEXT, step TEXT, status TEXT, output TEXT,
+	time REAL, PRIMARY KEY (pair, sample));
+CREATE TABLE IF NOT EXISTS results (pair TEXT, log TEXT, row TEXT, time REAL, PRIMARY KEY (pair, log));"""
+
+HEADER = "Sample\tName\tStep\tStatus\tOutput\n"
+
+class RunState():
+	# Stores location of state database and mutectLog.txt for one sample directory
+	def __init__(self, outdir):
+		if outdir[-1] != "/":
+			outdir += "/"
+		self.Outdir = outdir
+		self.ID = os.path.basename(outdir[:-1])
+		self.Root = os.path.dirname(outdir[:-1]) + "/"
+		self.Path = self.Root + "runState.db"
+		self.Log = self.Outdir + "mutectLog.txt"
+
+	def __connect__(self):
+		# Returns connection in autocommit mode so transactions can be started explicitly
+		conn = sqlite3.connect(self.Path, timeout = 300, isolation_level = None)
+		conn.executescript(SCHEMA)
+		return conn
+
+	def __reader__(self):
+		# Returns read-only connection (None if there is no database) so input trees are never written
+		if not os.path.isfile(self.Path):
+			return None
+		return sqlite3.connect(("file:{}?mode=ro").format(quote(self.Path)), timeout = 300, uri = True)
+
+	def __rollback__(self, conn):
+		# Rolls back open transaction (BEGIN IMMEDIATE may have failed before one was started)
+		if conn.in_transaction:
+			conn.execute("ROLLBACK")
+
+	def __setStatus__(self, conn, sample):
+		# Stores most recent event for sample in status table
+		row = conn.execute("SELECT name, step, status, output, time FROM events WHERE pair = ? AND sample = ? \
+ORDER BY id DESC LIMIT 1", (self.ID, sample)).fetchone()
+		if row:
+			conn.execute("INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?)", (self.ID, sample) + row)
+		else:
+			conn.execute("DELETE FROM status WHERE pair = ? AND sample = ?", (self.ID, sample))
+
+	def append(self, sample, name, step, status, outfile):
+		# Records status transition atomically
+		conn = self.__connect__()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			conn.execute("INSERT INTO events (pair, sample, name, step, status, output, time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(self.ID, sample, name, step, status, outfile, time()))
+			conn.execute("INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(self.ID, sample, name, step, status, outfile, time()))
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+		finally:
+			conn.close()
+		# Starting events record the input of the step and complete events record its output
+		infiles = [outfile] if status == "starting" else None
+		outfiles = [outfile] if status == "complete" else None
+		PROGRESS.emit(self.ID, sample, step, status, infiles, outfiles)
+
+	def addResult(self, log, row):
+		# Stores summary row of a comparison so it survives until it has been written to the summary file
+		conn = self.__connect__()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (self.ID, log, row, time()))
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+		finally:
+			conn.close()
+
+	def __results__(self, conn):
+		# Returns stored summary rows as summary file name and row (databases written before rows were stored have none)
+		try:
+			return conn.execute("SELECT log, row FROM results WHERE pair = ? ORDER BY time", (self.ID,)).fetchall()
+		except sqlite3.OperationalError:
+			return []
+
+	def results(self):
+		# Returns list of stored summary file names and rows for this sample directory
+		conn = self.__connect__()
+		try:
+			return [list(i) for i in self.__results__(conn)]
+		finally:
+			conn.close()
+
+	def __events__(self, conn):
+		# Returns all events for this sample directory in order
+		return conn.execute("SELECT sample, name, step, status, output FROM events WHERE pair = ? ORDER BY id",
+			(self.ID,)).fetchall()
+
+	def __latest__(self, conn):
+		# Returns most recent event of each step and status in order (a few rows per sample instead of the whole log)
+		if not conn.execute("SELECT 1 FROM status WHERE pair = ? LIMIT 1", (self.ID,)).fetchone():
+			return []
+		return conn.execute("SELECT sample, name, step, status, output FROM events WHERE id IN (SELECT MAX(id) FROM events \
+WHERE pair = ? GROUP BY sample, step, status) ORDER BY id", (self.ID,)).fetchall()
+
+	def __readLog__(self, log):
+		# Returns events from existing mutectLog.txt
+		rows = []
+		with open(log, "r") as f:
+			for line in f:
+				line = line.strip().split("\t")
+				if len(line) == 5 and line[2] != "Step":
+					rows.append(tuple(line))
+		return rows
+
+	def __importLog__(self, conn, log):
+		# Stores lines from existing mutectLog.txt
+		rows = [tuple([self.ID] + list(r) + [time()]) for r in self.__readLog__(log)]
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			if not self.__events__(conn):
+				conn.executemany("INSERT INTO events (pair, sample, name, step, status, output, time) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+				for i in set([r[1] for r in rows]):
+					self.__setStatus__(conn, i)
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+
+	def load(self, normal = None, log = None):
+		# Returns dict of samples from the latest event of each step; imports log or records normal for new directories
+		# Sample is imported here since sample imports commonUtil, which imports this module
+		from sample import Sample
+		done = {}
+		if log is None:
+			log = self.Log
+		conn = self.__connect__()
+		try:
+			events = self.__latest__(conn)
+			if not events and os.path.isfile(log):
+				self.__importLog__(conn, log)
+				events = self.__latest__(conn)
+		finally:
+			conn.close()
+		if not events and normal:
+			# Record normal file for new sample directories
+			self.append("N", getFileName(normal), "normal", "complete", normal)
+		for i in events:
+			if i[0] not in done.keys():
+				done[i[0]] = Sample()
+			done[i[0]].update(i[0], i[1], i[2], i[3], i[4])
+		return done
+
+	def copyFrom(self, state):
+		# Copies events from another output tree if there are none for this directory
+		if state.Path == self.Path and state.ID == self.ID:
+			return False
+		conn = self.__connect__()
+		try:
+			if self.__events__(conn):
+				return False
+		finally:
+			conn.close()
+		rows = []
+		results = []
+		src = state.__reader__()
+		if src is not None:
+			try:
+				rows = state.__events__(src)
+				results = state.__results__(src)
+			finally:
+				src.close()
+		if not rows and os.path.isfile(state.Log):
+			rows = state.__readLog__(state.Log)
+		conn = self.__connect__()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			conn.executemany("INSERT INTO events (pair, sample, name, step, status, output, time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+				[tuple([self.ID] + list(r) + [time()]) for r in rows])
+			conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", [(self.ID, r[0], r[1], time()) for r in results])
+			for i in set([r[0] for r in rows]):
+				self.__setStatus__(conn, i)
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+		finally:
+			conn.close()
+		return True
+
+	def adopt(self, state):
+		# Replaces steps after mutect with those of another output tree whose outputs have been moved to this directory
+		src = state.__connect__()
+		try:
+			rows = src.execute("SELECT sample, name, step, status, output FROM events WHERE pair = ? AND step NOT IN ('normal', 'mutect') \
+ORDER BY id", (state.ID,)).fetchall()
+			results = state.__results__(src)
+		finally:
+			src.close()
+		conn = self.__connect__()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			conn.execute("DELETE FROM events WHERE pair = ? AND step NOT IN ('normal', 'mutect')", (self.ID,))
+			conn.execute("DELETE FROM results WHERE pair = ?", (self.ID,))
+			conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?)", [(self.ID, r[0], r[1], time()) for r in results])
+			for r in rows:
+				out = r[4]
+				if out and out.startswith(state.Outdir):
+					out = self.Outdir + out[len(state.Outdir):]
+				conn.execute("INSERT INTO events (pair, sample, name, step, status, output, time) VALUES (?, ?, ?, ?, ?, ?, ?)",
+					(self.ID, r[0], r[1], r[2], r[3], out, time()))
+			for i in conn.execute("SELECT DISTINCT sample FROM events WHERE pair = ?", (self.ID,)).fetchall():
+				self.__setStatus__(conn, i[0])
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+		finally:
+			conn.close()
+
+	def trim(self):
+		# Removes steps after mutect
+		self.load()
+		conn = self.__connect__()
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			conn.execute("DELETE FROM events WHERE pair = ? AND step NOT IN ('normal', 'mutect')", (self.ID,))
+			conn.execute("DELETE FROM results WHERE pair = ?", (self.ID,))
+			for i in conn.execute("SELECT DISTINCT sample FROM status WHERE pair = ?", (self.ID,)).fetchall():
+				self.__setStatus__(conn, i[0])
+			conn.execute("COMMIT")
+		except Exception:
+			self.__rollback__(conn)
+			raise
+		finally:
+			conn.close()
+
+	def outputs(self):
+		# Returns list of sample, step, and output file for the most recent complete event of each step
+		conn = self.__connect__()
+		try:
+			rows = conn.execute("SELECT sample, step, output FROM events WHERE pair = ? AND status = 'complete' ORDER BY id",
+				(self.ID,)).fetchall()
+		finally:
+			conn.close()
+		ret = {}
+		for i in rows:
+			ret[(i[0], i[1])] = i[2]
+		return [[k[0], k[1], v] for k, v in ret.items()]
+
+	def isComplete(self):
+		# Returns True if both tumor samples have completed the final comparison
+		conn = self.__connect__()
+		try:
+			rows = conn.execute("SELECT sample FROM status WHERE pair = ? AND step = 'isec3' AND status = 'complete'",
+				(self.ID,)).fetchall()
+		finally:
+			conn.close()
+		return len(rows) >= 2
+
+	def export(self):
+		# Writes events to mutectLog.txt for human inspection
+		conn = self.__connect__()
+		try:
+			events = self.__events__(conn)
+		finally:
+			conn.close()
+		tmp = ("{}~{}").format(self.Log, os.getpid())
+		with open(tmp, "w") as out:
+			out.write(HEADER)
+			for i in events:
+				out.write("\t".join([str(j) for j in i]) + "\n")
+		os.replace(tmp, self.Log)
+		return self.Log
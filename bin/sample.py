@@ -3,12 +3,16 @@
 import os
 from unixpath import *
 import commonUtil
+from progress import PROGRESS
+from metrics import METRICS
+from vcfHeader import reheaderVCF
 
 class Sample():
 	# Stores data for managing sample progress
 	def __init__(self):
 		self.Name = ""
 		self.ID = ""
+		self.Pair = ""
 		self.Step = ""
 		self.Status = ""
 		self.Output = ""
@@ -111,6 +115,12 @@ class Sample():
 		if unfilt == True:
 			self.Unfiltered = outfile
 
+	def startStep(self, step, infiles):
+		# Records start of step in the event stream (the state database is only updated when the step finishes so it can be resumed)
+		PROGRESS.emit(self.Pair, self.Name, step, "starting", infiles)
+		# Tag resource usage of following tool calls in this process
+		METRICS.setContext(self.Pair, self.Name, step)
+
 	def reset(self):
 		# Resets status to begin filtering
 		self.Step = "mutect"
@@ -148,49 +158,36 @@ class Sample():
 		opt = self.__filterOpt__(conf)
 		if opt:
 			cmd += ('-i "{}" ').format(opt)
-		res = commonUtil.runProc(cmd + self.Output)
+		res = commonUtil.runCached(cmd + self.Output, [self.Output], [outfile])
 		# Record results
 		if res == True and os.path.isfile(outfile):
 			self.updateStatus("complete", outfile = outfile, unfilt = True)
 		else:
 			self.updateStatus("failed")
 
-	def __reheader__(self):
-		# Inserts contig lines into vcf header and returns outfile name
+	def __reheader__(self, outdir):
+		# Writes mutect vcf with P_CONTAM info line to outdir so concurrent attempts never rewrite the same file; returns new path or None
 		insert = '##INFO=<ID=P_CONTAM,Number=A,Type=Float,Description="Posterior probability an site reperesents contamination">\n'
-		pos = False
-		ins = True
-		outfile = self.Output + "~"
-		# Get list of ids in file and sort
-		with open(outfile, "w") as out:
-			with open(self.Output, "r") as f:
-				for line in f:
-					if "##INFO=" in line:
-						if "P_CONTAM" in line:
-							# Only insert line once
-							ins = False
-						pos = True
-					else:
-						if ins == True and pos == True:
-							# Insert line after last info field
-							out.write(insert)
-							ins = False
-					out.write(line)
-		# Remove infile and rename outfile
-		os.remove(self.Output)
-		os.rename(outfile, self.Output)
+		outfile = outdir + self.Output[self.Output.rfind("/")+1:self.Output.find(".")] + ".reheader.vcf"
+		return reheaderVCF(self.Output, outfile = outfile, insert = [insert])
 
 	def filterCalls(self, conf, outdir):
 		# Calls gatk to filter mutect calls to remove germline variants
+		infile = self.Output
 		if ".gz" not in self.Output:
-			self.__reheader__()
+			infile = self.__reheader__(outdir)
+			if infile is None:
+				self.updateStatus("failed")
+				return
 		ext = ".unfiltered.vcf"
 		outfile = outdir + self.Output[self.Output.rfind("/")+1:self.Output.find(".")] + ext
 		log = outfile.replace("vcf", "stdout")
 		# Assemble command
 		cmd = ("java -jar {} FilterMutectCalls ").format(conf["gatk"])
-		cmd += ("-V {} -O {}").format(self.Output, outfile)
-		res = commonUtil.runProc(cmd, log)
+		cmd += ("-V {} -O {}").format(infile, outfile)
+		res = commonUtil.runCached(cmd, [infile], [outfile], log, lambda: commonUtil.getStatus(log))
+		if infile != self.Output and os.path.isfile(infile):
+			os.remove(infile)
 		if res == True and commonUtil.getStatus(log) == True and commonUtil.getTotal(outfile) > 0:
 			self.Output = outfile
 			self.bcfFilter(conf)
@@ -206,6 +203,7 @@ class Sample():
 			run == True
 		if run == True:
 			self.updateStatus("starting", "filtering_germline")
+			self.startStep("filtering_germline", [self.Output])
 			self.filterCalls(conf, outdir)
 		return run
 
@@ -227,9 +225,10 @@ class Sample():
 			infile = self.Output
 			self.Output = ("{}.{}.vcf").format(self.Output[:self.Output.find(".")], tag)
 			self.updateStatus("starting", step2, self.Output)
+			self.startStep(step2, [infile, bed])
 			cmd = ("./heterAnalyzer {} {}").format(mode, params)
 			cmd += ("-v {} -i {} -o {}").format(infile, bed, self.Output)
-			res = commonUtil.runProc(cmd)
+			res = commonUtil.runCached(cmd, [infile, bed], [self.Output])
 			if res == True:
 				self.updateStatus("complete")
 			else:
@@ -1,7 +1,6 @@
 '''This script defines classes for Samples to manage filtering of mutect2 output'''
 
 import os
-from shutil import copy
 from unixpath import *
 from commonUtil import *
 from sample import *
@@ -15,7 +14,9 @@ class Samples():
 		self.Conf = {}
 		self.ID = ""
 		self.Outdir = ""
-		self.Log = ""
+		self.State = None
+		# Names in output directory before filtering started (kept if a duplicate replaces the output)
+		self.Existing = set()
 		self.A = Sample()
 		self.B = Sample()
 		self.N = Sample()
@@ -30,8 +31,7 @@ class Samples():
 			out = s.Private
 		else:
 			out = s.Output
-		with open(self.Log, "a") as l:
-				l.write(("{}\t{}\t{}\t{}\t{}\n").format(s.Name, s.ID, s.Step, s.Status, out))
+		self.State.append(s.Name, s.ID, s.Step, s.Status, out)
 
 	def setLogs(self, summary, ulog, blog, conf):
 		# Stores logs and config
@@ -58,6 +58,9 @@ class Samples():
 		else:
 			printError(("Could not find tumor B data for {}").format(self.ID))
 			proceed =  False
+		for i in [self.N, self.A, self.B]:
+			# Tag events of each sample with the pair
+			i.Pair = self.ID
 		# Ensure both have at least passed mutect
 		if proceed == True:
 			proceed = self.A.checkStatus(self.ID)
@@ -65,20 +68,6 @@ class Samples():
 			proceed = self.B.checkStatus(self.ID)				
 		return proceed
 
-	def __trimLog__(self):
-		# Removes steps after mutect from log
-		tmp = self.Log + "~"
-		with open(tmp, "w") as out:
-			with open(self.Log, "r") as f:
-				for line in f:
-					s = line.split("\t")
-					if s[2] == "Step" or s[2] == "normal" or s[2] == "mutect":
-						# Only write lines from mutect analysis
-						out.write(line)
-		# Replace log file
-		os.remove(self.Log)
-		os.rename(tmp, self.Log)
-
 	def setSamples(self, indir, outdir, done):
 		# Sets samples A, B, and N; returns True if ID not in done
 		ret = False
@@ -86,21 +75,34 @@ class Samples():
 		outdir = checkDir(outdir, True)
 		self.ID = getParent(indir)
 		self.Outdir = checkDir(outdir + self.ID + "/", True)
-		self.Log = self.Outdir + "mutectLog.txt"
-		if not os.path.isfile(self.Log):
-			# Copy log file to new directory
-			copy(indir + "mutectLog.txt", self.Log)
+		self.Existing = set(os.listdir(self.Outdir))
+		self.State = RunState(self.Outdir)
+		# Copy state to new output tree if needed
+		self.State.copyFrom(RunState(indir))
 		if self.Conf["force"] == True:
-			self.__trimLog__()
-		if os.path.isfile(self.Log) and self.ID not in done:
-			# Proceed if sample not done and log is present
-			_, s = checkOutput(self.Outdir, prnt = False)
+			# Remove steps after mutect
+			self.State.trim()
+		if self.ID not in done:
+			# Proceed if sample not done
+			s = self.State.load()
 			if self.Conf["force"] == True:
 				self.A.reset()
 				self.B.reset()
 			ret = self.__checkSamples__(s)
 		return True
 
+	def speculativeCopy(self, root):
+		# Returns copy of pair which restarts filtering from mutect output in a scratch output tree
+		ret = Samples()
+		ret.setLogs(self.Summary, self.Ulog, self.Blog, self.Conf)
+		ret.ID = self.ID
+		ret.Outdir = checkDir(root + self.ID + "/", True)
+		ret.State = RunState(ret.Outdir)
+		ret.State.copyFrom(self.State)
+		ret.State.trim()
+		ret.__checkSamples__(ret.State.load())
+		return ret
+
 	def updateStatuses(self, status, step = None, append = False):
 		# Updates A and B, appends to log if append == True
 		self.A.updateStatus(status, step)
@@ -111,6 +113,7 @@ class Samples():
 
 #-----------------------------------------------------------------------------
 
+	@traced()
 	def rmGermline(self):
 		# Wraps calls to Sample.rmGermline
 		ret = False
@@ -139,6 +142,7 @@ class Samples():
 		ret = bcfIsec(outpath, vcfs)
 		return ret, vcfs[0], vcfs[1]
 
+	@traced()
 	def compareVCFs(self, step):
 		# Compares unfilted vs. passed results for each combination of pair of samples
 		# Get outputs and logs and check for completion
@@ -147,6 +151,7 @@ class Samples():
 			bout = self.Outdir + "B_unfiltered"
 			cout = self.Outdir + "common_unfiltered.vcf"
 			log = self.Ulog
+			isec = "isec1"
 			self.A.Private = aout + "/0000.vcf"
 			self.B.Private = bout + "/0000.vcf"
 			if self.B.Step != "filtering_germline" or self.B.Status != "complete":
@@ -156,6 +161,7 @@ class Samples():
 			bout = self.Outdir + "B_covb"
 			cout = self.Outdir + "common_covb.vcf"
 			log = self.Blog
+			isec = "isec2"
 			if self.B.Step != "filtering_forB" or self.B.Status != "complete":
 				return False
 		elif step == "n":
@@ -163,8 +169,11 @@ class Samples():
 			bout = self.Outdir + "B_nab"
 			cout = self.Outdir + "common_nab.vcf"
 			log = self.Summary
+			isec = "isec3"
 			if self.B.Step != "filtering_NAB" or self.B.Status != "complete":
 				return False
+		self.A.startStep(isec, [self.A.Output, self.B.Unfiltered])
+		self.B.startStep(isec, [self.B.Output, self.A.Unfiltered])
 		# Make sure file names are updated if they are gzipped
 		atotal = getTotal(self.A.Output)
 		if atotal is not None and atotal > 0:
@@ -197,10 +206,11 @@ class Samples():
 		else:
 			c = 0
 			sim = 0.0
-		with open(log, "a") as out:
-			out.write(("{},{},{},{},{},{},{:.2%}\n").format(self.ID, self.A.ID, self.B.ID, a, b, c, sim))
+		# Store row with the name of its summary file before the step is marked complete so it is not lost if the run is killed
+		self.State.addResult(os.path.basename(log), ("{},{},{},{},{},{},{:.2%}").format(self.ID, self.A.ID, self.B.ID, a, b, c, sim))
 		return True
 
+	@traced()
 	def covB(self):
 		# Calls covB.sh to generate bed files for each comparison
 		run = False
@@ -211,12 +221,14 @@ class Samples():
 		if run == True:
 			# Update statuses and get output file names
 			self.updateStatuses("starting", "filtering_covB")
+			self.A.startStep("filtering_covB", [self.A.Private, self.B.Bam])
+			self.B.startStep("filtering_covB", [self.B.Private, self.A.Bam])
 			self.A.Bed = self.A.Private[:self.A.Private.rfind("/")] + "/A.private.tsv"
 			self.B.Bed = self.B.Private[:self.B.Private.rfind("/")] + "/B.private.tsv"
 			# Call covB.sh: vcf1 vcf2 outputvcf2 outputvcf1 bam1 bam2 genome gatkjar
 			cmd = ("bash covB.sh {} {} {} {} ").format(self.A.Private, self.B.Private, self.A.Bed, self.B.Bed)
 			cmd += ("{} {} {} {}").format(self.A.Bam, self.B.Bam, self.Conf["ref"], self.Conf["gatk"])
-			res = runProc(cmd)
+			res = runCached(cmd, [self.A.Private, self.B.Private, self.A.Bam, self.B.Bam], [self.A.Bed, self.B.Bed])
 			if res == True:
 				self.updateStatuses("complete", append = True)
 			else:
@@ -235,6 +247,7 @@ class Samples():
 				params += ("--{} {} ").format(i, self.Conf[i])
 		return params
 
+	@traced()
 	def filterForCov(self, mode):
 		# Calls heterAnalyzer to filter for coverage in paired sample
 		ret = False
@@ -264,9 +277,13 @@ class Samples():
 		for i in [self.A.Unfiltered, self.B.Unfiltered]:
 			if getExt(i) == "gz":
 				res = runProc((("gzip -d {}").format(i)))
+				if os.path.isfile(i + ".tbi"):
+					# Remove stale index so the unzipped file can be compressed again
+					os.remove(i + ".tbi")
 		self.A.Unfiltered = self.A.Unfiltered.replace(".gz", "")
 		self.B.Unfiltered = self.B.Unfiltered.replace(".gz", "")
 
+	@traced()
 	def covN(self):
 		# Calls covN.sh to extract coverage from normal bam file
 		run = False
@@ -279,9 +296,10 @@ class Samples():
 			self.N.Bed = self.Outdir + "normalVariants.tsv"
 			# Assign bed as outfile so it is recorded in log
 			self.N.updateStatus("starting", "filtering_covN", self.N.Bed)
+			self.N.startStep("filtering_covN", [self.A.Unfiltered, self.B.Unfiltered, self.N.Bam])
 			cmd = ("bash covN.sh {} {} {} {}").format(self.A.Unfiltered, self.B.Unfiltered, self.N.Bed, self.N.Bam)
 			cmd += (" {} {}").format(self.Conf["ref"], self.Conf["gatk"])
-			res = runProc(cmd)
+			res = runCached(cmd, [self.A.Unfiltered, self.B.Unfiltered, self.N.Bam], [self.N.Bed])
 			if res == True:
 				self.N.updateStatus("complete")
 			else:
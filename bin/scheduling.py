@@ -0,0 +1,47 @@
+'''This script orders work by estimated cost so the longest jobs are dispatched first'''
+
+import os
+from metrics import readRecords
+
+def getHistory(paths, steps = None, exclude = None):
+	# Returns dict of total wall seconds of successful tool calls for each pair in previous metrics
+	ret = {}
+	paths = [i for i in paths if i and os.path.exists(i)]
+	for r in readRecords(paths):
+		if not r.get("pair") or r.get("returncode") != 0:
+			continue
+		if steps is not None and r.get("step") not in steps:
+			continue
+		if exclude is not None and r.get("step") in exclude:
+			continue
+		ret[r["pair"]] = ret.get(r["pair"], 0.0) + r["wall"]
+	return ret
+
+def orderByCost(items, size, key = None, history = None):
+	# Returns items in longest-processing-time-first order
+	# Cost is historical runtime when available and size scaled to seconds by items with both otherwise
+	sizes = [size(i) for i in items]
+	costs = [float(i) for i in sizes]
+	if key is not None and history:
+		keys = [key(i) for i in items]
+		known = [idx for idx, k in enumerate(keys) if k in history.keys()]
+		seconds = sum([history[keys[idx]] for idx in known])
+		total = sum([sizes[idx] for idx in known])
+		# Seconds per byte, or rank unknown items by size above every known item if there is no overlap
+		rate = seconds / total if total > 0 else None
+		for idx, k in enumerate(keys):
+			if k in history.keys():
+				costs[idx] = history[k]
+			elif rate is not None:
+				costs[idx] = sizes[idx] * rate
+			else:
+				costs[idx] = float("inf")
+	order = sorted(range(len(items)), key = lambda x: (costs[x], sizes[x]), reverse = True)
+	return [items[i] for i in order]
+
+def getChunksize(n, workers, heavy = False, per = 8, limit = 64):
+	# Returns chunksize for imap which leaves at least per chunks for each worker so the tail stays balanced
+	if heavy == True:
+		# Dispatch overhead is negligible for jobs which run for minutes
+		return 1
+	return max(1, min(limit, n // (max(1, workers) * per)))
@@ -0,0 +1,236 @@
+'''This script runs work units in separate processes and duplicates stragglers into scratch output (the first attempt to finish is kept)'''
+
+import os
+import signal
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from shutil import rmtree
+from statistics import median
+from sys import stderr
+from threading import current_thread, main_thread
+from time import time
+from artifacts import REGISTRY
+
+def scratchPath(path):
+	# Returns scratch path beside path for a duplicate attempt
+	return path.rstrip("/") + "_speculative"
+
+def removePath(path):
+	# Removes file or directory if it exists
+	if os.path.isdir(path):
+		rmtree(path, ignore_errors = True)
+	elif os.path.lexists(path):
+		os.remove(path)
+
+def commitPath(scratch, final, merge = False, keep = None):
+	# Atomically replaces final with scratch (directories are merged entry by entry if merge is True)
+	# When merging, entries of final which the winner did not write are removed unless they are named in keep
+	scratch = scratch.rstrip("/")
+	final = final.rstrip("/")
+	if os.path.isdir(scratch):
+		if merge == True and os.path.isdir(final):
+			names = os.listdir(scratch)
+			for i in names:
+				commitPath(os.path.join(scratch, i), os.path.join(final, i))
+			if keep is not None:
+				for i in os.listdir(final):
+					if i not in names and i not in keep:
+						# Partial output of the loser
+						removePath(os.path.join(final, i))
+			os.rmdir(scratch)
+			return
+		old = None
+		if os.path.lexists(final):
+			# Move the loser aside so the winner appears in one rename
+			old = ("{}.{}.old").format(final, os.getpid())
+			os.rename(final, old)
+		os.rename(scratch, final)
+		if old:
+			removePath(old)
+		for root, _, files in os.walk(final):
+			for i in files:
+				REGISTRY.rename(os.path.join(scratch + root[len(final):], i), os.path.join(root, i))
+	elif os.path.isfile(scratch):
+		os.replace(scratch, final)
+		REGISTRY.rename(scratch, final)
+	elif os.path.lexists(final):
+		# Remove partial output of the loser which the winner did not write
+		removePath(final)
+
+def stopRun(signum, frame):
+	# Raises SystemExit on SIGTERM so running attempts are cancelled on the way out
+	raise SystemExit(128 + signum)
+
+def runAttempt(func, unit, conn, initializer):
+	# Runs one attempt in its own process group so its tool calls are cancelled with it
+	os.setpgid(0, 0)
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	if initializer is not None:
+		initializer()
+	try:
+		conn.send((True, func(unit)))
+	except Exception as e:
+		conn.send((False, repr(e)))
+	conn.close()
+
+class Attempt():
+	# Stores process, result pipe, and start time of one attempt
+	def __init__(self, idx, copy, proc, conn):
+		self.Idx = idx
+		self.Copy = copy
+		self.Proc = proc
+		self.Conn = conn
+		self.Start = time()
+
+	def elapsed(self):
+		# Returns seconds since attempt started
+		return time() - self.Start
+
+	def result(self):
+		# Returns status and result sent by attempt (a process which exits without sending has failed)
+		try:
+			ret = self.Conn.recv()
+		except EOFError:
+			self.Proc.join()
+			ret = (False, ("exit code {}").format(self.Proc.exitcode))
+		self.Conn.close()
+		self.Proc.join()
+		return ret
+
+	def cancel(self):
+		# Stops attempt and every tool it started
+		self.Conn.close()
+		try:
+			os.killpg(self.Proc.pid, signal.SIGTERM)
+		except (ProcessLookupError, PermissionError):
+			self.Proc.terminate()
+		self.Proc.join(10)
+		if self.Proc.is_alive():
+			try:
+				os.killpg(self.Proc.pid, signal.SIGKILL)
+			except (ProcessLookupError, PermissionError):
+				self.Proc.kill()
+			self.Proc.join()
+
+class Speculator():
+	# Runs units with at most workers processes and duplicates units which run longer than factor times the median runtime
+	def __init__(self, workers, factor = 3.0, floor = 60, minimum = 3, initializer = None, check = None, poll = 1.0):
+		self.Workers = max(1, workers)
+		self.Factor = factor
+		self.Floor = floor
+		self.Minimum = minimum
+		self.Initializer = initializer
+		# Returns False for results of attempts which finished without success
+		self.Check = check
+		self.Poll = poll
+		self.Context = get_context("fork")
+		self.Durations = []
+		self.Duplicated = 0
+		self.Won = 0
+
+	def __start__(self, func, unit, idx, copy):
+		# Starts one attempt in a new process with its own pipe (a cancelled attempt cannot corrupt a shared queue)
+		reader, writer = self.Context.Pipe(duplex = False)
+		proc = self.Context.Process(target = runAttempt, args = (func, unit, writer, self.Initializer))
+		proc.start()
+		writer.close()
+		return Attempt(idx, copy, proc, reader)
+
+	def __stragglers__(self, active, tried):
+		# Returns indeces of running units which have not been duplicated and exceed the limit (longest first)
+		if len(self.Durations) < self.Minimum:
+			return []
+		limit = max(self.Floor, self.Factor * median(self.Durations))
+		ret = []
+		for idx, a in active.items():
+			if idx not in tried and 0 in a.keys() and a[0].elapsed() > limit:
+				ret.append(idx)
+		return sorted(ret, key = lambda x: active[x][0].Start)
+
+	def __running__(self, active):
+		# Returns number of live attempts
+		return sum([len(i) for i in active.values()])
+
+	def __discard__(self, dup):
+		# Removes scratch output of a duplicate
+		for p in dup[2]:
+			removePath(p[0])
+
+	def run(self, func, units, duplicate):
+		# Yields results in order of completion
+		# duplicate(unit) returns function, unit writing to scratch, list of [scratch, final, (merge, keep)] paths, and function applied to result if the duplicate wins
+		pending = deque(range(len(units)))
+		active = {}
+		dups = {}
+		tried = set()
+		# Attempts run in their own process groups so they must be stopped here if the parent is interrupted or terminated
+		handler = None
+		if current_thread() is main_thread():
+			handler = signal.signal(signal.SIGTERM, stopRun)
+		try:
+			while pending or active:
+				while pending and self.__running__(active) < self.Workers:
+					idx = pending.popleft()
+					active[idx] = {0: self.__start__(func, units[idx], idx, 0)}
+				if not pending:
+					# Duplicate stragglers into idle slots
+					for idx in self.__stragglers__(active, tried):
+						if self.__running__(active) >= self.Workers:
+							break
+						tried.add(idx)
+						dups[idx] = duplicate(units[idx])
+						active[idx][1] = self.__start__(dups[idx][0], dups[idx][1], idx, 1)
+						self.Duplicated += 1
+						print(("\t[Warning] Unit {} has run for {:.0f}s. Starting duplicate attempt.").format(idx, active[idx][0].elapsed()), file=stderr, flush = True)
+				conns = {}
+				for i in active.values():
+					for a in i.values():
+						conns[a.Conn] = a
+				for conn in wait(list(conns.keys()), timeout = self.Poll):
+					attempt = conns[conn]
+					idx = attempt.Idx
+					if idx not in active.keys() or attempt.Copy not in active[idx].keys():
+						# Other attempt finished first in this round
+						continue
+					ok, res = attempt.result()
+					del active[idx][attempt.Copy]
+					if ok == True and self.Check is not None and self.Check(res) == False:
+						# Finished without success
+						ok = None
+					if ok != True and active[idx]:
+						# Wait for the other attempt
+						print(("\t[Warning] Attempt {} of unit {} failed.").format(attempt.Copy + 1, idx), file=stderr, flush = True)
+						if attempt.Copy == 1:
+							self.__discard__(dups.pop(idx))
+						continue
+					for a in active.pop(idx).values():
+						a.cancel()
+					if ok == False:
+						print(("\t[Warning] Unit {} failed: {}").format(idx, res), file=stderr, flush = True)
+					elif ok == True:
+						# Only successful attempts estimate the expected runtime
+						self.Durations.append(attempt.elapsed())
+					if idx in dups.keys():
+						dup = dups.pop(idx)
+						if attempt.Copy == 1 and ok == True:
+							# Duplicate finished first
+							for p in dup[2]:
+								commitPath(*p)
+							if dup[3] is not None:
+								res = dup[3](res)
+							self.Won += 1
+						else:
+							self.__discard__(dup)
+					if ok != False:
+						yield res
+			if self.Duplicated > 0:
+				print(("\tDuplicated {} straggling units ({} duplicates finished first).").format(self.Duplicated, self.Won), flush = True)
+		finally:
+			for i in active.values():
+				for a in i.values():
+					a.cancel()
+			for dup in dups.values():
+				self.__discard__(dup)
+			if handler is not None:
+				signal.signal(signal.SIGTERM, handler)
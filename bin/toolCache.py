@@ -0,0 +1,176 @@
+'''This script defines a content-addressed cache of tool outputs which can be shared by runs in different output directories'''
+
+import os
+import shutil
+import hashlib
+from sys import stderr
+from artifacts import REGISTRY
+
+class ToolCache():
+	# Stores outputs of tool invocations keyed by tool version, arguments, and input checksums
+	def __init__(self):
+		self.Dir = None
+		self.Limit = 0
+		self.Large = 1 << 30
+
+	def setCache(self, path, size = None):
+		# Enables cache in path with optional size limit in Gb
+		if not path:
+			return False
+		if path[-1] != "/":
+			path += "/"
+		try:
+			os.makedirs(path, exist_ok = True)
+		except OSError:
+			print(("\t[Warning] Could not create cache directory {}. Tool cache disabled.").format(path), file=stderr)
+			return False
+		self.Dir = path
+		if size:
+			self.Limit = int(float(size) * (1 << 30))
+		return True
+
+	def enabled(self):
+		# Returns True if a cache directory has been set
+		return self.Dir is not None
+
+	def __stat__(self, path):
+		# Returns cheap identity of file from its path, size, and mtime
+		st = os.stat(path)
+		return ("{}:{}:{}").format(os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+	def __identity__(self, path):
+		# Returns content hash for small files and stat identity for large ones (i.e. bam files)
+		if not os.path.exists(path):
+			return "missing"
+		if os.path.isdir(path):
+			return ",".join([self.__identity__(os.path.join(path, i)) for i in sorted(os.listdir(path))])
+		if os.path.getsize(path) > self.Large:
+			return self.__stat__(path)
+		return REGISTRY.identity(path)
+
+	def __tool__(self, cmd):
+		# Returns identity of called executable
+		exe = shutil.which(cmd.split()[0])
+		if exe:
+			return self.__stat__(exe)
+		return cmd.split()[0]
+
+	def key(self, cmd, inputs, outputs):
+		# Returns hash of tool version, normalized arguments, and input checksums
+		h = hashlib.sha256()
+		h.update(self.__tool__(cmd).encode())
+		for i in cmd.split():
+			i = i.strip("'\"")
+			if i in inputs:
+				# Inputs are identified by content so their location does not matter
+				h.update(("<input{}>").format(inputs.index(i)).encode())
+				h.update(self.__identity__(i).encode())
+			elif i in outputs:
+				h.update(("<output{}>").format(outputs.index(i)).encode())
+			elif os.path.isfile(i):
+				# Include version of jars, scripts, and references
+				h.update(self.__stat__(i).encode())
+			else:
+				h.update(i.encode())
+		return h.hexdigest()
+
+	def __link__(self, src, dest):
+		# Hard links src to dest (copying across devices)
+		if os.path.isdir(src):
+			os.makedirs(dest, exist_ok = True)
+			for i in os.listdir(src):
+				self.__link__(os.path.join(src, i), os.path.join(dest, i))
+		else:
+			if os.path.lexists(dest):
+				os.remove(dest)
+			try:
+				os.link(src, dest)
+			except OSError:
+				shutil.copy2(src, dest)
+
+	def fetch(self, key, outputs):
+		# Links cached outputs into place and returns True if key is present
+		entry = self.Dir + key
+		if not os.path.isdir(entry):
+			return False
+		for idx in range(len(outputs)):
+			if not os.path.exists(os.path.join(entry, str(idx))):
+				return False
+		try:
+			for idx, i in enumerate(outputs):
+				self.__link__(os.path.join(entry, str(idx)), i)
+			# Mark entry as recently used
+			os.utime(entry)
+		except OSError:
+			# Entry was evicted by another process while it was linked
+			self.clear(outputs)
+			return False
+		return True
+
+	def store(self, key, outputs):
+		# Copies outputs into cache and evicts least recently used entries
+		entry = self.Dir + key
+		if os.path.isdir(entry):
+			return True
+		tmp = ("{}.{}.tmp").format(entry, os.getpid())
+		try:
+			os.makedirs(tmp)
+			for idx, i in enumerate(outputs):
+				self.__link__(i, os.path.join(tmp, str(idx)))
+			os.rename(tmp, entry)
+		except OSError:
+			shutil.rmtree(tmp, ignore_errors = True)
+			return False
+		self.evict()
+		return True
+
+	def __size__(self, path):
+		# Returns total size of files in path
+		total = 0
+		for root, _, files in os.walk(path):
+			for i in files:
+				try:
+					total += os.path.getsize(os.path.join(root, i))
+				except OSError:
+					pass
+		return total
+
+	def evict(self):
+		# Removes least recently used entries until cache is below size limit
+		if self.Limit <= 0:
+			return
+		entries = []
+		total = 0
+		for i in os.listdir(self.Dir):
+			path = self.Dir + i
+			if os.path.isdir(path) and not i.endswith(".tmp"):
+				try:
+					mtime = os.path.getmtime(path)
+				except OSError:
+					continue
+				size = self.__size__(path)
+				entries.append([mtime, size, path])
+				total += size
+		entries.sort()
+		while total > self.Limit and entries:
+			_, size, path = entries.pop(0)
+			total -= size
+			tmp = ("{}.{}.evict.tmp").format(path, os.getpid())
+			try:
+				# Rename first so no process finds a partly deleted entry
+				os.rename(path, tmp)
+			except OSError:
+				# Evicted by another process
+				continue
+			shutil.rmtree(tmp, ignore_errors = True)
+
+	def clear(self, outputs):
+		# Removes existing outputs so tools write new files instead of overwriting linked cache entries
+		for i in outputs:
+			if os.path.isdir(i):
+				shutil.rmtree(i)
+			elif os.path.lexists(i):
+				os.remove(i)
+
+# Shared by every module in this process; set by each entry point
+CACHE = ToolCache()
@@ -0,0 +1,116 @@
+'''This script records begin and end times of pipeline steps as Chrome trace events which can be opened in Perfetto'''
+
+import os
+import json
+import functools
+import threading
+from argparse import ArgumentParser
+from glob import glob
+from socket import gethostname
+from sys import argv, stderr
+from time import time
+
+def spanArgs(args):
+	# Returns trace arguments identifying the sample or file a step was called on
+	if args:
+		if hasattr(args[0], "ID"):
+			return {"id": str(args[0].ID)}
+		if isinstance(args[0], str):
+			return {"arg": args[0]}
+	return {}
+
+class Tracer():
+	# Writes complete span events for each process to its own file (disabled unless a directory is set)
+	def __init__(self):
+		self.Dir = None
+		self.Pid = None
+
+	def setPath(self, path):
+		# Stores trace directory
+		if path:
+			os.makedirs(path, exist_ok = True)
+			self.Dir = os.path.join(path, "")
+
+	def enabled(self):
+		# Returns True if a trace directory has been set
+		return self.Dir is not None
+
+	def __write__(self, event):
+		# Appends event to trace file of current process
+		pid = os.getpid()
+		if self.Pid != pid:
+			# Name process in viewer the first time it writes (pool workers inherit the tracer)
+			self.Pid = pid
+			name = ("{} {} ({})").format(gethostname(), os.path.basename(argv[0]), pid)
+			self.__write__({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": name}})
+		try:
+			with open(("{}trace.{}.{}.jsonl").format(self.Dir, gethostname(), pid), "a") as out:
+				out.write(json.dumps(event) + "\n")
+		except OSError:
+			pass
+
+	def span(self, name, start, end, args = None):
+		# Records complete event with times in seconds
+		self.__write__({"name": name, "cat": "step", "ph": "X", "ts": int(start * 1e6), "dur": int((end - start) * 1e6),
+			"pid": os.getpid(), "tid": threading.get_ident() % 1000000, "args": args or {}})
+
+	def merge(self, outfile = None):
+		# Combines trace files from every process into one trace
+		if not self.Dir:
+			return None
+		if not outfile:
+			outfile = self.Dir + "trace.json"
+		return mergeTraces(self.Dir, outfile)
+
+# Shared by every module in this process; set by each entry point
+TRACER = Tracer()
+
+def traced(name = None):
+	# Decorator which records a span for each call when tracing is enabled
+	def decorator(func):
+		label = name or func.__name__
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not TRACER.enabled():
+				return func(*args, **kwargs)
+			start = time()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				TRACER.span(label, start, time(), spanArgs(args))
+		return wrapper
+	return decorator
+
+def mergeTraces(indir, outfile):
+	# Writes events from every per-process trace file in indir to a single Chrome trace json
+	events = []
+	for idx, i in enumerate(sorted(glob(os.path.join(indir, "trace.*.jsonl")))):
+		with open(i, "r") as f:
+			for line in f:
+				try:
+					e = json.loads(line)
+				except ValueError:
+					continue
+				# Give each file its own track since pids may be reused across hosts
+				e["pid"] = idx + 1
+				events.append(e)
+	tmp = ("{}.{}.tmp").format(outfile, os.getpid())
+	with open(tmp, "w") as out:
+		json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, out)
+	os.replace(tmp, outfile)
+	return outfile
+
+def main():
+	parser = ArgumentParser("This script merges per-process trace files into one trace for Perfetto or chrome://tracing.")
+	parser.add_argument("-i", help = "Path to trace directory.")
+	parser.add_argument("-o", help = "Path to output json (default is trace.json in the trace directory).")
+	args = parser.parse_args()
+	if not args.i or not os.path.isdir(args.i):
+		print("\n\t[Error] Please specify a trace directory. Exiting.\n", file=stderr)
+		quit()
+	if not args.o:
+		args.o = os.path.join(args.i, "trace.json")
+	print(("\tWrote {}").format(mergeTraces(args.i, args.o)))
+
+if __name__ == "__main__":
+	main()
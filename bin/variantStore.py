@@ -0,0 +1,187 @@
+'''This script defines an indexed sqlite store of variants from filterVCFs output for cohort-wide queries'''
+
+import os
+import gzip
+import sqlite3
+from argparse import ArgumentParser
+from datetime import datetime
+from glob import glob
+from sys import stderr
+from unixpath import checkDir
+from runState import RunState
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, pair TEXT,
+	tumor TEXT, step TEXT, size INTEGER, mtime INTEGER);
+CREATE TABLE IF NOT EXISTS variants (file INTEGER, pair TEXT, tumor TEXT, step TEXT, chrom TEXT, pos INTEGER,
+	ref TEXT, alt TEXT, filter TEXT);
+CREATE INDEX IF NOT EXISTS variants_site ON variants (chrom, pos, ref, alt);
+CREATE INDEX IF NOT EXISTS variants_sample ON variants (pair, tumor, step);
+CREATE INDEX IF NOT EXISTS variants_file ON variants (file);"""
+
+def findVCF(infile):
+	# Returns name of vcf or its bgzipped copy if either exists
+	for i in [infile, infile + ".gz"]:
+		if i and (i.endswith(".vcf") or i.endswith(".vcf.gz")) and os.path.isfile(i):
+			return i
+	return None
+
+def readVariants(infile):
+	# Yields chromosome, position, ref, alt, and filter for each alternate allele in vcf
+	if infile.endswith(".gz"):
+		f = gzip.open(infile, "rt")
+	else:
+		f = open(infile, "r")
+	with f:
+		for line in f:
+			if line[0] != "#":
+				s = line.split("\t", 7)
+				if len(s) >= 7:
+					for alt in s[4].split(","):
+						yield s[0], int(s[1]), s[3], alt, s[6]
+
+class VariantStore():
+	# Stores variants keyed by pair, tumor, step, chromosome, and position; files are only reloaded if they change
+	def __init__(self, path):
+		self.Path = path
+		conn = self.__connect__()
+		conn.close()
+
+	def __connect__(self):
+		# Returns connection in autocommit mode so transactions can be started explicitly
+		conn = sqlite3.connect(self.Path, timeout = 300, isolation_level = None)
+		conn.executescript(SCHEMA)
+		return conn
+
+	def __rollback__(self, conn):
+		# Rolls back open transaction (BEGIN IMMEDIATE may have failed before one was started)
+		if conn.in_transaction:
+			conn.execute("ROLLBACK")
+
+	def __loadFile__(self, conn, infile, pair, tumor, step):
+		# Replaces variants from one vcf if it has changed; returns True if it was loaded
+		st = os.stat(infile)
+		row = conn.execute("SELECT id, size, mtime FROM files WHERE path = ?", (infile,)).fetchone()
+		if row and row[1] == st.st_size and row[2] == st.st_mtime_ns:
+			return False
+		try:
+			conn.execute("BEGIN IMMEDIATE")
+			if row:
+				conn.execute("DELETE FROM variants WHERE file = ?", (row[0],))
+				conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+			cur = conn.execute("INSERT INTO files (path, pair, tumor, step, size, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+				(infile, pair, tumor, step, st.st_size, st.st_mtime_ns))
+			fid = cur.lastrowid
+			conn.executemany("INSERT INTO variants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				((fid, pair, tumor, step) + i for i in readVariants(infile)))
+			conn.execute("COMMIT")
+		except (OSError, ValueError, EOFError) as e:
+			self.__rollback__(conn)
+			print(("\t[Warning] Could not load {}: {}").format(infile, e), file=stderr)
+			return False
+		except Exception:
+			# Database errors must not leave the write lock held
+			self.__rollback__(conn)
+			raise
+		return True
+
+	def loadPair(self, outdir):
+		# Loads every vcf recorded in the run state of one pair directory, plus merged common variants
+		outdir = checkDir(outdir)
+		state = RunState(outdir)
+		files = []
+		for sample, step, outfile in state.outputs():
+			files.append([findVCF(outfile), sample, step])
+		for i in glob(outdir + "common_*.vcf*"):
+			name = os.path.basename(i)
+			files.append([findVCF(i), "common", name[7:name.find(".")]])
+		count = 0
+		conn = self.__connect__()
+		try:
+			for infile, tumor, step in files:
+				if infile and self.__loadFile__(conn, infile, state.ID, tumor, step) == True:
+					count += 1
+		finally:
+			conn.close()
+		return count
+
+	def loadTree(self, indir):
+		# Loads every pair directory in output tree
+		count = 0
+		for i in glob(checkDir(indir) + "*/"):
+			count += self.loadPair(i)
+		return count
+
+	def recurrent(self, minimum, step = None, tumor = None):
+		# Returns sites found in at least minimum pairs with number of pairs and comma separated pair names
+		where = []
+		args = []
+		if step:
+			where.append("step = ?")
+			args.append(step)
+		if tumor:
+			where.append("tumor = ?")
+			args.append(tumor)
+		cmd = "SELECT chrom, pos, ref, alt, COUNT(DISTINCT pair), GROUP_CONCAT(DISTINCT pair) FROM variants"
+		if where:
+			cmd += " WHERE " + " AND ".join(where)
+		cmd += " GROUP BY chrom, pos, ref, alt HAVING COUNT(DISTINCT pair) >= ? ORDER BY chrom, pos"
+		conn = self.__connect__()
+		try:
+			return conn.execute(cmd, args + [minimum]).fetchall()
+		finally:
+			conn.close()
+
+	def counts(self):
+		# Returns number of variants for each pair, tumor, and step
+		conn = self.__connect__()
+		try:
+			return conn.execute("SELECT pair, tumor, step, COUNT(*) FROM variants GROUP BY pair, tumor, step \
+ORDER BY pair, tumor, step").fetchall()
+		finally:
+			conn.close()
+
+#-----------------------------------------------------------------------------
+
+def writeRows(outfile, header, rows):
+	# Writes query results as csv (pair lists are separated by semicolons)
+	with open(outfile, "w") as out:
+		out.write(header)
+		for i in rows:
+			out.write(",".join([str(j).replace(",", ";") for j in i]) + "\n")
+
+def main():
+	starttime = datetime.now()
+	parser = ArgumentParser("This script loads filterVCFs output into an indexed variant store and queries it.")
+	parser.add_argument("-i", help = "Path to filterVCFs output directory (new or changed vcfs are loaded).")
+	parser.add_argument("-d", help = "Path to variant store (default is variants.db in the input directory).")
+	parser.add_argument("-o", help = "Path to output csv for queries.")
+	parser.add_argument("--recurrent", type = int, help = "Write sites found in at least this many pairs.")
+	parser.add_argument("--step", help = "Only query variants from this step (i.e. isec3, nab).")
+	parser.add_argument("--tumor", help = "Only query variants from this tumor (A, B, or common).")
+	parser.add_argument("--counts", action = "store_true", default = False,
+help = "Write number of variants for each pair, tumor, and step.")
+	args = parser.parse_args()
+	if not args.d:
+		if not args.i:
+			print("\n\t[Error] Please specify an input directory or variant store. Exiting.\n", file=stderr)
+			quit()
+		args.d = checkDir(args.i) + "variants.db"
+	store = VariantStore(args.d)
+	if args.i:
+		print("\n\tLoading variants...")
+		print(("\tLoaded {:,d} new or changed vcfs.").format(store.loadTree(args.i)))
+	if args.recurrent or args.counts:
+		if not args.o:
+			print("\n\t[Error] Please specify an output file. Exiting.\n", file=stderr)
+			quit()
+		if args.recurrent:
+			rows = store.recurrent(args.recurrent, args.step, args.tumor)
+			writeRows(args.o, "Chr,Pos,REF,ALT,#Pairs,Pairs\n", rows)
+		else:
+			rows = store.counts()
+			writeRows(args.o, "ID,Tumor,Step,#Variants\n", rows)
+		print(("\tWrote {:,d} rows to {}.").format(len(rows), args.o))
+	print(("\n\tFinished. Runtime: {}\n").format(datetime.now()-starttime))
+
+if __name__ == "__main__":
+	main()
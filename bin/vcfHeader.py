@@ -0,0 +1,244 @@
+'''This script defines functions for replacing vcf headers without rewriting the body of the file'''
+
+import os
+import gzip
+import shutil
+import struct
+import zlib
+from sys import stderr
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Maximum uncompressed size of one bgzf block (same as htslib)
+BLOCK_SIZE = 0xff00
+
+def readContigs(infile):
+	# Returns dict of contig lines from a fasta index, sequence dict, or vcf header (in file order)
+	contigs = {}
+	with open(infile, "r") as f:
+		for line in f:
+			if infile.endswith(".fai"):
+				s = line.split("\t")
+				if len(s) >= 2:
+					contigs[s[0]] = ("##contig=<ID={},length={}>\n").format(s[0], s[1])
+			elif infile.endswith(".dict"):
+				if line.startswith("@SQ"):
+					tags = dict([i.split(":", 1) for i in line.strip().split("\t")[1:] if ":" in i])
+					if "SN" in tags.keys() and "LN" in tags.keys():
+						contigs[tags["SN"]] = ("##contig=<ID={},length={}>\n").format(tags["SN"], tags["LN"])
+			else:
+				if line[0] != "#":
+					break
+				if "##contig=" in line:
+					spl = line.split(",")
+					contigs[spl[0][spl[0].rfind("=")+1:].rstrip(">\n")] = line
+	return contigs
+
+def isBGZF(infile):
+	# Returns True if file starts with a bgzf block
+	with open(infile, "rb") as f:
+		return f.read(4) == BGZF_MAGIC
+
+def isGzip(infile):
+	# Returns True if file is gzipped (bgzf or plain gzip)
+	with open(infile, "rb") as f:
+		return f.read(2) == GZIP_MAGIC
+
+def headerEnd(data):
+	# Returns index of first body byte in data, or None if the header may continue past the end of data
+	idx = 0
+	while idx < len(data):
+		if data[idx:idx+1] != b"#":
+			return idx
+		end = data.find(b"\n", idx)
+		if end < 0:
+			return None
+		idx = end + 1
+	return None
+
+#-----------------------------------------------------------------------------
+
+def readBlock(f):
+	# Returns raw bytes and uncompressed data of next bgzf block (empty at end of file)
+	head = f.read(12)
+	if len(head) < 12:
+		return b"", b""
+	if head[:4] != BGZF_MAGIC:
+		raise ValueError("Input is not a bgzf file")
+	xlen = struct.unpack("<H", head[10:12])[0]
+	extra = f.read(xlen)
+	bsize = None
+	idx = 0
+	while idx + 4 <= len(extra):
+		slen = struct.unpack("<H", extra[idx+2:idx+4])[0]
+		if extra[idx:idx+2] == b"BC":
+			bsize = struct.unpack("<H", extra[idx+4:idx+6])[0]
+		idx += 4 + slen
+	if bsize is None:
+		raise ValueError("Missing bgzf block size")
+	rest = f.read(bsize - xlen - 11)
+	raw = head + extra + rest
+	return raw, zlib.decompress(rest[:-8], -15)
+
+def writeBlocks(out, data):
+	# Compresses data into bgzf blocks
+	for i in range(0, len(data), BLOCK_SIZE):
+		chunk = data[i:i+BLOCK_SIZE]
+		c = zlib.compressobj(6, zlib.DEFLATED, -15)
+		cdata = c.compress(chunk) + c.flush()
+		out.write(BGZF_MAGIC + struct.pack("<IBBH", 0, 0, 255, 6) + b"BC" + struct.pack("<HH", 2, len(cdata) + 25))
+		out.write(cdata + struct.pack("<II", zlib.crc32(chunk) & 0xffffffff, len(chunk)))
+
+def readBGZFHeader(infile):
+	# Returns header text, uncompressed body bytes from the last header block, and compressed offset of following blocks
+	data = b""
+	end = None
+	with open(infile, "rb") as f:
+		while end is None:
+			raw, block = readBlock(f)
+			if not raw:
+				end = len(data)
+				break
+			data += block
+			end = headerEnd(data)
+		offset = f.tell()
+	return data[:end].decode(), data[end:], offset
+
+def readPlainHeader(infile):
+	# Returns header text and byte offset of body
+	header = []
+	offset = 0
+	with open(infile, "rb") as f:
+		for line in f:
+			if line[:1] != b"#":
+				break
+			header.append(line.decode())
+			offset += len(line)
+	return "".join(header), offset
+
+def readGzipHeader(infile):
+	# Returns header text of plain gzip file
+	header = []
+	with gzip.open(infile, "rb") as f:
+		for line in f:
+			if line[:1] != b"#":
+				break
+			header.append(line.decode())
+	return "".join(header)
+
+def recompress(infile, out, header):
+	# Writes header and body of plain gzip file as bgzf blocks (plain gzip has no blocks which can be copied)
+	data = header.encode()
+	with gzip.open(infile, "rb") as f:
+		line = f.readline()
+		while line[:1] == b"#":
+			line = f.readline()
+		data += line
+		while True:
+			chunk = f.read(BLOCK_SIZE * 64)
+			if not chunk:
+				break
+			data += chunk
+			n = len(data) - len(data) % BLOCK_SIZE
+			writeBlocks(out, data[:n])
+			data = data[n:]
+	writeBlocks(out, data)
+	out.write(BGZF_EOF)
+
+#-----------------------------------------------------------------------------
+
+def copyRange(src, out, offset):
+	# Appends src from offset to open output file without copying through python where possible
+	out.flush()
+	size = os.path.getsize(src)
+	with open(src, "rb") as f:
+		infd = f.fileno()
+		outfd = out.fileno()
+		for fn in ["copy_file_range", "sendfile"]:
+			if not hasattr(os, fn):
+				continue
+			try:
+				while offset < size:
+					if fn == "copy_file_range":
+						n = os.copy_file_range(infd, outfd, size - offset, offset)
+					else:
+						n = os.sendfile(outfd, infd, offset, size - offset)
+					if n == 0:
+						break
+					offset += n
+				return
+			except OSError:
+				# Unsupported by file system; continue from current offset with next method
+				pass
+		f.seek(offset)
+		shutil.copyfileobj(f, out)
+
+def newHeader(header, contigs = None, insert = None):
+	# Returns header with contig lines replaced and insert lines added after the last INFO line (if they are not already present)
+	lines = header.splitlines(True)
+	if insert:
+		insert = [i for i in insert if i.split(",")[0] not in header]
+		if insert:
+			idx = len(lines) - 1
+			info = [n for n, i in enumerate(lines) if i.startswith("##INFO=")]
+			if info:
+				idx = info[-1] + 1
+			lines[idx:idx] = insert
+	if contigs:
+		pos = [n for n, i in enumerate(lines) if i.startswith("##contig=")]
+		if pos:
+			idx = pos[0]
+		else:
+			# Insert before first filter line
+			filt = [n for n, i in enumerate(lines) if i.startswith("##FILTER=")]
+			idx = filt[0] if filt else len(lines) - 1
+		lines = [i for i in lines if not i.startswith("##contig=")]
+		lines[idx:idx] = list(contigs.values())
+	return "".join(lines)
+
+def reheaderVCF(infile, outfile = None, contigs = None, insert = None):
+	# Writes infile with new header to outfile (replacing infile if outfile is not given) and returns outfile name
+	bgzf = isBGZF(infile)
+	# Plain gzip input is decompressed and written as bgzf
+	gz = bgzf == False and isGzip(infile)
+	try:
+		if bgzf == True:
+			header, rest, offset = readBGZFHeader(infile)
+		elif gz == True:
+			header = readGzipHeader(infile)
+		else:
+			header, offset = readPlainHeader(infile)
+	except (OSError, EOFError, ValueError, zlib.error) as e:
+		print(("\t[Warning] Could not read header from {}: {}").format(infile, e), file=stderr)
+		return None
+	new = newHeader(header, contigs, insert)
+	if not outfile or os.path.abspath(outfile) == os.path.abspath(infile):
+		outfile = infile
+		if new == header:
+			return outfile
+	tmp = ("{}.{}.tmp").format(outfile, os.getpid())
+	try:
+		with open(tmp, "wb") as out:
+			if gz == True:
+				recompress(infile, out, new)
+			elif bgzf == True:
+				# Only blocks containing the header are recompressed; the remaining blocks are copied as is
+				writeBlocks(out, new.encode() + rest)
+			else:
+				out.write(new.encode())
+			if gz == False:
+				copyRange(infile, out, offset)
+			if bgzf == True and offset >= os.path.getsize(infile) and new:
+				out.write(BGZF_EOF)
+		os.replace(tmp, outfile)
+	except (OSError, EOFError, ValueError, zlib.error) as e:
+		print(("\t[Warning] Could not reheader {}: {}").format(infile, e), file=stderr)
+		if os.path.isfile(tmp):
+			os.remove(tmp)
+		return None
+	for i in [".tbi", ".csi"]:
+		# Virtual offsets in existing indexes are no longer valid
+		if os.path.isfile(outfile + i):
+			os.remove(outfile + i)
+	return outfile
@@ -0,0 +1,374 @@
+'''This script defines a work queue in a shared directory which invocations on any number of nodes drain cooperatively'''
+
+import os
+import json
+import random
+import threading
+import zlib
+from argparse import ArgumentParser
+from glob import glob
+from queue import SimpleQueue
+from socket import gethostname
+from sys import stderr
+from time import sleep, time
+from resultSink import ResultSink
+
+BUCKETS = 256
+# Items are moved to failed after this many expired claims
+ATTEMPTS = 3
+
+def writeJSON(outfile, obj):
+	# Writes json to temporary file and renames it into place
+	tmp = ("{}.{}.{}.tmp").format(outfile, gethostname(), os.getpid())
+	with open(tmp, "w") as out:
+		json.dump(obj, out)
+	os.replace(tmp, outfile)
+
+def readJSON(infile):
+	# Returns contents of json file
+	with open(infile, "r") as f:
+		return json.load(f)
+
+class QueueLock():
+	# Lock file created exclusively on the shared filesystem (touched while held and broken if it has not been touched within expiry)
+	def __init__(self, path, expiry):
+		self.Path = path
+		self.Expiry = expiry
+		self.Stop = None
+		self.Thread = None
+
+	def __touch__(self):
+		# Touches lock file until released
+		while not self.Stop.wait(self.Expiry / 4):
+			try:
+				os.utime(self.Path)
+			except FileNotFoundError:
+				return
+
+	def __enter__(self):
+		while True:
+			try:
+				fd = os.open(self.Path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o664)
+				os.write(fd, ("{}.{}\n").format(gethostname(), os.getpid()).encode())
+				os.close(fd)
+				self.Stop = threading.Event()
+				self.Thread = threading.Thread(target = self.__touch__, daemon = True)
+				self.Thread.start()
+				return self
+			except FileExistsError:
+				try:
+					if time() - os.stat(self.Path).st_mtime > self.Expiry:
+						# Holder died without releasing lock
+						os.remove(self.Path)
+						continue
+				except FileNotFoundError:
+					continue
+				sleep(1)
+
+	def __exit__(self, *args):
+		if self.Thread is not None:
+			self.Stop.set()
+			self.Thread.join()
+			self.Thread = None
+		try:
+			os.remove(self.Path)
+		except FileNotFoundError:
+			pass
+
+class WorkQueue():
+	# Stores items as files which move from todo to claimed to done by atomic renames
+	def __init__(self, path, expiry = 600):
+		self.Dir = os.path.join(path, "")
+		self.Todo = self.Dir + "todo/"
+		self.Claimed = self.Dir + "claimed/"
+		self.Done = self.Dir + "done/"
+		self.Merged = self.Dir + "merged/"
+		self.Failed = self.Dir + "failed/"
+		self.Locks = self.Dir + "locks/"
+		self.Ready = self.Dir + "ready"
+		self.Expiry = expiry
+		self.Owner = ("{}_{}").format(gethostname().replace(".", "_"), os.getpid())
+		self.Held = {}
+		# Items whose claims expired and were taken by another worker
+		self.Lost = set()
+		self.Stop = threading.Event()
+		self.Thread = None
+		for i in [self.Todo, self.Claimed, self.Done, self.Merged, self.Failed, self.Locks]:
+			os.makedirs(i, exist_ok = True)
+
+	def lock(self):
+		# Returns lock used to populate queue and merge results
+		return QueueLock(self.Dir + "queue.lock", self.Expiry)
+
+	def unitLock(self, name):
+		# Returns lock held while a unit runs so a unit whose claim expired never runs alongside its new owner
+		return QueueLock(("{}{:08x}.lock").format(self.Locks, zlib.crc32(name.encode())), self.Expiry)
+
+	def exists(self):
+		# Returns True if queue has been populated
+		return os.path.isfile(self.Ready)
+
+	def __bucket__(self, item):
+		# Returns todo subdirectory for item so no directory holds every item
+		return ("{}{:02x}/").format(self.Todo, zlib.crc32(item.encode()) % BUCKETS)
+
+	def populate(self, names, chunk = 1, prepare = None):
+		# Writes items of chunk units each unless queue exists (prepare is called once by the invocation which populates it)
+		ret = 0
+		with self.lock():
+			if self.exists():
+				return ret
+			if prepare is not None:
+				prepare()
+			for i in range(0, len(names), max(1, chunk)):
+				item = ("{:08d}").format(ret)
+				bucket = self.__bucket__(item)
+				os.makedirs(bucket, exist_ok = True)
+				writeJSON(bucket + item, {"units": names[i:i+chunk], "attempts": 0})
+				ret += 1
+			writeJSON(self.Ready, {"items": ret, "chunk": chunk, "time": time()})
+		return ret
+
+	def __heartbeat__(self):
+		# Touches claimed files until stopped
+		while not self.Stop.wait(self.Expiry / 4):
+			for k, v in list(self.Held.items()):
+				try:
+					os.utime(v)
+				except FileNotFoundError:
+					# Claim was reclaimed by another worker
+					self.lose(k)
+
+	def lose(self, item):
+		# Records that claim of item was taken by another worker
+		if item not in self.Lost:
+			self.Held.pop(item, None)
+			self.Lost.add(item)
+			print(("\t[Warning] Claim of queue item {} expired and was taken by another worker. Abandoning it.").format(item), file=stderr, flush = True)
+
+	def lost(self, item):
+		# Returns True if claim of item was taken by another worker
+		return item in self.Lost
+
+	def start(self):
+		# Starts heartbeat thread
+		if self.Thread is None:
+			self.Thread = threading.Thread(target = self.__heartbeat__, daemon = True)
+			self.Thread.start()
+
+	def stop(self):
+		# Stops heartbeat thread
+		self.Stop.set()
+		if self.Thread is not None:
+			self.Thread.join()
+			self.Thread = None
+
+	def reclaim(self):
+		# Returns expired claims of other workers to todo (or failed after too many attempts)
+		ret = 0
+		with os.scandir(self.Claimed) as entries:
+			for e in entries:
+				if e.name.endswith(self.Owner) or ".reclaim." in e.name:
+					continue
+				try:
+					if time() - e.stat().st_mtime <= self.Expiry:
+						continue
+					tmp = ("{}{}.reclaim.{}").format(self.Claimed, e.name, self.Owner)
+					os.rename(e.path, tmp)
+				except FileNotFoundError:
+					continue
+				self.__requeue__(e.name.split(".")[0], tmp)
+				ret += 1
+		return ret
+
+	def __requeue__(self, item, path):
+		# Returns claimed file at path to todo (or failed after too many attempts)
+		rec = readJSON(path)
+		rec["attempts"] += 1
+		if rec["attempts"] >= ATTEMPTS:
+			print(("\t[Warning] Queue item {} was attempted {} times. Moving to failed.").format(item, rec["attempts"]), file=stderr)
+			writeJSON(self.Failed + item, rec)
+		else:
+			bucket = self.__bucket__(item)
+			os.makedirs(bucket, exist_ok = True)
+			writeJSON(bucket + item, rec)
+		os.remove(path)
+
+	def release(self, item):
+		# Returns claim of unfinished item to the queue so other workers need not wait for it to expire
+		if item not in self.Held.keys():
+			return
+		claimed = self.Held.pop(item)
+		tmp = ("{}.reclaim.{}").format(claimed, self.Owner)
+		try:
+			os.rename(claimed, tmp)
+		except FileNotFoundError:
+			# Claim was already taken by another worker
+			return
+		self.__requeue__(item, tmp)
+
+	def claim(self, n = 1):
+		# Returns list of up to n claimed items as item name and list of unit names
+		ret = []
+		self.reclaim()
+		buckets = glob(self.Todo + "*/")
+		random.shuffle(buckets)
+		for b in buckets:
+			with os.scandir(b) as entries:
+				for e in entries:
+					if e.name.endswith(".tmp"):
+						continue
+					claimed = ("{}{}.{}").format(self.Claimed, e.name, self.Owner)
+					try:
+						# Only one worker can rename each file
+						os.rename(e.path, claimed)
+					except FileNotFoundError:
+						continue
+					os.utime(claimed)
+					self.Held[e.name] = claimed
+					ret.append([e.name, readJSON(claimed)["units"]])
+					if len(ret) >= n:
+						return ret
+		return ret
+
+	def complete(self, item, rows):
+		# Records rows of [summary file name, row] for item and releases claim (items with lost claims are left to their new owner)
+		if self.lost(item):
+			return
+		writeJSON(self.Done + item, {"rows": rows, "owner": self.Owner, "time": time()})
+		if item in self.Held.keys():
+			try:
+				os.remove(self.Held.pop(item))
+			except FileNotFoundError:
+				pass
+
+	def remaining(self):
+		# Returns True if any item is waiting or claimed
+		for b in glob(self.Todo + "*/"):
+			with os.scandir(b) as entries:
+				for e in entries:
+					if not e.name.endswith(".tmp"):
+						return True
+		with os.scandir(self.Claimed) as entries:
+			for e in entries:
+				return True
+		return False
+
+	def merge(self, sinks):
+		# Adds rows of done items to summary files given as ResultSinks (rows already present are skipped)
+		ret = 0
+		with self.lock():
+			out = {}
+			for k, v in sinks.items():
+				out[k] = ResultSink(v.Outfile, v.Header, keys = v.Keys)
+			with os.scandir(self.Done) as entries:
+				done = [e for e in entries if not e.name.endswith(".tmp")]
+			for e in done:
+				for name, row in readJSON(e.path)["rows"]:
+					s = out[name]
+					if not s.has(*s.key(row)):
+						s.add(row)
+						ret += 1
+			for i in out.values():
+				i.close()
+			for e in done:
+				os.replace(e.path, self.Merged + e.name)
+		return ret
+
+	def status(self):
+		# Returns counts of items in each state
+		ret = {"todo": 0}
+		for b in glob(self.Todo + "*/"):
+			ret["todo"] += len([i for i in os.listdir(b) if not i.endswith(".tmp")])
+		for k, v in [["claimed", self.Claimed], ["done", self.Done], ["merged", self.Merged], ["failed", self.Failed]]:
+			ret[k] = len([i for i in os.listdir(v) if not i.endswith(".tmp")])
+		return ret
+
+def runUnit(func, unit):
+	# Returns item and name of unit with result of func (or None if the claim of its item was lost before it started)
+	item, name, arg, claimed, lock = unit
+	with lock:
+		# The new owner of a lost item waits here until the unit is no longer running
+		if not os.path.isfile(claimed):
+			return item, name, None
+		return item, name, func(arg)
+
+def drain(queue, units, func, pool, workers, rows, sinks, poll = 30, wait = True):
+	# Yields results of units in items claimed by this invocation until the queue is empty (or nothing is left to claim if wait is False),
+	# then merges rows of every done item into sinks
+	# units(name) returns argument of func for unit (None if it is already in the summary), and rows(result) returns list of [summary file name, row]
+	# Another item is claimed whenever fewer than workers units are running so the pool never waits for a whole batch
+	finished = SimpleQueue()
+	running = 0
+	counts = {}
+	out = {}
+	queue.start()
+	try:
+		while True:
+			while running < workers:
+				items = queue.claim(1)
+				if not items:
+					break
+				for item, names in items:
+					todo = []
+					for i in names:
+						unit = units(i)
+						if unit is not None:
+							todo.append([item, i, unit, queue.Held[item], queue.unitLock(i)])
+					if not todo:
+						queue.complete(item, [])
+						continue
+					counts[item] = len(todo)
+					out[item] = []
+					for i in todo:
+						pool.apply_async(runUnit, (func, i), callback = finished.put, error_callback = finished.put)
+						running += 1
+			if running == 0:
+				if wait == False or not queue.remaining():
+					break
+				# Wait for other workers (or for their claims to expire)
+				sleep(poll)
+				continue
+			res = finished.get()
+			running -= 1
+			if isinstance(res, BaseException):
+				raise res
+			item, _, x = res
+			counts[item] -= 1
+			if x is None:
+				# Unit was skipped since its claim was taken by another worker
+				queue.lose(item)
+			if queue.lost(item):
+				# The new owner of the item records its rows
+				continue
+			out[item].extend(rows(x))
+			if counts[item] == 0:
+				queue.complete(item, out.pop(item))
+			yield x
+	except BaseException:
+		# Unfinished items are returned to the queue before rows of finished items are merged
+		queue.stop()
+		for item in list(out.keys()):
+			queue.release(item)
+		raise
+	finally:
+		queue.stop()
+		n = queue.merge(sinks)
+		print(("\tMerged {:,d} new rows from the work queue.").format(n), flush = True)
+	failed = queue.status()["failed"]
+	if failed > 0:
+		print(("\t[Warning] {:,d} queue items expired too many times and were moved to {}.").format(failed, queue.Failed), file=stderr)
+
+def main():
+	parser = ArgumentParser("This script prints the status of a shared work queue.")
+	parser.add_argument("-q", help = "Path to queue directory.")
+	args = parser.parse_args()
+	if not args.q or not os.path.isdir(args.q):
+		print("\n\t[Error] Please specify a queue directory. Exiting.\n", file=stderr)
+		quit()
+	queue = WorkQueue(args.q)
+	for k, v in queue.status().items():
+		print(("\t{}\t{:,d}").format(k, v))
+
+if __name__ == "__main__":
+	main()
@@ -1,31 +1,150 @@
-'''This script will check the output logs from mutect2parallel to identify 
+'''This script will check the output logs from mutect2parallel to identify
 any samples which were not successful'''
 
+import os
+import json
+import sqlite3
 from argparse import ArgumentParser
-from glob import glob
-from unixpath import checkDir, getParent
-
-def identifyFails(outdir):
-	# Searches mutect logs to identify samples which did not complete successfully
-	paths = glob(outdir + "*/mutectLog.txt")
-	for i in paths:
-		# Isolate sample names
-		with open(i, "r") as f:
-			lines = f.readlines()
-		for j in lines[-2:]:
-			# Check last two lines
-			if "complete" not in j:
-				sample = getParent(i)
-				j = j.strip()
-				print(("{}\t{}").format(sample, j))
+from multiprocessing.pool import ThreadPool
+from sys import stderr
+from unixpath import checkDir
+
+FIELDS = ["pair", "sample", "name", "step", "status", "output"]
+
+def queryState(db):
+	# Returns most recent status of each sample which is not complete from state database
+	conn = sqlite3.connect(db, timeout = 300)
+	try:
+		rows = conn.execute("SELECT pair, sample, name, step, status, output FROM status \
+WHERE status != 'complete' ORDER BY pair, sample").fetchall()
+	finally:
+		conn.close()
+	return [dict(zip(FIELDS, [str(j) for j in i])) for i in rows]
+
+def tailLines(infile, n = 2, block = 4096):
+	# Returns last n lines of file by reading blocks backwards from the end
+	with open(infile, "rb") as f:
+		f.seek(0, os.SEEK_END)
+		end = f.tell()
+		pos = end
+		data = b""
+		while pos > 0 and data.count(b"\n") <= n:
+			size = min(block, pos)
+			pos -= size
+			f.seek(pos)
+			data = f.read(size) + data
+	return [i.decode() for i in data.splitlines()[-n:]]
+
+def statLog(path):
+	# Returns log path with size and modification time (None if it is missing)
+	infile = path + "mutectLog.txt"
+	try:
+		st = os.stat(infile)
+	except OSError:
+		return infile, None
+	return infile, [st.st_size, st.st_mtime_ns]
+
+def checkLog(infile):
+	# Returns records for the last two lines of log which are not complete
+	ret = []
+	sample = os.path.basename(os.path.dirname(infile))
+	for j in tailLines(infile):
+		# Check last two lines
+		if "complete" not in j:
+			ret.append(dict(zip(FIELDS, [sample] + j.strip().split("\t"))))
+	return ret
+
+class LogIndex():
+	# Stores size, modification time, and failed lines of each log so only changed logs are read again
+	def __init__(self, outdir, threads = 8):
+		self.Outdir = outdir
+		self.Path = outdir + "logIndex.json"
+		self.Threads = threads
+		self.Logs = {}
+		self.Changed = 0
+		if os.path.isfile(self.Path):
+			try:
+				with open(self.Path, "r") as f:
+					self.Logs = json.load(f)
+			except ValueError:
+				print("\t[Warning] Could not read log index. Rebuilding.", file=stderr)
+
+	def __save__(self):
+		# Writes index atomically
+		tmp = ("{}.{}.tmp").format(self.Path, os.getpid())
+		try:
+			with open(tmp, "w") as out:
+				json.dump(self.Logs, out)
+			os.replace(tmp, self.Path)
+		except OSError:
+			print(("\t[Warning] Could not write log index {}.").format(self.Path), file=stderr)
+
+	def update(self):
+		# Stats every log in parallel and reads the tail of new or changed logs
+		dirs = [e.path + "/" for e in os.scandir(self.Outdir) if e.is_dir()]
+		pool = ThreadPool(processes = self.Threads)
+		stats = pool.map(statLog, dirs)
+		logs = {}
+		changed = []
+		for infile, st in stats:
+			if st is not None:
+				if infile in self.Logs.keys() and self.Logs[infile]["stat"] == st:
+					logs[infile] = self.Logs[infile]
+				else:
+					logs[infile] = {"stat": st}
+					changed.append(infile)
+		for infile, fails in zip(changed, pool.map(checkLog, changed)):
+			logs[infile]["fails"] = fails
+		pool.close()
+		pool.join()
+		self.Changed = len(changed)
+		# Logs which have been removed are dropped
+		self.Logs = logs
+		self.__save__()
+
+	def fails(self):
+		# Returns failed records in sample order
+		ret = []
+		for k in sorted(self.Logs.keys()):
+			ret.extend(self.Logs[k]["fails"])
+		return ret
+
+def writeRecords(records, fmt, checked = None, changed = None):
+	# Prints records as text, json, or tsv
+	if fmt == "json":
+		summary = {"failed": len(set([i["pair"] for i in records])), "records": records}
+		if checked is not None:
+			summary["checked"] = checked
+			summary["changed"] = changed
+		print(json.dumps(summary, indent = 1))
+	else:
+		if fmt == "tsv":
+			print("\t".join(FIELDS))
+		for i in records:
+			print("\t".join([i.get(k, "") for k in FIELDS]))
 
 def main():
 	parser = ArgumentParser("This script will check the output logs from \
 mutect2parallel to identify any samples which were not successful.")
+	parser.add_argument("--logs", action = "store_true", default = False,
+help = "Read mutectLog.txt files even if a state database is present.")
+	parser.add_argument("--json", action = "store_true", default = False, help = "Print summary as json.")
+	parser.add_argument("--tsv", action = "store_true", default = False, help = "Print failures as tsv with a header.")
+	parser.add_argument("-t", type = int, default = 8, help = "Number of threads used to check logs.")
 	parser.add_argument("outdir", help = "Path to output directory of mutect2 parallel.")
 	args = parser.parse_args()
 	outdir = checkDir(args.outdir)
-	identifyFails(outdir)
+	fmt = "text"
+	if args.json == True:
+		fmt = "json"
+	elif args.tsv == True:
+		fmt = "tsv"
+	if args.logs == False and os.path.isfile(outdir + "runState.db"):
+		writeRecords(queryState(outdir + "runState.db"), fmt)
+	else:
+		index = LogIndex(outdir, args.t)
+		index.update()
+		writeRecords(index.fails(), fmt, len(index.Logs), index.Changed)
 
 if __name__ == "__main__":
 	main()
@@ -6,42 +6,25 @@ import os
 import pandas as pd
 import unixpath
 
-class Variant():
+KEYS = ["Patient", "Shared", "Chr", "Start", "End", "REF", "ALT"]
+# Sheet name and output file for each variant set
+SHEETS = {"ampliseq": ["Table 3S_SNVs validation", "ampliseqVariants.csv"],
+	"stringent": ["Table 4S_S_ list varinats (SNVs", "stringentVariants.csv"],
+	"relaxed": ["Table 5S_R_ list variants(SNVs)", "relaxedVariants.csv"]}
 
-	def __init__(self, line):
-		self.patient = self.__setPatient__(line["Patient"])
-		self.shared	= line["Shared"]
-		self.chr = line["Chr"]
-		self.start = line["Start"]
-		self.end = line["End"]
-		self.ref = line["REF"]
-		self.alt = line["ALT"]
+def setPatient(name):
+	# Formats patient name to be equivalent to variants summary file
+	# Remove initial dash and replace second with underscore
+	name = name[name.index("D"):]
+	name = name.replace("DCIS-", "DCIS")
+	return name.replace("-", "_")
 
-	def __setPatient__(self, name):
-		# Formats patient name to be equivalent to variants summary file
-		# Remove initial dash and replace second with underscore
-		name = name[name.index("D"):]
-		name = name.replace("DCIS-", "DCIS")
-		return name.replace("-", "_")
-
-	def equals(self, line):
-		# Returns true if line cantains same variant
-		ret = True
-		if self.patient != line["Patient"]:
-			ret = False
-		elif self.shared != line["Shared"]:
-			ret = False
-		elif self.chr != line["Chr"]:
-			ret = False
-		elif self.start != line["Start"]:
-			ret = False
-		elif self.end != line["End"]:
-			ret = False
-		elif self.ref != line["REF"]:
-			ret = False
-		elif self.alt != line["ALT"]:
-			ret = False
-		return ret
+def normalize(df):
+	# Returns list of key tuples with values as stripped strings (so 1, 1.0, and "1" are equal)
+	cols = []
+	for k in KEYS:
+		cols.append(df[k].astype(str).str.strip().str.replace(r"\.0$", "", regex = True))
+	return list(zip(*cols))
 
 class VariantsFilter():
 
@@ -49,56 +32,54 @@ class VariantsFilter():
 		unixpath.checkFile(args.i)
 		unixpath.checkFile(args.v)
 		self.infile = args.i
-		self.outfile = ""
-		self.variants = []
+		self.chunksize = args.chunksize
+		self.outfiles = {}
+		self.variants = {}
 		self.xlsx = args.v
 		self.__readVariants__(args)
 
 	def __readVariants__(self, args):
-		# Loads variants from xlsx file
+		# Loads sets of variant keys from each requested sheet of xlsx file
 		print("\n\tReading confirmed variants...")
 		outdir = os.path.split(self.infile)[0]
-		if args.ampliseq:
-			sheet = "Table 3S_SNVs validation"
-			name = "ampliseqVariants.csv"
-		elif args.stringent:
-			sheet = "Table 4S_S_ list varinats (SNVs"
-			name = "relaxedVariants.csv"
-		elif args.relaxed:
-			sheet = "Table 5S_R_ list variants(SNVs)"
-			name = "stringentVariants.csv"
-		# Store outfile name
-		self.outfile = os.path.join(outdir, name)
-		wb = pd.read_excel(args.v, sheet)
-		for _, i in wb.iterrows():
-			self.variants.append(Variant(i))
+		names = [i for i in SHEETS.keys() if getattr(args, i) == True]
+		if not names:
+			# Filter every sheet in one pass
+			names = list(SHEETS.keys())
+		wb = pd.read_excel(args.v, [SHEETS[i][0] for i in names])
+		for i in names:
+			sheet = wb[SHEETS[i][0]].dropna(subset = ["Patient"]).copy()
+			sheet["Patient"] = sheet["Patient"].astype(str).apply(setPatient)
+			self.variants[i] = set(normalize(sheet))
+			self.outfiles[i] = os.path.join(outdir, SHEETS[i][1])
 
 	def filterVariants(self):
-		# Filters variants in infile
+		# Filters variants in infile by matching keys against each variant set
 		print("\tFiltering input variants...")
-		df = pd.read_csv(self.infile, sep = ",", header = 0)
-		for idx, i in df.iterrows():
-			if len(i["REF"]) != 1 or i["REF"] == "-":
-				df = df.drop(index = idx)
-			else:
-				match = False
-				for v in self.variants:
-					if v.equals(i):
-						match = True
-						break
-				if not match:
-					df = df.drop(index = idx)
-		df.to_csv(self.outfile)
-		print(("\tIdentified {} variants.").format(df.shape[0]))
+		first = True
+		total = dict([(i, 0) for i in self.variants.keys()])
+		for df in pd.read_csv(self.infile, sep = ",", header = 0, chunksize = self.chunksize):
+			ref = df["REF"].astype(str)
+			df = df[(ref.str.len() == 1) & (ref != "-")]
+			keys = normalize(df)
+			for i in self.variants.keys():
+				# Boolean series so an empty chunk selects no rows instead of no columns
+				match = df[pd.Series([k in self.variants[i] for k in keys], index = df.index, dtype = bool)]
+				match.to_csv(self.outfiles[i], mode = "w" if first else "a", header = first)
+				total[i] += match.shape[0]
+			first = False
+		for i in self.variants.keys():
+			print(("\tIdentified {} {} variants.").format(total[i], i))
 
 def main():
 	start = datetime.now()
 	parser = ArgumentParser("Filters previous output to reflect only current target variants.")
 	parser.add_argument("--ampliseq", action = "store_true", default = False, help = "Filter ampliseq variants.")
+	parser.add_argument("--chunksize", type = int, default = 100000, help = "Number of rows of input csv to read at once.")
 	parser.add_argument("-i", help = "Path to mutect2 variants csv.")
 	parser.add_argument("--relaxed", action = "store_true", default = False, help = "Filter relaxed variants.")
 	parser.add_argument("--stringent", action = "store_true", default = False, help = "Filter stringent variants.")
-	parser.add_argument("-v", help = "Path to xlsx file of approved variants.")
+	parser.add_argument("-v", help = "Path to xlsx file of approved variants (all sheets are filtered if no sheet is given).")
 	f = VariantsFilter(parser.parse_args())
 	f.filterVariants()
 	print(("\tTotal runtime: {}\n").format(datetime.now() - start))
@@ -7,55 +7,35 @@ from argparse import ArgumentParser
 from sys import stderr
 from unixpath import *
 from plotFunctions import *
+from summaryCache import SummaryTable
 
-def mergeSums(m, p):
-	# Returns paired lists of values such that each equivalent value has the same index
+VALUES = ["s", "a", "b", "c"]
+
+def mergeSums(m, p, vals):
+	# Returns arrays of paired values for each code such that each equivalent value has the same column
 	x = []
 	y = []
-	for i in m.keys():
-		if i in p.keys():
-			x.append(m[i])
-			y.append(p[i])
-	return [x, y]
-
-def getOutputSummary(val, infile, percent = True):
-	# Retuns dict of target values
-	first = True
-	sim = {}
-	with open(infile, "r") as f:
-		for line in f:
-			if first == False:
-				s = line.strip().split(",")
-				if len(s) > c.Max:
-					i = s[c.ID]
-					idx = i.find("_")
-					if idx == 2 or idx == 3:
-						# Trim preceding number
-						i = i[idx+1:]
-					if val == "s":
-						if percent == True:
-							n = float(s[c.Similarity].strip("%"))/100
-						else:
-							n = float(s[c.Similarity])
-					elif val == "a":
-						n = int(s[c.A])
-					elif val == "b":
-						n = int(s[c.B])
-					elif val == "c":
-						n = int(s[c.Common])
-					# {id: n}
-					sim[i] = n
-			else:
-				c = Columns(line.split(","))
-				first = False
-	return sim
+	pids = set(p.Columns["ID"].tolist())
+	ids = list(dict.fromkeys([i for i in m.Columns["ID"].tolist() if i in pids]))
+	for v in vals:
+		mv = m.values(v)
+		pv = p.values(v)
+		x.append([mv[i] for i in ids])
+		y.append([pv[i] for i in ids])
+	return [np.array(x, dtype = np.float64), np.array(y, dtype = np.float64)]
 
-def getSummaries(val, mutect, platypus):
-	# Returns list of paired values to plot
+def getSummaries(vals, mutect, platypus):
+	# Returns arrays of paired values to plot (summaries are read from cache when possible)
 	print("\n\tReading input files...")
-	m = getOutputSummary(val, mutect, True)
-	p = getOutputSummary(val, platypus, False)
-	return mergeSums(m, p)
+	m = SummaryTable(mutect)
+	p = SummaryTable(platypus)
+	return mergeSums(m, p, vals)
+
+def outputName(outfile, val, vals):
+	# Returns output file name for given value code
+	if len(vals) == 1:
+		return outfile
+	return outfile.replace(".svg", ("_{}.svg").format(val))
 
 def checkArgs(args):
 	# Checks for errors and returns output file name
@@ -74,13 +54,12 @@ def checkArgs(args):
 		# Write output to same directory
 		args.o = args.m.replace(".csv", ".svg")
 	args.v = args.v.lower()
-	good = False
-	for i in ["s", "a", "b", "c"]:
-		if args.v == i:
-			good = True
-			break
-	if good == False:
-		print("\n\t[Error] Please enter one of s, a, b, c for -v. Exiting.\n", file = stderr)
+	if args.v == "all":
+		args.v = VALUES
+	elif args.v in VALUES:
+		args.v = [args.v]
+	else:
+		print("\n\t[Error] Please enter one of s, a, b, c, or all for -v. Exiting.\n", file = stderr)
 		quit()
 	return args
 
@@ -89,15 +68,17 @@ def main():
 	parser = ArgumentParser("This script will make an svg scatter plot of the \
 percent of similar variants between platypus and mutect2.")
 	parser.add_argument("-v", default = "s", help = "Code for values to plot. \
-Values include Percent similarity (default): s, private A: a, private b: b, common: c")
+Values include Percent similarity (default): s, private A: a, private b: b, common: c, or every value: all")
 	parser.add_argument("-m", help = "Path to mutect2 summary file.")
 	parser.add_argument("-p", help = "Path to platypus summary file.")
 	parser.add_argument("-o", 
-help = "Path to output svg (will be written to same directory by default).")
+help = "Path to output svg (will be written to same directory by default; the value code is appended to each name when using -v all).")
 	args = parser.parse_args()
 	args = checkArgs(args)
-	points = getSummaries(args.v, args.m, args.p)
-	plotSimilarity(args.o, args.v, points)
+	x, y = getSummaries(args.v, args.m, args.p)
+	fits = regressions(x, y)
+	for idx, v in enumerate(args.v):
+		plotSimilarity(outputName(args.o, v, args.v), v, [x[idx], y[idx]], [i[idx] for i in fits])
 	print(("\tFinished. Runtime: {}\n").format(datetime.now()-start))
 
 if __name__ == "__main__":
@@ -1,5 +1,8 @@
 '''This script contains functions for ploting values from platypus and mutect2'''
 
+import matplotlib
+# Render without a display so plots can be made in batch jobs
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy import stats
@@ -57,22 +60,46 @@ def getLabels(val):
 		main += "Variants Common to A and B"
 	return main, xlab, ylab
 
-def plotSimilarity(outfile, val, points):
-	# Creates scatter plot and calculates regression and correlation
+def regressions(x, y):
+	# Returns slope, intercept, correlation, and p-value arrays for each row of x and y (missing values are ignored)
+	x = np.atleast_2d(np.asarray(x, dtype = np.float64))
+	y = np.atleast_2d(np.asarray(y, dtype = np.float64))
+	mask = ~np.isnan(x) & ~np.isnan(y)
+	n = mask.sum(axis = 1)
+	x = np.where(mask, x, 0.0)
+	y = np.where(mask, y, 0.0)
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		mx = x.sum(axis = 1)/n
+		my = y.sum(axis = 1)/n
+		dx = np.where(mask, x - mx[:, None], 0.0)
+		dy = np.where(mask, y - my[:, None], 0.0)
+		sxy = (dx*dy).sum(axis = 1)
+		sxx = (dx*dx).sum(axis = 1)
+		syy = (dy*dy).sum(axis = 1)
+		slope = sxy/sxx
+		intercept = my - slope*mx
+		r = np.clip(sxy/np.sqrt(sxx*syy), -1.0, 1.0)
+		t = r*np.sqrt((n - 2)/(1 - r*r))
+	p = 2*stats.t.sf(np.abs(t), n - 2)
+	return slope, intercept, r, p
+
+def plotSimilarity(outfile, val, points, fit):
+	# Creates scatter plot with precomputed regression and correlation
 	main, xlab, ylab = getLabels(val)
-	# Get regression function and linear correlation
-	reg = np.poly1d(np.polyfit(points[0], points[1], 1))
-	cor = stats.pearsonr(points[0], points[1])
-	txt = ("Correlation = {:.4f}\nP-Value = {:.4f}").format(cor[0], cor[1])
+	slope, intercept, cor, pval = fit
+	txt = ("Correlation = {:.4f}\nP-Value = {:.4f}").format(cor, pval)
 	fig, ax = plt.subplots()
-	ax.axis([-0.1, 1.1, -0.1, 1.1])
+	if val == "s":
+		ax.axis([-0.1, 1.1, -0.1, 1.1])
 	# Set labels
 	ax.set_title(main)
 	ax.set_xlabel(xlab)
 	ax.set_ylabel(ylab)
 	# Plot points, regression, and correlation
-	ax.scatter(points[0], points[1])
-	ax.plot(reg(points[0]))
+	x = np.asarray(points[0], dtype = np.float64)
+	ax.scatter(x, points[1])
+	line = np.array([np.nanmin(x), np.nanmax(x)]) if len(x) > 0 else np.array([])
+	ax.plot(line, slope*line + intercept)
 	ax.text(0.75, 0.1, txt, ha="center", va="center", transform=ax.transAxes)
 	fig.savefig(outfile)
-
+	plt.close(fig)
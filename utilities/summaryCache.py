@@ -0,0 +1,114 @@
+'''This script defines a cached columnar table of summary csv values which is updated as rows are appended'''
+
+import os
+import numpy as np
+from sys import stderr
+from plotFunctions import Columns
+
+# Bytes before the cached offset used to detect rewritten files
+TAIL = 64
+
+def trimID(i):
+	# Removes preceding number from sample ID
+	idx = i.find("_")
+	if idx == 2 or idx == 3:
+		i = i[idx+1:]
+	return i
+
+def toFloat(val):
+	# Returns value as float with percentages converted to fractions (nan if it is missing)
+	val = val.strip()
+	try:
+		if val.endswith("%"):
+			return float(val.strip("%"))/100
+		return float(val)
+	except ValueError:
+		return np.nan
+
+class SummaryTable():
+	# Stores ID, private A, private B, common, and similarity columns from a summary csv in a cached npz file
+	def __init__(self, infile):
+		self.Infile = infile
+		self.Cache = infile + ".npz"
+		self.Header = ""
+		self.Offset = 0
+		self.Tail = b""
+		self.Columns = {"ID": np.array([], dtype = str)}
+		for i in ["a", "b", "c", "s"]:
+			self.Columns[i] = np.array([], dtype = np.float64)
+		self.__load__()
+		self.__update__()
+
+	def __load__(self):
+		# Reads cached columns if the csv has only been appended to since they were stored
+		if not os.path.isfile(self.Cache):
+			return
+		try:
+			with np.load(self.Cache) as data:
+				header = str(data["header"])
+				offset = int(data["offset"])
+				tail = data["tail"].tobytes()
+				columns = dict([(k, data[k]) for k in self.Columns.keys()])
+		except (OSError, KeyError, ValueError):
+			return
+		with open(self.Infile, "rb") as f:
+			if f.readline().decode() != header or os.path.getsize(self.Infile) < offset:
+				return
+			f.seek(max(0, offset - TAIL))
+			if f.read(offset - max(0, offset - TAIL)) != tail:
+				return
+		self.Header = header
+		self.Offset = offset
+		self.Tail = tail
+		self.Columns = columns
+
+	def __parse__(self, lines):
+		# Returns dict of new column values
+		c = Columns(self.Header.split(","))
+		cols = {"ID": [], "a": [], "b": [], "c": [], "s": []}
+		idx = {"a": c.A, "b": c.B, "c": c.Common, "s": c.Similarity}
+		for line in lines:
+			s = line.strip().split(",")
+			if len(s) > c.Max:
+				cols["ID"].append(trimID(s[c.ID]))
+				for k, v in idx.items():
+					cols[k].append(toFloat(s[v]) if v is not None else np.nan)
+		return cols
+
+	def __update__(self):
+		# Parses complete rows appended after cached offset and stores new cache
+		with open(self.Infile, "rb") as f:
+			if self.Offset == 0:
+				self.Header = f.readline().decode()
+				self.Offset = f.tell()
+			f.seek(self.Offset)
+			data = f.read()
+		end = data.rfind(b"\n") + 1
+		if end == 0:
+			return
+		cols = self.__parse__(data[:end].decode().splitlines())
+		self.Offset += end
+		with open(self.Infile, "rb") as f:
+			f.seek(max(0, self.Offset - TAIL))
+			self.Tail = f.read(self.Offset - max(0, self.Offset - TAIL))
+		self.Columns["ID"] = np.concatenate([self.Columns["ID"], np.array(cols["ID"], dtype = str)])
+		for k in ["a", "b", "c", "s"]:
+			self.Columns[k] = np.concatenate([self.Columns[k], np.array(cols[k], dtype = np.float64)])
+		self.__save__()
+
+	def __save__(self):
+		# Writes columns to cache file
+		tmp = ("{}.{}.tmp").format(self.Cache, os.getpid())
+		try:
+			with open(tmp, "wb") as out:
+				np.savez(out, header = np.array(self.Header), offset = np.array(self.Offset),
+					tail = np.frombuffer(self.Tail, dtype = np.uint8), **self.Columns)
+			os.replace(tmp, self.Cache)
+		except OSError:
+			print(("\t[Warning] Could not write summary cache {}.").format(self.Cache), file=stderr)
+			if os.path.isfile(tmp):
+				os.remove(tmp)
+
+	def values(self, val):
+		# Returns dict of ID: value for given column (later rows replace earlier ones)
+		return dict(zip(self.Columns["ID"].tolist(), self.Columns[val].tolist()))